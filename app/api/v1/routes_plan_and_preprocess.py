@@ -3,13 +3,11 @@ from pydantic import BaseModel
 import os
 from pathlib import Path
 import json
-from redis import Redis
-from rq import Queue
-from rq.job import Job
 import logging
 
 from app.core.nnunet_plan_and_preprocess import plan_and_preprocess_slurm, plan_and_preprocess_sh
 from app.core.config import settings
+from app.core import job_executor
 from app.core.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -27,10 +25,6 @@ Path(nnunet_results_dir).mkdir(parents=True, exist_ok=True)
 
 logger.info(f"nnunet_data_dir={nnunet_preprocessed_dir}")
 
-# Redis connection and RQ queue
-redis_conn = Redis(host="localhost", port=6379)
-queue = Queue(connection=redis_conn)
-
 # FastAPI router
 router = APIRouter()
 
@@ -41,7 +35,7 @@ class PlanAndPreprocessTaskRequest(BaseModel):
 
 
 def run_plan_and_preprocess_sh_rq(dataset_num: int, planner: str, verify_dataset_integrity: bool):
-    """Function that will be executed by RQ worker."""
+    """Function that will be executed by the job executor (RQ worker or local pool)."""
     try:
         logger.info(f"RQ Worker: RUNNING plan_and_preprocess_sh() for dataset {dataset_num}")
         plan_and_preprocess_sh(dataset_num, planner, verify_dataset_integrity)
@@ -63,12 +57,12 @@ async def plan_and_preprocess(request: PlanAndPreprocessTaskRequest):
 
     if settings.JOB_PROCESSOR == "slurm":
         logger.info("RUNNING... plan_and_preprocess_slurm()")
-        plan_and_preprocess_slurm(dataset_num, planner, verify_dataset_integrity)
+        slurm_job_id = plan_and_preprocess_slurm(dataset_num, planner, verify_dataset_integrity)
         message = "Plan and preprocess task (SLURM) submitted successfully"
-        return {"message": message}
+        return {"message": message, "slurm_job_id": slurm_job_id}
     
-    # Enqueue the SH job to RQ
-    job = queue.enqueue(
+    # Enqueue the SH job (RQ "default" queue, or the local pool)
+    job_id = job_executor.get_executor().enqueue(
         run_plan_and_preprocess_sh_rq,
         dataset_num,
         planner,
@@ -76,15 +70,17 @@ async def plan_and_preprocess(request: PlanAndPreprocessTaskRequest):
         job_timeout=172800  # 2 days in seconds
     )
 
-    logger.info(f"Enqueued plan_and_preprocess_sh() with job_id={job.id}")
-    return {"message": "Plan and preprocess task (SH) enqueued successfully", "job_id": job.id}
+    logger.info(f"Enqueued plan_and_preprocess_sh() with job_id={job_id}")
+    return {"message": "Plan and preprocess task (SH) enqueued successfully", "job_id": job_id}
 
 
 @router.get("/plan-and-preprocess/status/{job_id}")
 async def get_job_status(job_id: str):
-    """Check RQ job status."""
+    """Check job status."""
     try:
-        job = Job.fetch(job_id, connection=redis_conn)
-        return {"job_id": job.id, "status": job.get_status(), "result": job.result}
+        job = job_executor.get_executor().fetch(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return {"job_id": job["id"], "status": job["status"], "result": job["result"]}
     except Exception as e:
         return {"error": f"Job {job_id} not found or failed: {str(e)}"}
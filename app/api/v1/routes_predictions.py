@@ -1,13 +1,11 @@
 from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form, Query
+from fastapi.responses import Response, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
-import os, re, json, shutil, zipfile
+import os, re, json, time, shutil, zipfile
 from datetime import datetime
 from json import JSONDecodeError
 from pathlib import Path
-from app.core.nnunet_worker import run_nnunet_predict
-
-from rq import Queue
-import redis
+from app.core import job_executor, prediction_admission, prediction_events, prediction_webhooks, prediction_stats, prediction_scheduler, prediction_cache, prediction_index, prediction_progress, prediction_cancel, prediction_tiers, nnunet_worker
 
 router = APIRouter()
 
@@ -36,13 +34,15 @@ Path(nnunet_predictions_dir).mkdir(parents=True, exist_ok=True)
 logger.info(f"nnunet_data_dir={nnunet_data_dir}")
 logger.info(f"nnunet_predictions_dir={nnunet_predictions_dir}")
 
-queue_name = "nnunet_jobs"
-r = redis.Redis.from_url(settings.REDIS_URL)
-q = Queue(queue_name, connection=r)
-logger.info(f"Connected to Redis queue '{queue_name}' at {settings.REDIS_URL}")
+logger.info(f"Job processor: {settings.JOB_PROCESSOR}")
 
 # Core module
 import app.core.nnunet_raw as nnunet_raw
+from app.core.upload_tools import save_upload_file, UploadTooLargeError
+import app.core.http_cache as http_cache
+
+# ETag lifetime of GET /prediction for unfinished requests, whose queue ETA changes over time
+QUEUE_ETA_ETAG_SEC = 5
 
 def log_request(request: Request):
     if request:
@@ -63,12 +63,19 @@ def create_unique_request_dir(dataset_path: str) -> str:
     return req_dir
 
     
-async def get_file_ending(dataset_id):
+async def get_dataset_info(dataset_id):
+    """The dataset's dataset.json, from the nnunet_raw cache while the file is unchanged."""
     try:
         dataset_info = await nnunet_raw.read_dataset_json(dirname=dataset_id)
     except Exception as e:
         log_exception(e)
         raise HTTPException(status_code=500, detail=f"Failed to read dataset.json: {str(e)}")
+    if dataset_info is None:
+        raise HTTPException(status_code=500, detail=f"Failed to read dataset.json of {dataset_id}")
+    return dataset_info
+
+async def get_file_ending(dataset_id, dataset_info=None):
+    dataset_info = dataset_info or await get_dataset_info(dataset_id)
 
     if "file_ending" not in dataset_info:
         logger.error(f"nnunet_raw: dataset.json for {dataset_id} missing 'file_ending'")
@@ -76,12 +83,8 @@ async def get_file_ending(dataset_id):
 
     return dataset_info["file_ending"]
 
-async def get_input_channel_names(dataset_id):
-    try:
-        dataset_info = await nnunet_raw.read_dataset_json(dirname=dataset_id)
-    except Exception as e:
-        log_exception(e)
-        raise HTTPException(status_code=500, detail=f"Failed to read dataset.json: {str(e)}")
+async def get_input_channel_names(dataset_id, dataset_info=None):
+    dataset_info = dataset_info or await get_dataset_info(dataset_id)
 
     if "channel_names" not in dataset_info:
         logger.warning(f"nnunet_raw: dataset.json for {dataset_id} missing 'channel_names'")
@@ -90,73 +93,89 @@ async def get_input_channel_names(dataset_id):
     return list(dataset_info["channel_names"].values())
     
 @router.get("/predictions")
-async def get_predictions_list(dataset_id: str, request: Request):
+async def get_predictions_list(
+    dataset_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int | None = Query(None, ge=1),
+    sort: str = Query("req_id"),
+    order: str = Query("asc"),
+    requester_id: str | None = Query(None),
+    image_id: str | None = Query(None),
+    date_from: str | None = Query(None),
+    date_to: str | None = Query(None),
+    completed: bool | None = Query(None),
+):
     
     log_request(request)
     logger.info(f"GET /predictions called with dataset_id={dataset_id}")
 
-    results = []
-
     dataset_path = os.path.join(nnunet_predictions_dir, dataset_id)
 
     if not os.path.exists(dataset_path):
         logger.warning(f"Predictions folder for dataset '{dataset_id}' not found at: {dataset_path}")
-        return results
+        return []
 
     # file_ending (.mha)
     file_ending = await get_file_ending(dataset_id)
-    
-    for entry in sorted(os.listdir(dataset_path)):
-        req_dir = os.path.join(dataset_path, entry)
-        if not os.path.isdir(req_dir) or not entry.startswith("req_"):
-            logger.debug(f"Skipping non-request directory: {req_dir}")
-            continue
 
-        item = {"req_id": entry}
+    # import the request folders once, then only re-check requests still in flight
+    if not await run_in_threadpool(prediction_index.is_dataset_indexed, dataset_id):
+        await run_in_threadpool(prediction_index.index_dataset_from_disk, dataset_id, dataset_path, file_ending)
+    await run_in_threadpool(prediction_index.reconcile_in_flight, dataset_id, dataset_path, file_ending)
 
-        # Load req.json
-        req_json_path = os.path.join(req_dir, "req.json")
-        if os.path.exists(req_json_path):
-            try:
-                with open(req_json_path, "r") as f:
-                    item["req_info"] = json.load(f)
-            except (JSONDecodeError, OSError) as e:
-                log_exception(e)
-                item["req_info"] = {}
-                continue
-        else:
-            logger.warning(f"Missing req.json in {entry}")
-            item["req_info"] = {}
-            continue
-
-        # List input images
-        item["input_images"] = sorted([
-            fname for fname in os.listdir(req_dir)
-            if fname.startswith("image_") and fname.endswith(file_ending)
-        ])
-
-        # Check for outputs
-        expected_output_label_images = [f'image_{fname.split("_")[1]}{file_ending}' for fname in item["input_images"]]
-        completed = True
-        outputs_dir = os.path.join(req_dir, "outputs")
-        output_labels = []
-        for expected_output_label in expected_output_label_images:
-            output_label_path = os.path.join(outputs_dir, expected_output_label)
-            if not os.path.exists(output_label_path):
-                completed = False
-                break
-            else:
-                output_labels.append(expected_output_label)
-
-        item["completed"] = completed
-        item["output_labels"] = sorted(output_labels)
-
-        results.append(item)
-
-    return results
+    try:
+        return await run_in_threadpool(
+            prediction_index.list_requests,
+            dataset_id,
+            offset=offset,
+            limit=limit,
+            sort=sort,
+            order=order,
+            requester_id=requester_id,
+            image_id=image_id,
+            date_from=date_from,
+            date_to=date_to,
+            completed=completed,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/predictions/tiers")
+async def get_prediction_tiers(dataset_id: str = Query(...), request: Request = None):
+    """Latency tiers of the dataset (see app/core/prediction_tiers.py) and whether their models are trained."""
+    log_request(request)
+    logger.info(f"GET /predictions/tiers called with dataset_id={dataset_id}")
+    return {
+        "default": settings.PREDICTION_DEFAULT_TIER,
+        "tiers": await run_in_threadpool(prediction_tiers.list_tiers, dataset_id),
+    }
+
+
+@router.get("/predictions/stats")
+async def get_prediction_stats(
+    dataset_id: str = Query(None),
+    configuration: str = Query(None),
+    tier: str = Query(None),
+    since: str = Query(None, description="ISO timestamp; only predictions finished since then"),
+    limit: int = Query(10000, ge=1, le=100000, description="Latest predictions considered"),
+    request: Request = None,
+):
+    """
+    p50/p95/p99 latencies of finished predictions per dataset, configuration and
+    tier: total time, time queued, time per stage and per megavoxel of input
+    (see app/core/prediction_stats.py), plus the work currently queued per lane.
+    """
+    log_request(request)
+    logger.info(f"GET /predictions/stats called with dataset_id={dataset_id}, configuration={configuration}, tier={tier}, since={since}")
+    return {
+        "stats": await run_in_threadpool(prediction_stats.duration_stats, dataset_id, configuration, tier, since, limit),
+        "queued": await run_in_threadpool(prediction_admission.queued_work),
+    }
 
 @router.get("/prediction")
-async def get_prediction(dataset_id: str = Query(...), req_id: str = Query(...), request: Request = None):
+async def get_prediction(dataset_id: str = Query(...), req_id: str = Query(...), request: Request = None,
+                         response: Response = None):
     log_request(request)
     logger.info(f"GET /prediction called with dataset_id={dataset_id}, req_id={req_id}")
 
@@ -169,6 +188,19 @@ async def get_prediction(dataset_id: str = Query(...), req_id: str = Query(...),
     if not os.path.isdir(req_dir):
         raise HTTPException(status_code=404, detail=f"Request directory not found: {req_dir}")
 
+    # Everything below derives from these files; new inputs and outputs change their folder's mtime.
+    # The queue ETA of an unfinished request changes on its own, so its ETag expires with time.
+    outputs_dir = os.path.join(req_dir, "outputs")
+    state = prediction_progress.read_state(req_dir) or {}
+    etag_paths = [req_dir, os.path.join(req_dir, "req.json"), outputs_dir,
+                  os.path.join(outputs_dir, "summary.json"), os.path.join(outputs_dir, prediction_index.PROVISIONAL_FILE_NAME)]
+    eta_bucket = None if state.get("status") in FINISHED_STATUSES else int(time.time() // QUEUE_ETA_ETAG_SEC)
+    etag = http_cache.file_etag(etag_paths, json.dumps(state, sort_keys=True), eta_bucket)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if http_cache.is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
     item = {"req_id": req_id}
 
     # Load req.json
@@ -196,7 +228,6 @@ async def get_prediction(dataset_id: str = Query(...), req_id: str = Query(...),
 
     # Check outputs
     expected_output_label_images = [f'image_{fname.split("_")[1]}{file_ending}' for fname in item["input_images"]]
-    outputs_dir = os.path.join(req_dir, "outputs")
     output_labels = []
     completed = True
     for expected_output_label in expected_output_label_images:
@@ -206,14 +237,46 @@ async def get_prediction(dataset_id: str = Query(...), req_id: str = Query(...),
             break
         output_labels.append(expected_output_label)
 
-    item["completed"] = completed
+    item["completed"] = completed and prediction_index.outputs_finalized(outputs_dir)
     item["output_labels"] = sorted(output_labels)
+    # progressive requests: 'provisional' while only the quick first-pass segmentation is available
+    item["stage"] = prediction_index.output_stage(outputs_dir, item["completed"])
+
+    # queue position and ETA of an unfinished request
+    item["queue"] = None
+    if not item["completed"]:
+        if state.get("status") not in FINISHED_STATUSES:
+            try:
+                item["queue"] = await run_in_threadpool(
+                    prediction_stats.queue_eta, dataset_id, req_id, item["req_info"], state
+                )
+            except Exception as e:
+                logger.warning(f"Failed to estimate the ETA of {req_id}: {e}")
 
     logger.info(f"Returning item={item}")
 
     return item
 
 
+def reuse_cached_outputs(dataset_id: str, cached_req_dir: str, req: dict, job_metadata: dict,
+                         input_images: list[str], output_labels: list[str]):
+    """Complete a new request with the outputs of an identical earlier one (blocking file work)."""
+    req_dir = job_metadata["input_dir"]
+    cached_from = os.path.basename(cached_req_dir)
+    prediction_cache.link_outputs(cached_req_dir, req_dir)
+    nnunet_worker.write_summary(job_metadata, os.path.join(req_dir, "outputs"), cached_from=cached_from)
+
+    req["cached_from"] = cached_from
+    with open(os.path.join(req_dir, "req.json"), "w") as f:
+        json.dump(req, f, indent=4)
+
+    prediction_index.upsert_request(
+        dataset_id, req["req_id"], req, input_images,
+        status="completed", completed=True, output_labels=output_labels,
+    )
+    prediction_webhooks.notify(job_metadata, "completed", output_labels=output_labels, req_info=req)
+
+
 # image_id is saved and send it back to the requester. It's used to identify the image. In principle, the client should keep this information on their own, not giving this info to the server.
 @router.post("/predictions")
 async def post_prediction_request(
@@ -222,17 +285,51 @@ async def post_prediction_request(
     requester_id: str = Form(...),
     image_id: str = Form(...),
     image: UploadFile = File(...),
+    priority: str = Form(None),
+    tier: str = Form(None),
+    progressive: bool = Form(False),
 ):
     
     log_request(request)
     logger.info(
         f"POST /predictions called with dataset_id={dataset_id}, "
         f"requester_id={requester_id}, image_id={image_id}, "
-        f"filename={image.filename}"
+        f"filename={image.filename}, priority={priority}, tier={tier}, progressive={progressive}"
     )
 
+    try:
+        lane = prediction_scheduler.validate_lane(priority)
+        tier_settings = await run_in_threadpool(prediction_tiers.resolve_tier, dataset_id, tier)
+
+        # admission control: reject, or route to a cheaper tier, when the lane is backed up
+        admission = await run_in_threadpool(
+            prediction_admission.admit, dataset_id, lane, tier_settings, 1, tier is None
+        )
+        tier_settings = admission["tier_settings"]
+
+        provisional_settings = None
+        if progressive:
+            provisional_settings = await run_in_threadpool(
+                prediction_tiers.resolve_tier, dataset_id, settings.PREDICTION_PROVISIONAL_TIER
+            )
+            if {**provisional_settings, "tier": None} == {**tier_settings, "tier": None}:
+                provisional_settings = None  # nothing to refine
+    except prediction_admission.AdmissionRejected as e:
+        logger.warning(f"POST /predictions rejected ({e.status_code}): {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     form_data = await request.form()
 
+    # completion webhook, see app/core/prediction_webhooks.py
+    callback_url = form_data.get("callback_url")
+    if callback_url:
+        try:
+            prediction_webhooks.validate_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     dataset_path = os.path.join(nnunet_predictions_dir, dataset_id)
     logger.debug(f"dataset_path={dataset_path}")
 
@@ -251,24 +348,29 @@ async def post_prediction_request(
         # note: this end points supports single-channel & single image.
         image_path = os.path.join(req_dir, f'image_0_0000{file_ending}')
         logger.debug(f"Saving uploaded image to: {image_path}")
-        with open(image_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        upload = await save_upload_file(image, image_path, hash_algorithm="sha256")
 
         # Save request metadata
         req = {
             "requester_id": requester_id,
             "image_id_list": [image_id],
             "req_id": os.path.basename(req_dir),
-            "at": datetime.now().isoformat()
+            "at": datetime.now().isoformat(),
+            "priority": lane,
+            "tier": tier_settings["tier"],
+            "progressive": provisional_settings is not None,
+            # admission estimate, summed up over unfinished requests by later admissions
+            "estimated_sec": round(admission["estimated_sec"], 1),
         }
-        known_keys = {"dataset_id", "requester_id", "image_id"}
+        if admission["degraded_from"]:
+            req["degraded_from"] = admission["degraded_from"]
+        known_keys = {"dataset_id", "requester_id", "image_id", "priority", "tier", "progressive", "estimated_sec", "degraded_from"}
         for key, value in form_data.items():
             if key not in known_keys and isinstance(value, str):
                 req[key] = value
 
         req_path = os.path.join(req_dir, "req.json")
-        with open(req_path, "w") as f:
-            json.dump(req, f, indent=4)
+        await run_in_threadpool(_write_req_info, req_path, req)
 
         # --- Define the Job Metadata (Matching the Command) ---
 
@@ -294,39 +396,75 @@ async def post_prediction_request(
             # Corresponds to -i /path/to/input
             "input_dir": INPUT_PATH, 
             
-            # Corresponds to -c 3d_lowres
-            "configuration": "3d_lowres",
-            
             # Corresponds to -device gpu (If your worker uses this to set the device)
             "device": "gpu", 
-            
-            # Standard nnU-Net keys, usually defaults if not overridden
-            "trainer": "nnUNetTrainer", 
-            "plans": "nnUNetPlans",
-            "requester_id": "vtk_image_labeler_3d@varianEclipseTest",
+
+            # From the request's tier: configuration (-c), trainer (-tr), plans (-p),
+            # folds (-f), use_mirroring (--disable_tta), tile_step_size (-step_size)
+            **tier_settings,
+
+            # progressive request: settings of the quick provisional pass published first
+            "provisional": provisional_settings,
+
+            # fair-share scheduling within the priority lane is keyed by requester
+            "requester_id": requester_id,
+            "num_images": 1,
         }
 
 
+        # --- Result cache: reuse the outputs of an identical earlier submission ---
+        if settings.PREDICTION_CACHE_ENABLED:
+            key = await run_in_threadpool(prediction_cache.cache_key, upload["hash"], JOB_METADATA)
+            cached_req_dir = await run_in_threadpool(prediction_cache.lookup, dataset_path, key) if key else None
+            if cached_req_dir:
+                logger.info(f"Cache hit: {req['req_id']} reuses the outputs of {os.path.basename(cached_req_dir)}")
+                await run_in_threadpool(
+                    reuse_cached_outputs, dataset_id, cached_req_dir, req, JOB_METADATA,
+                    [os.path.basename(image_path)], [f"image_0{file_ending}"],
+                )
+                req['job_id'] = None
+                return req
+
+            JOB_METADATA["image_sha256"] = upload["hash"]
+            JOB_METADATA["cache_key"] = key
+
         # --- Submission Logic ---
         logger.info(f"Submitting nnU-Net prediction job {JOB_METADATA['job_id']}...")
 
-        # Enqueue the job, passing the entire JOB_METADATA dictionary as the only argument
-        job = q.enqueue(
-            run_nnunet_predict, # The function the worker will execute
-            JOB_METADATA,       # The required dictionary of parameters
-            job_timeout='3h',   # Allow ample time for a large segmentation job
-            result_ttl=604800    # Keep results for 7 days
+        # index the request before its job exists: a fast worker may update its status right away
+        await run_in_threadpool(
+            prediction_index.upsert_request, dataset_id, req["req_id"], req, [os.path.basename(image_path)]
         )
 
-        logger.info(f"\nJob submitted successfully to queue '{queue_name}'.")
-        logger.info(f"  Job ID: {job.id}")
-        
+        # Queue the request in its priority lane; the lane's jobs run requests by fair share.
+        try:
+            job_id = await run_in_threadpool(
+                prediction_scheduler.submit,
+                JOB_METADATA,       # The required dictionary of parameters
+                lane,
+                job_timeout='3h',   # Allow ample time for a large segmentation job
+                result_ttl=604800    # Keep results for 7 days
+            )
+        except Exception:
+            await run_in_threadpool(prediction_index.delete_request, dataset_id, req["req_id"])
+            raise
+
+        logger.info(f"\nJob submitted successfully to queue '{prediction_scheduler.LANE_QUEUE_NAMES[lane]}'.")
+        logger.info(f"  Job ID: {job_id}")
+
+        # keep the job id with the request, so its progress can be looked up later
         logger.debug(f"Attaching job info to response.")
-        req['job_id'] = job.id
+        req['job_id'] = job_id
+        await run_in_threadpool(_write_req_info, req_path, req)
+        await run_in_threadpool(prediction_index.update_req_info, dataset_id, req["req_id"], req)
 
         logger.debug(f"Returning req={req}")
         return req
 
+    except UploadTooLargeError as e:
+        if os.path.exists(req_dir):
+            shutil.rmtree(req_dir)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         # Cleanup request folder on error
         if os.path.exists(req_dir):
@@ -366,10 +504,9 @@ async def post_prediction_request_zip(
         logger.debug(f"file_ending={file_ending}")
 
         # Save zip file
-        images_zip_path = os.path.join(req_dir, 'images.zip')
+        images_zip_path = os.path.join(req_dir, prediction_index.ZIP_UPLOAD_FILE_NAME)
         logger.debug(f"Saving uploaded zip to: {images_zip_path}")
-        with open(images_zip_path, "wb") as buffer:
-            shutil.copyfileobj(images_zip.file, buffer)
+        await save_upload_file(images_zip, images_zip_path)
 
         # Extract zip
         logger.debug(f"Extracting zip file: {images_zip_path}")
@@ -401,11 +538,20 @@ async def post_prediction_request_zip(
                 req[key] = value
 
         req_path = os.path.join(req_dir, "req.json")
-        with open(req_path, "w") as f:
-            json.dump(req, f, indent=4)
+        await run_in_threadpool(_write_req_info, req_path, req)
+
+        input_images = [f"image_{i}_0000{file_ending}" for i in range(len(filename_list))]
+        # no prediction is queued for zip uploads: "uploaded" keeps them out of the in-flight checks
+        await run_in_threadpool(
+            prediction_index.upsert_request, dataset_id, req["req_id"], req, input_images, status="uploaded"
+        )
 
         return {"status": "success", "req": req}
 
+    except UploadTooLargeError as e:
+        if os.path.exists(req_dir):
+            shutil.rmtree(req_dir)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         # Cleanup request folder on error
         if os.path.exists(req_dir):
@@ -413,6 +559,52 @@ async def post_prediction_request_zip(
         raise HTTPException(status_code=500, detail=f"Error processing prediction request: {str(e)}")
 
 
+FINISHED_STATUSES = {"completed", "failed", "cancelled"}
+
+def cancel_request(dataset_id: str, req_id: str, req_dir: str) -> str:
+    """
+    Cancel a request's prediction. A parked request is taken out of its lane
+    (and its slot job out of the queue) right away; a running one is stopped
+    by its worker, which polls the cancel marker. Returns the resulting status.
+    """
+    state = prediction_progress.read_state(req_dir) or {}
+    if state.get("status") in FINISHED_STATUSES:
+        return state["status"]
+
+    req_info = _read_req_info(req_dir)
+    prediction_cancel.mark_cancelled(req_dir)
+
+    parked = prediction_scheduler.cancel_pending(
+        req_info.get("priority"), req_info.get("requester_id"), req_dir, req_info.get("job_id")
+    )
+
+    if parked or state.get("status") is None:
+        # nothing is running it; a slot that already popped it sees the marker and skips it
+        prediction_progress.write_state(req_dir, status="cancelled")
+        prediction_index.update_status(dataset_id, req_id, "cancelled")
+        return "cancelled"
+
+    logger.info(f"Cancellation of running request {req_id} requested")
+    return "cancelling"
+
+
+@router.post("/predictions/cancel")
+async def cancel_prediction_request(dataset_id: str = Query(...), req_id: str = Query(...), request: Request = None):
+    log_request(request)
+    logger.info(f"POST /predictions/cancel called with dataset_id={dataset_id}, req_id={req_id}")
+
+    req_dir = os.path.join(nnunet_predictions_dir, dataset_id, req_id)
+    if not os.path.isdir(req_dir):
+        raise HTTPException(status_code=404, detail=f"Request '{req_id}' not found in dataset '{dataset_id}'")
+
+    try:
+        status = await run_in_threadpool(cancel_request, dataset_id, req_id, req_dir)
+    except Exception as e:
+        log_exception(e)
+        raise HTTPException(status_code=500, detail=f"Failed to cancel request '{req_id}': {str(e)}")
+    return {"req_id": req_id, "status": status}
+
+
 @router.delete("/predictions")
 async def delete_prediction_request(dataset_id: str, req_id: str, request: Request):
     log_request(request)
@@ -429,23 +621,149 @@ async def delete_prediction_request(dataset_id: str, req_id: str, request: Reque
         raise HTTPException(status_code=404, detail=f"Request '{req_id}' not found in dataset '{dataset_id}'")
 
     try:
-        shutil.rmtree(req_dir)
+        # stop its job first; a running worker also notices the folder is gone
+        try:
+            await run_in_threadpool(cancel_request, dataset_id, req_id, req_dir)
+        except Exception as e:
+            logger.warning(f"Failed to cancel request {req_id} before deleting it: {e}")
+
+        await run_in_threadpool(shutil.rmtree, req_dir)
         logger.info(f"Deleted request directory: {req_dir}")
+        await run_in_threadpool(prediction_index.delete_request, dataset_id, req_id)
         return {"status": "success", "message": f"Request '{req_id}' deleted."}
     except Exception as e:
         log_exception(e)
         raise HTTPException(status_code=500, detail=f"Failed to delete request '{req_id}': {str(e)}")
 
 
+def _write_req_info(req_path: str, req: dict):
+    with open(req_path, "w") as f:
+        json.dump(req, f, indent=4)
+
+
+def _read_req_info(req_dir: str) -> dict:
+    try:
+        with open(os.path.join(req_dir, "req.json"), "r") as f:
+            return json.load(f)
+    except (JSONDecodeError, OSError):
+        return {}
+
+
+def _fetch_job_progress(job_id: str) -> tuple[str | None, dict | None]:
+    """(job status, published progress) of a job, or (None, None) if the executor no longer has it."""
+    job = job_executor.get_executor().fetch(job_id)
+    if job is None:
+        return None, None
+    return job["status"], job["meta"].get("progress")
+
+
+@router.get("/predictions/progress")
+async def get_prediction_progress(dataset_id: str = Query(...), req_id: str = Query(...), request: Request = None):
+    """
+    Live progress of a request: the status recorded by the worker in the
+    request's state.json and the progress its job publishes while nnU-Net
+    runs (stage, cases and sliding-window steps done, overall fraction).
+    """
+    log_request(request)
+    logger.info(f"GET /predictions/progress called with dataset_id={dataset_id}, req_id={req_id}")
+
+    req_dir = os.path.join(nnunet_predictions_dir, dataset_id, req_id)
+    if not os.path.isdir(req_dir):
+        raise HTTPException(status_code=404, detail=f"Request '{req_id}' not found in dataset '{dataset_id}'")
+
+    state = prediction_progress.read_state(req_dir) or {}
+    # the job running a request can be a batch flush job other than the one it was submitted with
+    job_id = state.get("rq_job_id") or _read_req_info(req_dir).get("job_id")
+
+    job_status, progress = None, None
+    if job_id:
+        job_status, progress = await run_in_threadpool(_fetch_job_progress, job_id)
+
+    return {
+        "req_id": req_id,
+        "status": state.get("status", "queued"),
+        "job_id": job_id,
+        "job_status": job_status,
+        "progress": progress,
+        "updated_at": state.get("updated_at"),
+    }
+
+
+@router.get("/predictions/log")
+async def get_prediction_log(
+    dataset_id: str = Query(...),
+    req_id: str = Query(...),
+    offset: int = Query(0, ge=0),
+    max_bytes: int = Query(65536, ge=1, le=1024 * 1024),
+    request: Request = None,
+):
+    """
+    Incremental read of a request's prediction log. Pass the returned
+    next_offset as `offset` of the next call to get only the new output.
+    """
+    log_request(request)
+    logger.info(f"GET /predictions/log called with dataset_id={dataset_id}, req_id={req_id}, offset={offset}")
+
+    req_dir = os.path.join(nnunet_predictions_dir, dataset_id, req_id)
+    if not os.path.isdir(req_dir):
+        raise HTTPException(status_code=404, detail=f"Request '{req_id}' not found in dataset '{dataset_id}'")
+
+    return await run_in_threadpool(prediction_progress.read_log, req_dir, offset, max_bytes)
+
+
+@router.get("/predictions/events")
+async def get_prediction_events(
+    dataset_id: str = Query(...),
+    req_id: str | None = Query(None),
+    requester_id: str | None = Query(None),
+    request: Request = None,
+):
+    """
+    Server-Sent Events stream of status changes (queued, running with
+    progress, provisional, completed, failed, cancelled) of one request
+    (req_id) or of all unfinished requests of a requester (requester_id),
+    instead of polling GET /prediction. See app/core/prediction_events.py.
+    """
+    log_request(request)
+    logger.info(f"GET /predictions/events called with dataset_id={dataset_id}, req_id={req_id}, requester_id={requester_id}")
+
+    if (req_id is None) == (requester_id is None):
+        raise HTTPException(status_code=400, detail="Pass either req_id or requester_id")
+
+    dataset_dir = os.path.join(nnunet_predictions_dir, dataset_id)
+    if req_id is not None and not os.path.isdir(os.path.join(dataset_dir, req_id)):
+        raise HTTPException(status_code=404, detail=f"Request '{req_id}' not found in dataset '{dataset_id}'")
+
+    file_ending = await get_file_ending(dataset_id)
+    events = prediction_events.stream(
+        dataset_dir, file_ending, request.is_disconnected,
+        req_id=req_id, dataset_id=dataset_id, requester_id=requester_id,
+    )
+    return StreamingResponse(
+        events, media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/predictions/image_and_label_metadata")
 async def get_image_label_metadata(
     dataset_id: str = Query(...),
     req_id: str = Query(...),
-    image_number: int = Query(...)
+    image_number: int = Query(...),
+    request: Request = None,
+    response: Response = None,
 ):
     try:
-        file_ending = await get_file_ending(dataset_id)
-        ch_names = await get_input_channel_names(dataset_id)
+        # derived from dataset.json alone
+        etag = http_cache.file_etag([nnunet_raw.dataset_json_path(dataset_id)], req_id, image_number)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if http_cache.is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        dataset_info = await get_dataset_info(dataset_id)
+        file_ending = await get_file_ending(dataset_id, dataset_info)
+        ch_names = await get_input_channel_names(dataset_id, dataset_info)
         
         image_names = [f"image_{image_number}_{i:04}{file_ending}" for i in range(len(ch_names))]
         label_name = f"image_{image_number}{file_ending}"
@@ -463,9 +781,40 @@ async def get_image_label_metadata(
 
 import json
 
+CONTOUR_NPZ_MEDIA_TYPE = "application/x-npz"
+
+def artifact_cache_control(outputs_dir: str) -> str:
+    """Artifacts of a finished request don't change; provisional ones are replaced by the final pass."""
+    if prediction_index.outputs_finalized(outputs_dir) and settings.PREDICTION_ARTIFACT_MAX_AGE_SEC > 0:
+        return f"private, max-age={settings.PREDICTION_ARTIFACT_MAX_AGE_SEC}"
+    return "no-cache"
+
 def load_from_json(filepath):
     with open(filepath, 'r') as f:
         return json.load(f)
+
+def read_json_object_bytes(paths: dict) -> bytes:
+    """Body of a JSON object whose values are the raw contents of already-serialized JSON files."""
+    parts = []
+    for key, path in paths.items():
+        with open(path, 'rb') as f:
+            parts.append(json.dumps(key).encode() + b':' + f.read())
+    return b'{' + b','.join(parts) + b'}'
+
+def read_json_object_gzip(paths: dict, gz_path: str) -> bytes:
+    """Like read_json_object_bytes() but gzip-compressed, kept as a precompressed sibling file."""
+    import gzip
+    newest_source = max(os.stat(path).st_mtime_ns for path in paths.values())
+    if os.path.exists(gz_path) and os.stat(gz_path).st_mtime_ns >= newest_source:
+        with open(gz_path, 'rb') as f:
+            return f.read()
+
+    content = gzip.compress(read_json_object_bytes(paths), compresslevel=6)
+    tmp_path = f"{gz_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, gz_path)
+    return content
     
 
 @router.get("/predictions/contour_points")
@@ -474,9 +823,17 @@ async def get_contour_points(
     req_id: str = Query(...),
     image_number: int = Query(...),
     contour_number: int = Query(...),
-    coordinate_systems: str = Query("woI")
+    coordinate_systems: str = Query("woI"),
+    request: Request = None
 ):
-    import app.core.dict_helper as dict_helper
+    """
+    Contour points of one label in the selected coordinate systems (w, o, I).
+
+    JSON by default. Clients sending `Accept: application/x-npz` get the compact
+    binary form instead: an .npz with points_* arrays (points_I int16/int32,
+    points_o/points_w float32) and the offsets/slices/holes arrays describing
+    how the flat point arrays split into contours.
+    """
     import app.core.image_tools as image_tools 
 
     try:
@@ -493,26 +850,9 @@ async def get_contour_points(
         if not os.path.exists(outputs_dir):
             raise HTTPException(status_code=404, detail=f"outputs_dir not found: {outputs_dir}")
 
-        # Load dataset and label info
         file_ending = await get_file_ending(dataset_id)
         logger.debug(f"file_ending={file_ending}")
 
-        dataset_json_path = os.path.join(outputs_dir, "dataset.json")
-        logger.debug(f"dataset_json_path={dataset_json_path}")
-
-        dataset = dict_helper.load_from_json(dataset_json_path)
-        logger.debug(f"Loaded dataset.json for dataset_id={dataset_id}")
-        logger.debug(f"dataset: {dataset}")
-
-        labels_map = dataset.get("labels")
-        logger.debug(f"labels_map={labels_map}")
-        if not labels_map or len(labels_map) < 2:
-            raise HTTPException(status_code=400, detail="Invalid 'labels' in dataset.json. Must contain at least 2 label entries.")
-
-        # ✅ Check if contour_number is in label_map values
-        if contour_number not in labels_map.values():
-            raise HTTPException(status_code=400, detail=f"Contour number {contour_number} is not in label map.")
-
         # Validate coordinate_systems
         valid_coords = {'w', 'o', 'I'}
         invalid = set(coordinate_systems) - valid_coords
@@ -525,17 +865,9 @@ async def get_contour_points(
         # Label and binary image paths
         label_image_path = os.path.join(outputs_dir, f"image_{image_number}.mha")
         logger.debug(f"label_image_path={label_image_path}")
-        if not os.path.exists(label_image_path):
-            raise HTTPException(status_code=404, detail=f"Label image not found: {label_image_path}")
-
-        binary_image_fname = f"image_{image_number}{file_ending}.{contour_number}.mha"
-        binary_image_file = os.path.join(outputs_dir, binary_image_fname)
-        logger.debug(f"binary_image_file={binary_image_file}")
 
-        # Generate binary label image if missing
-        if not os.path.exists(binary_image_file):
-            logger.debug(f"Binary label image not fouund: {binary_image_file}. Extrackting...")
-            await run_in_threadpool(image_tools.extract_binary_label_image,label_image_path, contour_number, binary_image_file)
+        contour_file_prefix = f"image_{image_number}{file_ending}"
+        binary_image_fname = f"{contour_file_prefix}.{contour_number}.mha"
 
         # Coordinate-to-file mapping
         coord_map = {
@@ -551,18 +883,72 @@ async def get_contour_points(
         }
         logger.info(f'contour_paths={contour_paths}')
 
-        # Generate contour .json files if any of them missing
-        if any(not os.path.exists(p) for p in contour_paths.values()):
-            logger.debug(f"Generating contour JSON files for: {binary_image_file}")
-            await run_in_threadpool(image_tools.binary_image_to_contour_list_json_files,binary_image_file)
+        # Content negotiation: compact binary contours or JSON (default)
+        media_type = http_cache.preferred_media_type(request, ["application/json", CONTOUR_NPZ_MEDIA_TYPE])
+        want_npz = media_type == CONTOUR_NPZ_MEDIA_TYPE
+        npz_path = os.path.join(outputs_dir, f"{binary_image_fname}.contours.npz")
+        required_paths = [npz_path] if want_npz else list(contour_paths.values())
+
+        # Revalidation from the artifact (and label image) stats alone, before anything is read or generated
+        use_gzip = not want_npz and settings.CONTOUR_GZIP_SIBLINGS and http_cache.accepts_gzip(request)
+        encoding = "npz" if want_npz else "gzip" if use_gzip else "identity"
+        etag = http_cache.file_etag([label_image_path, *required_paths], coordinate_systems, encoding)
+        headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding", "Cache-Control": artifact_cache_control(outputs_dir)}
+        if http_cache.is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        # Load dataset and label info
+        dataset_json_path = os.path.join(outputs_dir, "dataset.json")
+        logger.debug(f"dataset_json_path={dataset_json_path}")
+
+        # parsed once per file version (nnunet_raw's mtime-validated cache), not on every request
+        dataset = await run_in_threadpool(nnunet_raw.load_dataset_json_file, dataset_json_path)
+        logger.debug(f"Loaded dataset.json for dataset_id={dataset_id}")
+        logger.debug(f"dataset: {dataset}")
+
+        labels_map = dataset.get("labels")
+        logger.debug(f"labels_map={labels_map}")
+        if not labels_map or len(labels_map) < 2:
+            raise HTTPException(status_code=400, detail="Invalid 'labels' in dataset.json. Must contain at least 2 label entries.")
+
+        # ✅ Check if contour_number is in label_map values
+        if contour_number not in labels_map.values():
+            raise HTTPException(status_code=400, detail=f"Contour number {contour_number} is not in label map.")
+
+        if not os.path.exists(label_image_path):
+            raise HTTPException(status_code=404, detail=f"Label image not found: {label_image_path}")
+
+        # Generate contour files if any of them missing.
+        # All labels are extracted in one pass over the label image, so later requests for other labels are cache hits.
+        if any(not os.path.exists(p) for p in required_paths):
+            label_values = [v for v in labels_map.values() if v != 0]
+            logger.debug(f"Generating contour JSON files for labels {label_values} of: {label_image_path}")
+            await run_in_threadpool(
+                image_tools.label_image_to_contour_list_json_files,
+                label_image_path,
+                label_values,
+                out_dir=outputs_dir,
+                file_prefix=contour_file_prefix,
+            )
+            # the ETag of the generated files
+            etag = http_cache.file_etag([label_image_path, *required_paths], coordinate_systems, encoding)
+            headers["ETag"] = etag
         else:
-            logger.debug(f"Contour JSON files already exist for: {binary_image_file}")
+            logger.debug(f"Contour files already exist for: {binary_image_fname}")
 
-        # Load and return selected coordinate outputs
-        return {
-            key: load_from_json(path)
-            for key, path in contour_paths.items()
-        }
+        if want_npz:
+            content = await run_in_threadpool(image_tools.read_contour_npz_bytes, npz_path, list(contour_paths.keys()))
+            return Response(content=content, media_type=CONTOUR_NPZ_MEDIA_TYPE, headers=headers)
+
+        # Serve the selected coordinate outputs straight from the files, without parsing them
+        if use_gzip:
+            gz_path = os.path.join(outputs_dir, f"{binary_image_fname}.{''.join(selected_coords)}.json.gz")
+            content = await run_in_threadpool(read_json_object_gzip, contour_paths, gz_path)
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=content, media_type="application/json", headers=headers)
+
+        content = await run_in_threadpool(read_json_object_bytes, contour_paths)
+        return Response(content=content, media_type="application/json", headers=headers)
 
     except Exception as e:
         log_exception(e)
@@ -597,10 +983,11 @@ async def download_image_and_label(
         raise HTTPException(status_code=404, detail="Request folder not found.")
 
     try:
-        file_ending = await get_file_ending(dataset_id)
+        dataset_info = await get_dataset_info(dataset_id)
+        file_ending = await get_file_ending(dataset_id, dataset_info)
         logger.debug(f"file_ending={file_ending}")  
 
-        ch_names = await get_input_channel_names(dataset_id)
+        ch_names = await get_input_channel_names(dataset_id, dataset_info)
         logger.debug(f"ch_names={ch_names}")
         
         # image names & paths
@@ -621,6 +1008,12 @@ async def download_image_and_label(
 
         label_exist = os.path.exists(label_path)        
         logger.debug(f"label_exist={label_exist}")
+
+        # the zip only changes with its files; skip zipping if the client has it
+        etag = http_cache.file_etag([*image_paths, label_path])
+        headers = {"ETag": etag, "Cache-Control": artifact_cache_control(outputs_dir)}
+        if http_cache.is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
         
         # Create a temp ZIP file with both images
         tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
@@ -634,7 +1027,8 @@ async def download_image_and_label(
             return FileResponse(
                 tmp.name,
                 media_type='application/zip',
-                filename=f"{req_id}_image_{image_number}.zip"
+                filename=f"{req_id}_image_{image_number}.zip",
+                headers=headers,
             )
         finally:
             async def delayed_delete(path):
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 import os, json, re, random, asyncio
 from pathlib import Path
@@ -52,7 +53,7 @@ def log_and_raise_exception(e: Exception):
 # ---------------- Routes ----------------
 @router.get("/dataset_json/list")
 async def get_dataset_json_list():
-    """Retrieve dataset list asynchronously."""
+    """Retrieve dataset list asynchronously (unchanged dataset.json files come from the cache)."""
     dirnames = raw.get_dataset_dirs()
     tasks = [raw.read_dataset_json(dirname) for dirname in dirnames]
     dataset_list = await asyncio.gather(*tasks)
@@ -106,10 +107,8 @@ async def post_dataset(request: Request):
         dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
         Path(dataset_path).mkdir(parents=True, exist_ok=True)
 
-        # Save dataset.json asynchronously
-        json_path = os.path.join(dataset_path, "dataset.json")
-        async with aiofiles.open(json_path, 'w') as f:
-            await f.write(json.dumps(dataset.dict(), indent=4))
+        # Save dataset.json (and cache it)
+        await run_in_threadpool(raw.write_dataset_json, dataset_id, dataset.dict())
 
         logger.info(f"Dataset created successfully: {dataset_id}")
         response = dataset.dict()
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
 import os, re
 import json
-import shutil
 
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 
 # FastAPI Router
 router = APIRouter()
@@ -31,6 +31,19 @@ logger.info(f"nnunet_data_dir={nnunet_data_dir}")
 
 # Core module
 import app.core.nnunet_raw as nnunet_raw
+from app.core.upload_tools import save_upload_file, UploadTooLargeError
+import app.core.http_cache as http_cache
+
+
+def load_dataset_json(dataset_id: str) -> dict:
+    """The dataset's dataset.json (cached in nnunet_raw); 404 if the dataset doesn't exist."""
+    try:
+        return nnunet_raw.load_dataset_json(dataset_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_id}' not found.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read dataset.json: {str(e)}")
+
 
 @router.get("/dataset/image_name_list")
 async def get_image_name_list(dataset_id: str):
@@ -59,17 +72,7 @@ async def add_image_and_labels(
     """
     # Validate dataset directory
     dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
-    dataset_json_path = os.path.join(dataset_path, "dataset.json")
-    
-    if not os.path.exists(dataset_path) or not os.path.exists(dataset_json_path):
-        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_id}' not found.")
-    
-    # Load dataset.json
-    try:
-        with open(dataset_json_path, "r") as f:
-            dataset_info = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to read dataset.json: {str(e)}")
+    dataset_info = load_dataset_json(dataset_id)
     
     # Validate required keys in dataset.json
     required_keys = ["numTraining", "numTest", "file_ending"]
@@ -109,19 +112,20 @@ async def add_image_and_labels(
 
     # Save files
     try:
-        with open(base_image_path, "wb") as buffer:
-            shutil.copyfileobj(base_image.file, buffer)
-        
-        with open(labels_path, "wb") as buffer:
-            shutil.copyfileobj(labels.file, buffer)
-
+        await save_upload_file(base_image, base_image_path)
+        await save_upload_file(labels, labels_path)
+
+    except UploadTooLargeError as e:
+        for path in [base_image_path, labels_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save images: {str(e)}")
 
     # Save updated dataset.json
     try:
-        with open(dataset_json_path, "w") as f:
-            json.dump(dataset_info, f, indent=4)
+        await run_in_threadpool(nnunet_raw.write_dataset_json, dataset_id, dataset_info)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update dataset.json: {str(e)}")
 
@@ -172,17 +176,7 @@ async def get_image_and_labels(
     """
     # Validate dataset directory
     dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
-    dataset_json_path = os.path.join(dataset_path, "dataset.json")
-    
-    if not os.path.exists(dataset_path) or not os.path.exists(dataset_json_path):
-        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_id}' not found.")
-    
-    # Load dataset.json
-    try:
-        with open(dataset_json_path, "r") as f:
-            dataset_info = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to read dataset.json: {str(e)}")
+    dataset_info = load_dataset_json(dataset_id)
 
     file_ending = dataset_info.get("file_ending", ".mha")
 
@@ -227,19 +221,14 @@ async def download_file(
     dataset_id: str,
     images_for: str,
     type: str,  # "image" or "label"
-    num: int
+    num: int,
+    request: Request = None,
 ):
     """
     Downloads a single image or label file.
     """
     dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
-    dataset_json_path = os.path.join(dataset_path, "dataset.json")
-
-    if not os.path.exists(dataset_json_path):
-        raise HTTPException(status_code=404, detail="Dataset not found")
-
-    with open(dataset_json_path, "r") as f:
-        dataset_info = json.load(f)
+    dataset_info = load_dataset_json(dataset_id)
 
     file_ending = dataset_info.get("file_ending", ".nii.gz")
 
@@ -263,8 +252,14 @@ async def download_file(
     else:
         raise HTTPException(status_code=400, detail="Invalid type (must be 'image' or 'label').")
 
+    # raw files are replaced in place by update_image_and_labels, so clients revalidate
+    etag = http_cache.file_etag([path])
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if http_cache.is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
     filename = os.path.basename(path)
-    return FileResponse(path, filename=filename)
+    return FileResponse(path, filename=filename, headers=headers)
 
 
 @router.put("/dataset/update_image_and_labels")
@@ -279,13 +274,7 @@ async def update_image_and_labels(
     Updates existing image and label files for a given dataset and index.
     """
     dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
-    dataset_json_path = os.path.join(dataset_path, "dataset.json")
-
-    if not os.path.exists(dataset_json_path):
-        raise HTTPException(status_code=404, detail="Dataset not found")
-
-    with open(dataset_json_path, "r") as f:
-        dataset_info = json.load(f)
+    dataset_info = load_dataset_json(dataset_id)
 
     file_ending = dataset_info.get("file_ending", ".mha")
 
@@ -306,11 +295,16 @@ async def update_image_and_labels(
     parts = os.path.basename(base_image_path).split('_')
     label_path = os.path.join(labels_folder, f"{parts[0]}_{parts[1]}{file_ending}")
     try:
-        with open(base_image_path, "wb") as buffer:
-            shutil.copyfileobj(base_image.file, buffer)
-
-        with open(label_path, "wb") as buffer:
-            shutil.copyfileobj(labels.file, buffer)
+        # upload next to the existing files and swap in once both are complete
+        await save_upload_file(base_image, base_image_path + ".upload")
+        await save_upload_file(labels, label_path + ".upload")
+        os.replace(base_image_path + ".upload", base_image_path)
+        os.replace(label_path + ".upload", label_path)
+    except UploadTooLargeError as e:
+        for path in [base_image_path + ".upload", label_path + ".upload"]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update files: {str(e)}")
 
@@ -328,13 +322,7 @@ async def delete_image_and_labels(
     Deletes image and label files for a given dataset and index.
     """
     dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
-    dataset_json_path = os.path.join(dataset_path, "dataset.json")
-
-    if not os.path.exists(dataset_json_path):
-        raise HTTPException(status_code=404, detail="Dataset not found")
-
-    with open(dataset_json_path, "r") as f:
-        dataset_info = json.load(f)
+    dataset_info = load_dataset_json(dataset_id)
 
     file_ending = dataset_info.get("file_ending", ".mha")
 
@@ -376,8 +364,7 @@ async def delete_image_and_labels(
 
     # Save updated dataset.json
     try:
-        with open(dataset_json_path, "w") as f:
-            json.dump(dataset_info, f, indent=4)
+        await run_in_threadpool(nnunet_raw.write_dataset_json, dataset_id, dataset_info)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update dataset.json: {str(e)}")
 
@@ -7,9 +7,91 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
     SLURM_USER: str = "jinkokim"
     NNUNET_DATA_DIR: str
-    JOB_PROCESSOR: str = "slurm"
+    JOB_PROCESSOR: str = "rq"  # "rq", "local" or "slurm", see app/core/job_executor.py
     REDIS_URL: str = "redis://localhost:6379/0"
 
+    # JOB_PROCESSOR = "local": in-process job pool, no Redis
+    LOCAL_EXECUTOR_WORKERS: int = 2
+    LOCAL_EXECUTOR_DIR: str = ""  # job records; defaults to NNUNET_DATA_DIR/local_jobs
+    LOCAL_EXECUTOR_POLL_SEC: float = 0.5
+
+    # JOB_PROCESSOR = "slurm": jobs run as SLURM batch jobs
+    SLURM_SETUP: str = "module load slurm"  # shell setup run before sbatch/squeue/sacct/scancel ("" for none)
+    SLURM_JOBS_DIR: str = ""  # job records and logs, on a filesystem shared with the nodes; defaults to NNUNET_DATA_DIR/slurm_jobs
+    SLURM_JOB_TEMPLATE: str = ""  # defaults to scripts_dir/job.slurm
+    SLURM_POLL_TTL_SEC: float = 10.0  # squeue/sacct results are reused for this long
+    SLURM_BATCH_WINDOW_SEC: float = 30.0  # prediction requests are collected this long into one allocation
+    SLURM_BATCH_MAX_REQUESTS: int = 16
+
+    # prediction worker
+    PREDICT_MODE: str = "script"  # "script", "in_process" or "pipeline"
+    PREDICTOR_CACHE_MAX_MB: int = 4096
+    PREDICT_NUM_PROCESSES_PREPROCESSING: int = 2
+    PREDICT_NUM_PROCESSES_EXPORT: int = 2
+
+    # latency tier of requests that don't name one: preview, standard or full (see prediction_tiers)
+    PREDICTION_DEFAULT_TIER: str = "full"
+    # tier of the quick first pass of progressive requests
+    PREDICTION_PROVISIONAL_TIER: str = "preview"
+
+    # live progress of running predictions (published to the RQ job's meta)
+    PREDICTION_PROGRESS_INTERVAL_SEC: float = 1.0
+
+    # push notifications of status changes (GET /predictions/events, see prediction_events)
+    PREDICTION_EVENTS_POLL_SEC: float = 1.0
+    PREDICTION_EVENTS_REFRESH_SEC: float = 5.0  # requester streams: look for new requests
+    PREDICTION_EVENTS_KEEPALIVE_SEC: float = 15.0
+
+    # completion webhooks to a request's callback_url (see prediction_webhooks)
+    WEBHOOK_DIR: str = ""  # outbox; defaults to NNUNET_DATA_DIR/webhooks
+    WEBHOOK_WORKERS: int = 4  # deliveries in flight
+    WEBHOOK_TIMEOUT_SEC: float = 10.0
+    WEBHOOK_MAX_BATCH: int = 50  # events per POST to one URL
+    WEBHOOK_MAX_ATTEMPTS: int = 8
+    WEBHOOK_BACKOFF_SEC: float = 5.0  # doubles per failed attempt
+    WEBHOOK_BACKOFF_MAX_SEC: float = 3600.0
+    WEBHOOK_SECRET: str = ""  # HMAC-SHA256 key of the X-Webhook-Signature header ("" for unsigned)
+    WEBHOOK_ALLOWED_HOSTS: list[str] = []  # callback_url hosts, fnmatch patterns ("*.example.org"); empty rejects all
+
+    # cancellation of running predictions
+    PREDICTION_CANCEL_POLL_SEC: float = 1.0
+    PREDICTION_CANCEL_GRACE_SEC: float = 10.0
+
+    # eager contour generation in the worker after a successful prediction
+    PREDICTION_POSTPROCESS_CONTOURS: bool = True
+    PREDICTION_POSTPROCESS_LABEL_STATS: bool = True
+    PREDICTION_POSTPROCESS_WORKERS: int = 4
+
+    # uploads
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    UPLOAD_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 0 for no limit
+
+    # reuse outputs of identical submissions (same image hash and model)
+    PREDICTION_CACHE_ENABLED: bool = True
+
+    # contour responses: keep precompressed .json.gz siblings for gzip-accepting clients
+    CONTOUR_GZIP_SIBLINGS: bool = True
+
+    # Cache-Control max-age of artifacts (contours, downloads) of finished requests; provisional ones are revalidated
+    PREDICTION_ARTIFACT_MAX_AGE_SEC: int = 3600
+
+    # priority lanes (interactive, normal, bulk) and fair share between requesters within a lane
+    PREDICTION_DEFAULT_LANE: str = "normal"
+    PREDICTION_REQUESTER_WEIGHTS: dict[str, float] = {}  # requester_id -> weight (default 1.0)
+
+    # admission control (see app/core/prediction_admission.py); lanes without a limit accept everything
+    PREDICTION_LANE_MAX_QUEUED: dict[str, int] = {}  # lane -> max unfinished requests, else 429
+    PREDICTION_LANE_MAX_WAIT_SEC: dict[str, float] = {}  # lane -> max estimated time to result, else cheaper tier or 503
+    PREDICTION_ADMISSION_DEGRADE: bool = True  # route requests without an explicit tier to a cheaper one instead of 503
+    PREDICTION_ADMISSION_WORKERS: int = 1  # predictions running in parallel
+    PREDICTION_ADMISSION_DEFAULT_SEC: float = 120.0  # estimate per image (full tier) without history
+    PREDICTION_ADMISSION_HISTORY: int = 50  # recent durations the estimate is the median of
+    PREDICTION_ADMISSION_HORIZON_SEC: float = 86400.0  # older unfinished requests are considered lost
+
+    # micro-batching of prediction requests for the same model (0 disables)
+    PREDICTION_BATCH_WINDOW_SEC: float = 0.0
+    PREDICTION_BATCH_MAX_REQUESTS: int = 8
+
     venv_dir: str = "/home/jk/nnunet/_venv"
     scripts_dir: str = "/home/jk/projects/nnunet_server/scripts"
     nnunet_dir: str = "/home/jk/nnunet"
@@ -0,0 +1,100 @@
+import os
+import hashlib
+from fastapi import Request
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from arbitrary parts (converted with str())."""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode())
+        h.update(b"\0")
+    return f'"{h.hexdigest()}"'
+
+
+def file_etag(paths, *extra) -> str:
+    """ETag from the path, size and mtime of each file (missing files count too). No file is read."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append(f"{path}:missing")
+    return make_etag(*parts, *extra)
+
+
+def is_not_modified(request: Request | None, etag: str) -> bool:
+    """True if the request's If-None-Match matches `etag` (weak comparison, as RFC 9110 requires)."""
+    if request is None:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def parse_quality_list(value: str) -> list[tuple[str, float]]:
+    """(token, q) of each element of an Accept or Accept-Encoding header, lowercased; q defaults to 1."""
+    items = []
+    for element in value.split(","):
+        token, *params = [part.strip() for part in element.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, q_value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(q_value)
+                except ValueError:
+                    q = 0.0
+        items.append((token.lower(), q))
+    return items
+
+
+def _media_quality(media_ranges: list[tuple[str, float]], media_type: str) -> tuple[float, int]:
+    """q of the most specific range matching media_type, and its specificity (2 exact, 1 type/*, 0 */*, -1 none)."""
+    type_ = media_type.partition("/")[0]
+    best = (0.0, -1)
+    for media_range, q in media_ranges:
+        if media_range == media_type:
+            specificity = 2
+        elif media_range == f"{type_}/*":
+            specificity = 1
+        elif media_range == "*/*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best[1]:
+            best = (q, specificity)
+    return best
+
+
+def preferred_media_type(request: Request | None, offered: list[str]) -> str:
+    """
+    The offered media type the request's Accept header ranks highest: by q-value,
+    then by how specifically it is named; ties go to the earlier offer. Types
+    with q=0 are never chosen. offered[0] (the default) without an Accept header
+    or if none of the offers is acceptable.
+    """
+    accept = request.headers.get("accept") if request is not None else None
+    if not accept:
+        return offered[0]
+    media_ranges = parse_quality_list(accept)
+    preferred, preferred_quality = offered[0], (0.0, -1)
+    for media_type in offered:
+        quality = _media_quality(media_ranges, media_type.lower())
+        if quality[0] > 0 and quality > preferred_quality:
+            preferred, preferred_quality = media_type, quality
+    return preferred
+
+
+def accepts_gzip(request: Request | None) -> bool:
+    if request is None:
+        return False
+    codings = dict(parse_quality_list(request.headers.get("accept-encoding", "")))
+    return codings.get("gzip", codings.get("*", 0.0)) > 0
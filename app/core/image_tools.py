@@ -1060,9 +1060,13 @@ def composit_label_image_to_binary_images(label_image_path, label_map, out_dir,
 
         if image is None:
             image = sitk.ReadImage(label_image_path)
-            label_array = sitk.GetArrayFromImage(image)
+            label_array = sitk.GetArrayViewFromImage(image)
+            # labels are only compared inside the bounding box of the foreground
+            roi = nonzero_bbox(label_array != 0)
 
-        binary_array = (label_array == label_value).astype(np.uint8)
+        binary_array = np.zeros(label_array.shape, dtype=np.uint8)
+        if roi is not None:
+            binary_array[roi] = label_array[roi] == label_value
         binary_image = sitk.GetImageFromArray(binary_array)
         binary_image.CopyInformation(image)
 
@@ -1073,73 +1077,206 @@ def composit_label_image_to_binary_images(label_image_path, label_map, out_dir,
     return output_filenames
 
 
-def transform_contour_list(contour_list, H):
-    contour_list_w = []
+# Contour arrays: the contours of a whole volume held as one flat point array.
+#   'points':  (N, 2) int32, x/y pixel index of every point, contour after contour
+#   'offsets': (C + 1,) int64, points of contour c are points[offsets[c]:offsets[c + 1]]
+#   'slices':  (C,) int32, z index of each contour (contours are ordered by slice)
+#   'holes':   (C,) bool, whether each contour is a hole
+# Nested lists (the JSON format) are only built at serialization time.
+
+def empty_contour_arrays():
+    return {
+        'points': np.zeros((0, 2), dtype=np.int32),
+        'offsets': np.zeros(1, dtype=np.int64),
+        'slices': np.zeros(0, dtype=np.int32),
+        'holes': np.zeros(0, dtype=bool),
+    }
+
+def stack_contour_arrays(point_chunks, slices, holes):
+    """Build contour arrays from per-contour (n_i, 2) point arrays."""
+    if not point_chunks:
+        return empty_contour_arrays()
+    counts = np.array([len(c) for c in point_chunks], dtype=np.int64)
+    return {
+        'points': np.concatenate(point_chunks).astype(np.int32),
+        'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'slices': np.asarray(slices, dtype=np.int32),
+        'holes': np.asarray(holes, dtype=bool),
+    }
+
+def contour_list_to_arrays(contour_list):
+    """Flatten a contour list ([{'slice', 'contours': [{'points', 'hole'}]}]) into contour arrays."""
+    point_chunks, slices, holes = [], [], []
     for Z_contours in contour_list:
-        slice = Z_contours['slice']
-        contours = Z_contours['contours']
-        contours_w = []
-        for contour in contours:
-            points = contour['points']
-            hole = contour['hole']
-            points_w = []
-            for point in points:
-                X = point[0]
-                Y = point[1]
-                Z = slice
-                pt_I = np.array([X, Y, Z, 1.0])
-                pt_w = H @ pt_I
-                points_w.append([float(pt_w[0]), float(pt_w[1]), float(pt_w[2])])
-            contours_w.append({'points': points_w, 'hole': hole})
-        contour_list_w.append({'slice': slice, 'contours': contours_w})
-    return contour_list_w
-
-def binary_image_to_contour(mask):
-    
-    # Convert SimpleITK images to NumPy arrays
-    mask_np = sitk.GetArrayFromImage(mask)
-
-    contours_list_I = []  # List to store contours from all slices
-
-    # for slice
-    for z in range(mask_np.shape[0]):  # Iterate through each slice
-        slice_2d = mask_np[z, :, :]  # Extract the 2D slice
+        for contour in Z_contours['contours']:
+            point_chunks.append(np.asarray(contour['points'], dtype=np.float64).reshape(-1, 2))
+            slices.append(Z_contours['slice'])
+            holes.append(contour['hole'])
+    return stack_contour_arrays(point_chunks, slices, holes)
+
+def transform_contour_points(arrays, H):
+    """Map every contour point (x, y, slice) through the 4x4 matrix H with one matmul. Returns (N, 3) float64."""
+    counts = np.diff(arrays['offsets'])
+    n = len(arrays['points'])
+    pts_I = np.empty((n, 4), dtype=np.float64)
+    pts_I[:, :2] = arrays['points']
+    pts_I[:, 2] = np.repeat(arrays['slices'], counts)
+    pts_I[:, 3] = 1.0
+    return (pts_I @ np.asarray(H, dtype=np.float64).T)[:, :3]
+
+def contour_arrays_to_list(arrays, points=None):
+    """Nested contour list from contour arrays. `points` (e.g. transformed points) replaces arrays['points']."""
+    points = (arrays['points'] if points is None else points).tolist()
+    offsets = arrays['offsets'].tolist()
+    slices = arrays['slices'].tolist()
+    holes = arrays['holes'].tolist()
+
+    contour_list = []
+    for c, z in enumerate(slices):
+        if not contour_list or contour_list[-1]['slice'] != z:
+            contour_list.append({'slice': z, 'contours': []})
+        contour_list[-1]['contours'].append({'points': points[offsets[c]:offsets[c + 1]], 'hole': holes[c]})
+    return contour_list
 
-        # Convert objects from value 1 to 255
-        #_, binary_slice = cv2.threshold(slice_2d, 1, 255, cv2.THRESH_BINARY)
-
-        slice_max = np.max(slice_2d)
-        print(f'slice max={slice_max}')
+def transform_contour_list(contour_list, H):
+    arrays = contour_list_to_arrays(contour_list)
+    return contour_arrays_to_list(arrays, transform_contour_points(arrays, H))
 
-        if slice_max == 0:
-            continue
+def trace_contour_order(hierarchy):
+    """
+    (contour index, hole) pairs in the order trace_contour() visits them:
+    depth first from contour 0, children (holes flip) before the next sibling.
+    """
+    order = []
+    stack = [(0, False)]
+    while stack:
+        index, hole = stack.pop()
+        order.append((index, hole))
+        [next, previous, first_child, parent] = hierarchy[index]
+        if next != -1:
+            stack.append((next, hole))
+        if first_child != -1:
+            stack.append((first_child, not hole))
+    return order
+
+def slice_to_contour_arrays(binary_slice):
+    """Trace the contours of a 2D uint8 mask (0 / 255). Returns ([(n_i, 2) int32 points], [hole])."""
+    contours, hierarchy = cv2.findContours(binary_slice, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) == 0:
+        return [], []
+
+    # hierarchy has shape (1, N, 4): [next, previous, first_child, parent] per contour
+    order = trace_contour_order(hierarchy[0])
+    return [contours[i].reshape(-1, 2) for i, _ in order], [hole for _, hole in order]
+
+def nonzero_bbox(mask, margin=0):
+    """
+    Bounding box of the nonzero voxels of a (z, y, x) array as a tuple of
+    slices, grown by `margin` voxels and clipped to the array; None if there
+    are none. The full array is traversed once (for z and y); x is only
+    searched inside the z/y box.
+    """
+    zy = mask.any(axis=2)
+    z = np.flatnonzero(zy.any(axis=1))
+    if z.size == 0:
+        return None
+    y = np.flatnonzero(zy.any(axis=0))
+    x = np.flatnonzero(mask[z[0]:z[-1] + 1, y[0]:y[-1] + 1].any(axis=(0, 1)))
+    return tuple(
+        slice(max(int(first) - margin, 0), min(int(last) + 1 + margin, n))
+        for first, last, n in ((z[0], z[-1], mask.shape[0]), (y[0], y[-1], mask.shape[1]), (x[0], x[-1], mask.shape[2]))
+    )
 
-        if slice_max == 1:
-            slice_2d = slice_2d * 255
+def label_array_to_contours(label_np, label_values, index_offset=(0, 0, 0)):
+    """
+    Contours of several labels of a (z, y, x) label array. Only the slices and
+    the sub-rectangle of the labels' bounding box are traced; points and slice
+    indices are shifted back to the array's index space, plus index_offset
+    ([x, y, z], e.g. the start of a cropped region in its full image).
 
-        # Find contours in the binary slice
-        contours, hierarchy = cv2.findContours(slice_2d, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    Returns {label_value: contour arrays} (see stack_contour_arrays()).
+    """
+    label_values = [int(v) for v in label_values]
+    collected = {v: ([], [], []) for v in label_values}  # point chunks, slices, holes
+
+    # one voxel of margin, so contours touching the box are traced as on the full slice
+    roi = nonzero_bbox(np.isin(label_np, label_values), margin=1)
+    if roi is None:
+        return {v: empty_contour_arrays() for v in label_values}
+
+    z_roi, y_roi, x_roi = roi
+    roi_np = label_np[roi]
+    offset_xy = np.array([x_roi.start + index_offset[0], y_roi.start + index_offset[1]], dtype=np.int32)
+    for k in range(roi_np.shape[0]):
+        slice_2d = roi_np[k]
+        present = set(np.unique(slice_2d).tolist())
+        for v in label_values:
+            if v not in present:
+                continue
+            binary_slice = (slice_2d == v).astype(np.uint8) * 255
+            point_chunks, holes = slice_to_contour_arrays(binary_slice)
+            collected[v][0].extend(chunk + offset_xy for chunk in point_chunks)
+            collected[v][1].extend([z_roi.start + k + index_offset[2]] * len(point_chunks))
+            collected[v][2].extend(holes)
+
+    return {v: stack_contour_arrays(*collected[v]) for v in label_values}
+
+def label_image_to_contours(label_image, label_values, index_offset=(0, 0, 0)):
+    """
+    Contours of several labels from a single pass over the occupied slices of a label image.
 
-        print(f'num contours={len(contours)}')
-        if len(contours) == 0:
-            continue
+    Returns {label_value: contour arrays} (see stack_contour_arrays()).
+    """
+    return label_array_to_contours(sitk.GetArrayViewFromImage(label_image), label_values, index_offset)
 
-        # The hierarchy array has the shape (1, N, 4), where N is the number of contours found. 
-        # Each element of the array is a vector of four integers [next, previous, first_child, parent]:
-        print(hierarchy.shape)
-        
-        # remove the first dim (which is always 1)
-        hierarchy = hierarchy[0] 
+def binary_image_to_contour(mask, index_offset=(0, 0, 0)):
+    """
+    Contour list ([{'slice', 'contours': [{'points', 'hole'}]}], index space) of
+    the nonzero voxels of a binary image (foreground 1 or 255).
+    """
+    mask_np = sitk.GetArrayViewFromImage(mask)
+    arrays = label_array_to_contours((mask_np != 0).view(np.uint8), [1], index_offset)[1]
+    return contour_arrays_to_list(arrays)
 
-        # check if any of the outer contour has child (hole)
-        cont_num = 0
-        hole = False
-        return_list = []
-        trace_contour(cont_num, contours, hierarchy, hole, return_list)
+def resample_roi_at_image_grid(image, grid_image, label_values=None, margin=1, interpolator=sitk.sitkNearestNeighbor):
+    """
+    Resample only the bounding box of the image's foreground (nonzero voxels,
+    or those of label_values) onto the part of grid_image's grid covering it.
 
-        contours_list_I.append({'slice':z, 'contours': return_list})
+    Returns (resampled ROI, its start index [x, y, z] in grid_image), or
+    (None, None) if there is no foreground on that grid.
+    """
+    image_np = sitk.GetArrayViewFromImage(image)
+    foreground = image_np != 0 if label_values is None else np.isin(image_np, [int(v) for v in label_values])
+    roi = nonzero_bbox(foreground, margin=margin)
+    if roi is None:
+        return None, None
+    z_roi, y_roi, x_roi = roi
+    roi_start = [x_roi.start, y_roi.start, z_roi.start]
+    roi_stop = [x_roi.stop, y_roi.stop, z_roi.stop]
+
+    # the ROI's corners (voxel edges) as continuous indices of grid_image
+    corners = np.array([
+        grid_image.TransformPhysicalPointToContinuousIndex(
+            image.TransformContinuousIndexToPhysicalPoint([float(c) - 0.5 for c in corner]))
+        for corner in np.array(np.meshgrid(*zip(roi_start, roi_stop), indexing='ij')).reshape(3, -1).T
+    ])
+    grid_size = np.array(grid_image.GetSize())
+    start = np.maximum(np.floor(corners.min(axis=0)).astype(int) - margin, 0)
+    stop = np.minimum(np.ceil(corners.max(axis=0)).astype(int) + 1 + margin, grid_size)
+    if np.any(stop <= start):
+        return None, None
+
+    cropped = sitk.RegionOfInterest(image, [int(b - a) for a, b in zip(roi_start, roi_stop)], [int(a) for a in roi_start])
 
-    return contours_list_I
+    resample = sitk.ResampleImageFilter()
+    resample.SetOutputSpacing(grid_image.GetSpacing())
+    resample.SetSize([int(n) for n in stop - start])
+    resample.SetOutputDirection(grid_image.GetDirection())
+    resample.SetOutputOrigin(grid_image.TransformIndexToPhysicalPoint([int(i) for i in start]))
+    resample.SetDefaultPixelValue(0)
+    resample.SetInterpolator(interpolator)
+    return resample.Execute(cropped), [int(i) for i in start]
     
 def binary_image_to_contour_list_json_files(binary_image_path, base_image_path=None, out_dir=None, skip_if_output_exists=True):
 
@@ -1167,18 +1304,17 @@ def binary_image_to_contour_list_json_files(binary_image_path, base_image_path=N
     # binary segmentation image
     binary_image = read_image(binary_image_path)
 
-    # if base_image is given, resample the seg at base image grid
+    # if base_image is given, resample the seg at base image grid (only its ROI) and get contours in I
     if base_image_path:
         base_image = read_image(base_image_path)
-
-        # resample
-        binary_image = resample_binary_image_at_image_grid(binary_image, base_image)
-
-    # get contours in I
-    contour_list_I = binary_image_to_contour(binary_image)
+        roi_image, roi_start = resample_roi_at_image_grid(binary_image, base_image)
+        contour_list_I = [] if roi_image is None else binary_image_to_contour(roi_image, index_offset=roi_start)
+        img_coord = get_image_coord_from_itkImage(base_image)
+    else:
+        contour_list_I = binary_image_to_contour(binary_image)
+        img_coord = get_image_coord_from_itkImage(binary_image)
 
     # convert to w 
-    img_coord = get_image_coord_from_itkImage(binary_image)
     contour_list_o = transform_contour_list(contour_list_I, img_coord.o_H_I())
     contour_list_w = transform_contour_list(contour_list_I, img_coord.w_H_I())
 
@@ -1189,6 +1325,142 @@ def binary_image_to_contour_list_json_files(binary_image_path, base_image_path=N
 
     return [os.path.basename(points_I_json), os.path.basename(points_o_json),os.path.basename(points_w_json)]
 
+def save_to_json_atomic(obj, json_file):
+    """Write JSON to a temp file and rename it, so readers never see a partial file."""
+    tmp_file = f'{json_file}.{os.getpid()}.tmp'
+    dict_helper.save_to_json(obj, tmp_file)
+    os.replace(tmp_file, json_file)
+
+def save_contour_arrays_npz(arrays, points_o, points_w, npz_file):
+    """
+    Compact binary contours: points_I (int16 when it fits), points_o/points_w (float32)
+    and the offsets/slices/holes arrays, written atomically as a compressed .npz.
+    """
+    points_I = arrays['points']
+    if points_I.size == 0 or (points_I.min() >= np.iinfo(np.int16).min and points_I.max() <= np.iinfo(np.int16).max):
+        points_I = points_I.astype(np.int16)
+
+    tmp_file = f'{npz_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez_compressed(
+            f,
+            points_I=points_I,
+            points_o=points_o.astype(np.float32),
+            points_w=points_w.astype(np.float32),
+            offsets=arrays['offsets'].astype(np.int64),
+            slices=arrays['slices'].astype(np.int32),
+            holes=arrays['holes'].astype(np.uint8),
+        )
+    os.replace(tmp_file, npz_file)
+
+def read_contour_npz_bytes(npz_file, point_keys):
+    """Bytes of a contours .npz reduced to the given points_* arrays (plus offsets, slices and holes)."""
+    all_point_keys = ['points_I', 'points_o', 'points_w']
+    if set(all_point_keys) <= set(point_keys):
+        with open(npz_file, 'rb') as f:
+            return f.read()
+
+    import io
+    with np.load(npz_file) as data:
+        keep = {k: data[k] for k in data.files if k not in all_point_keys or k in point_keys}
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **keep)
+    return buffer.getvalue()
+
+def label_statistics(label_image, label_values):
+    """Voxel count, volume (ml) and index bounding box [x0, y0, z0, x1, y1, z1] (inclusive) of each label."""
+    label_np = sitk.GetArrayFromImage(label_image)
+    voxel_volume_ml = float(np.prod(label_image.GetSpacing())) / 1000.0
+
+    stats = {}
+    for v in label_values:
+        mask = label_np == int(v)
+        count = int(np.count_nonzero(mask))
+        bbox = None
+        if count:
+            z = np.flatnonzero(mask.any(axis=(1, 2)))
+            y = np.flatnonzero(mask.any(axis=(0, 2)))
+            x = np.flatnonzero(mask.any(axis=(0, 1)))
+            bbox = [int(x[0]), int(y[0]), int(z[0]), int(x[-1]), int(y[-1]), int(z[-1])]
+        stats[int(v)] = {'voxels': count, 'volume_ml': count * voxel_volume_ml, 'bbox_I': bbox}
+    return stats
+
+def label_image_to_contour_list_json_files(label_image_path, label_values, out_dir=None, file_prefix=None, base_image_path=None, skip_if_output_exists=True, label_image=None):
+    """
+    Write the points_I/o/w contour JSON files of every label in `label_values`,
+    reading the label image once and without writing intermediate binary images.
+
+    Files are named {file_prefix}.{label}.mha.points_{I,o,w}.json, the names
+    binary_image_to_contour_list_json_files() produces for the per-label binary
+    images of composit_label_image_to_binary_images(). file_prefix defaults to
+    the label image file name. An already loaded `label_image` may be passed to
+    avoid reading label_image_path again.
+
+    The same contours are also written to {file_prefix}.{label}.mha.contours.npz
+    (see save_contour_arrays_npz()).
+
+    Returns {label_value: [points_I_json, points_o_json, points_w_json, contours_npz]} (file names).
+    """
+    if not os.path.exists(label_image_path):
+        raise Exception(f"Input file not found:{label_image_path}")
+
+    if out_dir is None:
+        out_dir = os.path.dirname(label_image_path)
+    elif not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    if file_prefix is None:
+        file_prefix = os.path.basename(label_image_path)
+
+    def output_files(label_value):
+        header = os.path.join(out_dir, f'{file_prefix}.{label_value}.mha')
+        return [header + '.points_I.json', header + '.points_o.json', header + '.points_w.json', header + '.contours.npz']
+
+    result = {}
+    pending = []
+    for v in label_values:
+        v = int(v)
+        files = output_files(v)
+        result[v] = [os.path.basename(f) for f in files]
+        if skip_if_output_exists and all(os.path.exists(f) for f in files):
+            continue
+        pending.append(v)
+
+    if not pending:
+        print('all output files exists. so, skipping...')
+        return result
+
+    if label_image is None:
+        label_image = read_image(label_image_path)
+
+    # if base_image is given, resample the labels at base image grid (only their ROI)
+    if base_image_path:
+        base_image = read_image(base_image_path)
+        roi_image, roi_start = resample_roi_at_image_grid(label_image, base_image, label_values=pending)
+        if roi_image is None:
+            contours_by_label = {v: empty_contour_arrays() for v in pending}
+        else:
+            contours_by_label = label_image_to_contours(roi_image, pending, index_offset=roi_start)
+        img_coord = get_image_coord_from_itkImage(base_image)
+    else:
+        contours_by_label = label_image_to_contours(label_image, pending)
+        img_coord = get_image_coord_from_itkImage(label_image)
+
+    o_H_I = img_coord.o_H_I()
+    w_H_I = img_coord.w_H_I()
+
+    for v in pending:
+        arrays = contours_by_label[v]
+        points_o = transform_contour_points(arrays, o_H_I)
+        points_w = transform_contour_points(arrays, w_H_I)
+        points_I_json, points_o_json, points_w_json, contours_npz = output_files(v)
+        save_to_json_atomic(contour_arrays_to_list(arrays), points_I_json)
+        save_to_json_atomic(contour_arrays_to_list(arrays, points_o), points_o_json)
+        save_to_json_atomic(contour_arrays_to_list(arrays, points_w), points_w_json)
+        save_contour_arrays_npz(arrays, points_o, points_w, contours_npz)
+
+    return result
+
 def get_image_slice_indices_of_non_zero_pixel_values(image_path):
 
     image = read_image(image_path)
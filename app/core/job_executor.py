@@ -0,0 +1,512 @@
+"""
+Job executor backends, selected by settings.JOB_PROCESSOR:
+
+    "rq"     RQ queues on settings.REDIS_URL, run by `rq worker` processes
+    "slurm"  one SLURM batch job per job, see SlurmExecutor
+    "local"  a process pool inside the API process, no external service
+
+All backends expose the same small interface (enqueue / fetch / cancel, and
+current_job_id / update_current_job_meta from inside a running job), so the
+callers don't import redis or rq themselves.
+
+The local backend keeps every job as a JSON record in
+settings.LOCAL_EXECUTOR_DIR (jobs/<id>.json) plus an empty marker in pending/
+while it is queued. An asyncio task in the API process dispatches pending jobs
+to a spawn-context ProcessPoolExecutor of LOCAL_EXECUTOR_WORKERS processes. It
+picks by priority first, then by fair share between groups (smallest virtual
+time, cost / weight), then in submission order. Jobs enqueued from inside a
+running job (another process) are picked up from the pending folder, which is
+polled every LOCAL_EXECUTOR_POLL_SEC. Queued jobs survive a restart; jobs that
+were running when the API stopped are marked failed. Pool processes are reused
+across jobs, so warm caches (e.g. the nnUNetPredictor cache) persist as with
+rq's SimpleWorker. job_timeout is not enforced by the local backend.
+
+The SLURM backend writes the same records to settings.SLURM_JOBS_DIR, which
+must be shared with the compute nodes, and submits scripts_dir/job.slurm
+running `python -m app.core.job_executor run <jobs dir> <job id>` with
+sbatch. The job records its result there; squeue/sacct are only asked (in one
+call for all jobs, cached for SLURM_POLL_TTL_SEC) while a job is queued or
+running, or to find out that it died. job_timeout becomes the --time limit.
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import importlib
+import traceback
+import threading
+import shlex
+import socket
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import slurm_tools
+
+logger = get_logger(__name__)
+
+
+def func_path(func) -> str:
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def _import_func(path: str):
+    module_name, qualname = path.split(":")
+    obj = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+class JobExecutor:
+    """Interface of the job backends."""
+
+    name = None
+
+    def enqueue(self, func, *args, queue: str = "default", job_timeout=None, result_ttl=None,
+                at_front: bool = False, **options) -> str:
+        """Queue func(*args). Returns the job id."""
+        raise NotImplementedError
+
+    def fetch(self, job_id: str) -> dict | None:
+        """{"id", "status", "meta", "result"} of a job, or None if unknown."""
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job. Returns False if it is not queued (anymore)."""
+        raise NotImplementedError
+
+    def current_job_id(self) -> str | None:
+        """Id of the job running in this process, if any."""
+        raise NotImplementedError
+
+    def update_current_job_meta(self, **meta):
+        """Merge `meta` into the metadata of the job running in this process."""
+        raise NotImplementedError
+
+
+# ---------------- RQ ----------------
+class RQExecutor(JobExecutor):
+    name = "rq"
+
+    def __init__(self, redis_url: str):
+        import redis
+        self.connection = redis.Redis.from_url(redis_url)
+
+    def enqueue(self, func, *args, queue: str = "default", job_timeout=None, result_ttl=None,
+                at_front: bool = False, **options) -> str:
+        from rq import Queue
+        kwargs = {"at_front": at_front}
+        if job_timeout is not None:
+            kwargs["job_timeout"] = job_timeout
+        if result_ttl is not None:
+            kwargs["result_ttl"] = result_ttl
+        return Queue(queue, connection=self.connection).enqueue(func, *args, **kwargs).id
+
+    def _fetch_job(self, job_id: str):
+        from rq.job import Job
+        from rq.exceptions import NoSuchJobError
+        try:
+            return Job.fetch(job_id, connection=self.connection)
+        except NoSuchJobError:
+            return None
+
+    def fetch(self, job_id: str) -> dict | None:
+        job = self._fetch_job(job_id)
+        if job is None:
+            return None
+        return {"id": job.id, "status": job.get_status(refresh=False), "meta": job.meta, "result": job.result}
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._fetch_job(job_id)
+        if job is None or job.get_status() != "queued":
+            return False
+        job.cancel()
+        return True
+
+    def current_job_id(self) -> str | None:
+        from rq import get_current_job
+        job = get_current_job()
+        return job.id if job else None
+
+    def update_current_job_meta(self, **meta):
+        from rq import get_current_job
+        job = get_current_job()
+        if job is not None:
+            job.meta.update(meta)
+            job.save_meta()
+
+
+# ---------------- job records on disk (local and SLURM) ----------------
+# id of the job running in this process
+_current_job_id = None
+
+
+def run_job(jobs_dir: str, job_id: str):
+    """Run the job of record jobs_dir/jobs/<job_id>.json in this process."""
+    global _current_job_id
+    with open(os.path.join(jobs_dir, "jobs", f"{job_id}.json"), "r") as f:
+        record = json.load(f)
+    _current_job_id = job_id
+    try:
+        func = _import_func(record["func"])
+        return func(*record["args"], **record["kwargs"])
+    finally:
+        _current_job_id = None
+
+
+class FileJobExecutor(JobExecutor):
+    """Base of the backends that keep their job records as JSON files in jobs_dir/jobs."""
+
+    def __init__(self, jobs_dir: str):
+        self.jobs_dir = jobs_dir
+        os.makedirs(os.path.join(jobs_dir, "jobs"), exist_ok=True)
+
+    def _record_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, "jobs", f"{job_id}.json")
+
+    def _meta_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, "jobs", f"{job_id}.meta.json")
+
+    def _read(self, path: str) -> dict | None:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: str, obj: dict):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f, indent=2, default=str)
+        os.replace(tmp_path, path)
+
+    def _update_record(self, job_id: str, **fields):
+        record = self._read(self._record_path(job_id)) or {"id": job_id}
+        record.update(fields)
+        self._write(self._record_path(job_id), record)
+
+    def _new_record(self, func, args, queue: str, **fields) -> dict:
+        job_id = str(uuid.uuid4())
+        record = {
+            "id": job_id,
+            "func": func_path(func),
+            "args": list(args),
+            "kwargs": {},
+            "queue": queue,
+            "status": "queued",
+            "enqueued_at": datetime.now().isoformat(),
+            **fields,
+        }
+        self._write(self._record_path(job_id), record)
+        return record
+
+    def _status(self, record: dict) -> str:
+        return record["status"]
+
+    def record(self, job_id: str) -> dict | None:
+        """The job's record: function, arguments, queue, status, result."""
+        return self._read(self._record_path(job_id))
+
+    def fetch(self, job_id: str) -> dict | None:
+        record = self._read(self._record_path(job_id))
+        if record is None:
+            return None
+        return {
+            "id": job_id,
+            "status": self._status(record),
+            "meta": self._read(self._meta_path(job_id)) or {},
+            "result": record.get("result"),
+        }
+
+    def current_job_id(self) -> str | None:
+        return _current_job_id
+
+    def update_current_job_meta(self, **meta):
+        job_id = _current_job_id
+        if job_id is None:
+            return
+        path = self._meta_path(job_id)
+        self._write(path, {**(self._read(path) or {}), **meta})
+
+
+# ---------------- Local process pool ----------------
+class LocalExecutor(FileJobExecutor):
+    name = "local"
+
+    def __init__(self, jobs_dir: str, max_workers: int):
+        super().__init__(jobs_dir)
+        self.max_workers = max_workers
+        os.makedirs(os.path.join(jobs_dir, "pending"), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending = {}  # job_id -> record, only in the dispatching process
+        self._vtime = {}  # fair-share group -> virtual time
+        self._running = 0
+        self._pool = None
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    def _pending_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, "pending", job_id)
+
+    def enqueue(self, func, *args, queue: str = "default", job_timeout=None, result_ttl=None,
+                at_front: bool = False, priority: int = 0, group: str | None = None,
+                cost: float = 1.0, weight: float = 1.0, **options) -> str:
+        record = self._new_record(
+            func, args, queue,
+            priority=priority - 1 if at_front else priority, group=group, cost=cost, weight=weight,
+        )
+        job_id = record["id"]
+        with open(self._pending_path(job_id), "w"):
+            pass
+        logger.info(f"Local job {job_id} ({record['func']}) queued on '{queue}'")
+        self._notify()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            record = self._read(self._record_path(job_id))
+            if record is None or record["status"] != "queued":
+                return False
+            self._pending.pop(job_id, None)
+            try:
+                os.remove(self._pending_path(job_id))
+            except FileNotFoundError:
+                pass
+            self._update_record(job_id, status="canceled", ended_at=datetime.now().isoformat())
+        return True
+
+    def pending(self) -> list[dict]:
+        """Records of the queued jobs."""
+        records = []
+        for job_id in os.listdir(os.path.join(self.jobs_dir, "pending")):
+            record = self._read(self._record_path(job_id))
+            if record is not None and record["status"] == "queued":
+                records.append(record)
+        return records
+
+    # -- dispatcher (API process only) --
+    def start(self):
+        """Start dispatching; call from the running event loop (FastAPI startup)."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._recover()
+        self._task = self._loop.create_task(self._dispatch_loop())
+        logger.info(f"Local job executor started with {self.max_workers} workers in {self.jobs_dir}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._pool is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._pool.shutdown)
+
+    def _notify(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _recover(self):
+        """Jobs left running by a previous API process can't be resumed."""
+        for name in os.listdir(os.path.join(self.jobs_dir, "jobs")):
+            if not name.endswith(".json") or name.endswith(".meta.json"):
+                continue
+            record = self._read(os.path.join(self.jobs_dir, "jobs", name))
+            if record and record.get("status") == "started":
+                logger.warning(f"Local job {record['id']} was interrupted by a restart")
+                self._update_record(record["id"], status="failed", exc_info="interrupted by a restart",
+                                    ended_at=datetime.now().isoformat())
+
+    def _load_pending(self):
+        for job_id in os.listdir(os.path.join(self.jobs_dir, "pending")):
+            if job_id in self._pending or job_id.endswith(".tmp"):
+                continue
+            record = self._read(self._record_path(job_id))
+            if record is None or record["status"] != "queued":
+                continue
+            group = record.get("group")
+            if group is not None and not any(r.get("group") == group for r in self._pending.values()):
+                # (re)activated group: no credit for the time it had nothing queued
+                floor = min(self._vtime.values(), default=0.0)
+                self._vtime[group] = max(self._vtime.get(group, 0.0), floor)
+            self._pending[job_id] = record
+
+    def _pick(self) -> dict | None:
+        if not self._pending:
+            return None
+        record = min(
+            self._pending.values(),
+            key=lambda r: (r["priority"], self._vtime.get(r.get("group"), 0.0), r["enqueued_at"]),
+        )
+        del self._pending[record["id"]]
+        group = record.get("group")
+        if group is not None:
+            self._vtime[group] = self._vtime.get(group, 0.0) + record["cost"] / max(record["weight"], 1e-6)
+        return record
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.LOCAL_EXECUTOR_POLL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            with self._lock:
+                self._load_pending()
+                while self._running < self.max_workers:
+                    record = self._pick()
+                    if record is None:
+                        break
+                    try:
+                        os.remove(self._pending_path(record["id"]))
+                    except FileNotFoundError:
+                        continue  # cancelled meanwhile
+                    self._update_record(record["id"], status="started", started_at=datetime.now().isoformat())
+                    self._running += 1
+                    self._loop.create_task(self._run(record))
+
+    async def _run(self, record: dict):
+        job_id = record["id"]
+        pool = self._pool
+        try:
+            result = await self._loop.run_in_executor(pool, run_job, self.jobs_dir, job_id)
+            self._update_record(job_id, status="finished", result=result, ended_at=datetime.now().isoformat())
+        except BrokenProcessPool:
+            # a pool process died (e.g. out of memory); the pool can't be used anymore
+            logger.error(f"Local job {job_id} failed: a worker process died, restarting the pool")
+            self._update_record(job_id, status="failed", exc_info=traceback.format_exc(),
+                                ended_at=datetime.now().isoformat())
+            if self._pool is pool:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+        except Exception:
+            logger.error(f"Local job {job_id} failed")
+            self._update_record(job_id, status="failed", exc_info=traceback.format_exc(),
+                                ended_at=datetime.now().isoformat())
+        finally:
+            self._running -= 1
+            self._wakeup.set()
+
+
+# ---------------- SLURM ----------------
+# repository root; the nodes run the jobs from there (see scripts/job.slurm)
+APP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SlurmExecutor(FileJobExecutor):
+    name = "slurm"
+
+    def __init__(self, jobs_dir: str):
+        super().__init__(jobs_dir)
+        os.makedirs(os.path.join(jobs_dir, "logs"), exist_ok=True)
+        self._states = slurm_tools.StatusCache(settings.SLURM_POLL_TTL_SEC)
+
+    def enqueue(self, func, *args, queue: str = "default", job_timeout=None, result_ttl=None,
+                at_front: bool = False, **options) -> str:
+        record = self._new_record(func, args, queue)
+        job_id = record["id"]
+        script_file = os.path.join(self.jobs_dir, "jobs", f"{job_id}.slurm")
+        log_file = os.path.join(self.jobs_dir, "logs", f"{job_id}.log")
+        slurm_tools.render_template(
+            slurm_tools.default_job_template(),
+            script_file,
+            job_name=queue,
+            log_file=log_file,
+            venv_dir=settings.venv_dir,
+            app_dir=APP_DIR,
+            data_dir=settings.NNUNET_DATA_DIR,
+            cmd_lines=f"python -m app.core.job_executor run {shlex.quote(self.jobs_dir)} {job_id}",
+        )
+
+        sbatch_options = []
+        if job_timeout is not None:
+            sbatch_options += ["--time", slurm_tools.time_limit(job_timeout)]
+        try:
+            slurm_job_id = slurm_tools.sbatch(script_file, *sbatch_options)
+        except Exception as e:
+            self._update_record(job_id, status="failed", exc_info=f"sbatch failed: {e}")
+            raise
+        self._update_record(job_id, slurm_job_id=slurm_job_id, log_file=log_file)
+        logger.info(f"SLURM job {job_id} ({record['func']}) submitted as {slurm_job_id}")
+        return job_id
+
+    def _status(self, record: dict) -> str:
+        # the job writes its own final status; SLURM tells the rest
+        if record["status"] in slurm_tools.FINAL_STATUSES or not record.get("slurm_job_id"):
+            return record["status"]
+        state = self._states.state(record["slurm_job_id"])
+        if state is None:
+            return record["status"]
+
+        status = slurm_tools.job_status(state)
+        if status in ("failed", "canceled"):
+            # killed before it could record it (time limit, node failure, scancel)
+            record = self.record(record["id"]) or record
+            if record["status"] not in slurm_tools.FINAL_STATUSES:
+                self._update_record(record["id"], status=status, slurm_state=state,
+                                    ended_at=datetime.now().isoformat())
+                return status
+            return record["status"]
+        return status
+
+    def cancel(self, job_id: str) -> bool:
+        record = self.record(job_id)
+        if record is None or not record.get("slurm_job_id") or self._status(record) != "queued":
+            return False
+        slurm_tools.scancel(record["slurm_job_id"])
+        self._update_record(job_id, status="canceled", ended_at=datetime.now().isoformat())
+        return True
+
+
+def run_job_and_record(jobs_dir: str, job_id: str) -> int:
+    """Run a job of a FileJobExecutor in this process and record its outcome. Returns the exit code."""
+    store = FileJobExecutor(jobs_dir)
+    store._update_record(job_id, status="started", started_at=datetime.now().isoformat(),
+                         host=socket.gethostname())
+    try:
+        result = run_job(jobs_dir, job_id)
+    except Exception:
+        logger.exception(f"Job {job_id} failed")
+        store._update_record(job_id, status="failed", exc_info=traceback.format_exc(),
+                             ended_at=datetime.now().isoformat())
+        return 1
+    store._update_record(job_id, status="finished", result=result, ended_at=datetime.now().isoformat())
+    return 0
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> JobExecutor:
+    """The process-wide executor of settings.JOB_PROCESSOR."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if settings.JOB_PROCESSOR == "local":
+                jobs_dir = settings.LOCAL_EXECUTOR_DIR or os.path.join(settings.NNUNET_DATA_DIR, "local_jobs")
+                _executor = LocalExecutor(jobs_dir, settings.LOCAL_EXECUTOR_WORKERS)
+            elif settings.JOB_PROCESSOR == "slurm":
+                jobs_dir = settings.SLURM_JOBS_DIR or os.path.join(settings.NNUNET_DATA_DIR, "slurm_jobs")
+                _executor = SlurmExecutor(jobs_dir)
+            else:
+                _executor = RQExecutor(settings.REDIS_URL)
+        return _executor
+
+
+if __name__ == "__main__":
+    # python -m app.core.job_executor run <jobs dir> <job id>   (SLURM batch script)
+    import sys
+    # through the package module, so jobs see the current job id they import from there
+    from app.core import job_executor
+    if len(sys.argv) != 4 or sys.argv[1] != "run":
+        sys.exit("usage: python -m app.core.job_executor run <jobs dir> <job id>")
+    sys.exit(job_executor.run_job_and_record(sys.argv[2], sys.argv[3]))
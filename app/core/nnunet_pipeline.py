@@ -0,0 +1,243 @@
+"""
+Staged prediction pipeline (settings.PREDICT_MODE = "pipeline").
+
+nnUNetv2_predict does preprocessing, network inference and resampling/export
+of every case in one process, so the GPU idles while the CPU resamples and
+writes .mha files. In pipeline mode a request goes through three jobs on
+separate queues, each served by its own worker pool:
+
+    nnunet_preprocess  (CPU)  resample/normalize the input to network spacing
+    nnunet_infer       (GPU)  sliding-window inference to logits, warm predictor
+    nnunet_export      (CPU)  resample logits to the original geometry, write the
+                              segmentation, contours and summary
+
+Stages hand their arrays over on disk in req_*/_pipeline/ (np.save, read back
+memory-mapped), and each stage enqueues the next one when it is done. The GPU
+worker thus only ever runs inference while CPU workers preprocess the next
+requests and export the previous ones. Interactive requests are enqueued at
+the front of each stage queue.
+
+Start the workers with scripts/start_pipeline_workers.sh. With the local job
+executor (settings.JOB_PROCESSOR = "local") the stages share its process pool.
+"""
+
+import os
+import json
+import time
+import pickle
+import shutil
+from datetime import datetime
+import numpy as np
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import job_executor, nnunet_worker, prediction_cancel, prediction_progress
+
+logger = get_logger(__name__)
+
+# nnU-Net directories
+nnunet_data_dir = settings.NNUNET_DATA_DIR
+nnunet_results_dir = os.path.join(nnunet_data_dir, 'results')
+
+PREPROCESS_QUEUE = "nnunet_preprocess"
+INFER_QUEUE = "nnunet_infer"
+EXPORT_QUEUE = "nnunet_export"
+
+PIPELINE_DIR_NAME = "_pipeline"
+
+STAGE_JOB_TIMEOUT = "1h"
+
+
+def _pipeline_dir(job_metadata: dict) -> str:
+    return os.path.join(job_metadata["input_dir"], PIPELINE_DIR_NAME)
+
+
+def _enqueue(queue_name: str, func, job_metadata: dict) -> str:
+    return job_executor.get_executor().enqueue(
+        func,
+        job_metadata,
+        queue=queue_name,
+        job_timeout=STAGE_JOB_TIMEOUT,
+        result_ttl=86400,
+        at_front=job_metadata.get("lane") == "interactive",
+    )
+
+
+def _load_plans(job_metadata: dict):
+    """(plans_manager, configuration_manager, dataset_json) of the request's model, without loading any checkpoint."""
+    from nnunetv2.utilities.plans_handling.plans_handler import PlansManager
+    from app.core import nnunet_tools
+
+    model_folder = nnunet_tools.get_model_folder(
+        nnunet_results_dir,
+        job_metadata["dataset_id"],
+        job_metadata.get("configuration", "3d_lowres"),
+        job_metadata.get("trainer", "nnUNetTrainer"),
+        job_metadata.get("plans", "nnUNetPlans"),
+    )
+    if model_folder is None:
+        raise FileNotFoundError(f"Dataset {job_metadata['dataset_id']} not found in {nnunet_results_dir}")
+
+    with open(os.path.join(model_folder, "dataset.json"), "r") as f:
+        dataset_json = json.load(f)
+    with open(os.path.join(model_folder, "plans.json"), "r") as f:
+        plans = json.load(f)
+    plans_manager = PlansManager(plans)
+    configuration_manager = plans_manager.get_configuration(job_metadata.get("configuration", "3d_lowres"))
+    return plans_manager, configuration_manager, dataset_json, model_folder
+
+
+def _report(job_metadata: dict, stage: str, cases_done: int, cases_total: int):
+    """Record the pipeline stage in state.json and the current job's meta (see prediction_progress)."""
+    executor = job_executor.get_executor()
+    fields = {}
+    if stage == "preprocessing" and cases_done == 0:
+        fields = {"started_at": datetime.now().isoformat(), "stage_seconds": {}}
+    prediction_progress.write_state(
+        job_metadata["input_dir"], status="running", job_id=job_metadata["job_id"],
+        rq_job_id=executor.current_job_id(), pipeline_stage=stage, **fields,
+    )
+    executor.update_current_job_meta(progress={
+        "stage": stage,
+        "cases_total": cases_total,
+        "cases_done": cases_done,
+        "fraction": round(cases_done / cases_total, 4) if cases_total else 0.0,
+        "updated_at": datetime.now().isoformat(),
+    })
+
+
+def _log(job_metadata: dict, message: str):
+    logger.info(f"[{job_metadata['job_id']}] {message}")
+    with open(prediction_progress.log_path(job_metadata["input_dir"]), "a") as f:
+        f.write(f"=== {message} at {datetime.now().isoformat()} ===\n")
+
+
+def _run_stage(job_metadata: dict, stage: str, body, then=None):
+    """Common cancel check, timing, error handling and cleanup of a stage job; then(result) runs after the timing."""
+    if prediction_cancel.is_cancelled(job_metadata["input_dir"]):
+        shutil.rmtree(_pipeline_dir(job_metadata), ignore_errors=True)
+        return nnunet_worker.cancel_request(job_metadata, pipeline_stage=stage)
+    try:
+        _log(job_metadata, f"{stage} started")
+        started = time.time()
+        result = body()
+        prediction_progress.add_stage_seconds(job_metadata["input_dir"], {stage: time.time() - started})
+        _log(job_metadata, f"{stage} finished")
+        return then(result) if then is not None else result
+    except prediction_cancel.PredictionCancelled:
+        # cancelled between two cases: the next stage is not enqueued
+        shutil.rmtree(_pipeline_dir(job_metadata), ignore_errors=True)
+        return nnunet_worker.cancel_request(job_metadata, pipeline_stage=stage)
+    except Exception as e:
+        logger.exception(f"[{job_metadata['job_id']}] Exception in pipeline stage {stage}: {e}")
+        shutil.rmtree(_pipeline_dir(job_metadata), ignore_errors=True)
+        return nnunet_worker.fail_request(job_metadata, pipeline_stage=stage, error=str(e))
+
+
+def submit(job_metadata: dict):
+    """Start the pipeline of a request. Returns the job result of the calling (slot) job."""
+    os.makedirs(_pipeline_dir(job_metadata), exist_ok=True)
+    job_id = _enqueue(PREPROCESS_QUEUE, preprocess_request, job_metadata)
+    logger.info(f"[{job_metadata['job_id']}] Pipeline started, preprocessing job {job_id}")
+    return {"status": "pipelined", "job_id": job_metadata["job_id"], "preprocess_job_id": job_id}
+
+
+def preprocess_request(job_metadata: dict) -> dict:
+    """Stage 1 (CPU): preprocess every case of the request to network spacing."""
+    def body():
+        from nnunetv2.utilities.utils import create_lists_from_splitted_dataset_folder, get_identifiers_from_splitted_dataset_folder
+
+        plans_manager, configuration_manager, dataset_json, _ = _load_plans(job_metadata)
+        input_dir = job_metadata["input_dir"]
+        file_ending = dataset_json["file_ending"]
+        case_files = create_lists_from_splitted_dataset_folder(input_dir, file_ending)
+        case_ids = get_identifiers_from_splitted_dataset_folder(input_dir, file_ending)
+        preprocessor = configuration_manager.preprocessor_class(verbose=False)
+
+        pipeline_dir = _pipeline_dir(job_metadata)
+        for k, (case_id, files) in enumerate(zip(case_ids, case_files)):
+            _report(job_metadata, "preprocessing", k, len(case_ids))
+            data, _, properties = preprocessor.run_case(files, None, plans_manager, configuration_manager, dataset_json)
+            np.save(os.path.join(pipeline_dir, f"{case_id}.data.npy"), data.astype(np.float32, copy=False))
+            with open(os.path.join(pipeline_dir, f"{case_id}.properties.pkl"), "wb") as f:
+                pickle.dump(properties, f)
+
+        job_id = _enqueue(INFER_QUEUE, infer_request, {**job_metadata, "case_ids": case_ids})
+        return {"status": "preprocessed", "job_id": job_metadata["job_id"], "infer_job_id": job_id}
+
+    return _run_stage(job_metadata, "preprocessing", body)
+
+
+def infer_request(job_metadata: dict) -> dict:
+    """Stage 2 (GPU): logits of every preprocessed case, with the warm cached predictor."""
+    def body():
+        import torch
+        from app.core import nnunet_predictor_cache
+
+        predictor = nnunet_predictor_cache.get_predictor(
+            job_metadata["dataset_id"],
+            job_metadata.get("configuration", "3d_lowres"),
+            job_metadata.get("trainer", "nnUNetTrainer"),
+            job_metadata.get("plans", "nnUNetPlans"),
+            job_metadata.get("folds", [0, 1, 2, 3, 4]),
+            job_metadata.get("device", "gpu"),
+        )
+        predictor.use_mirroring = job_metadata.get("use_mirroring", True)
+        predictor.tile_step_size = job_metadata.get("tile_step_size", 0.5)
+
+        pipeline_dir = _pipeline_dir(job_metadata)
+        case_ids = job_metadata["case_ids"]
+        for k, case_id in enumerate(case_ids):
+            _report(job_metadata, "predicting", k, len(case_ids))
+            data_path = os.path.join(pipeline_dir, f"{case_id}.data.npy")
+            # memory-mapped: pages are read as the sliding window reaches them
+            data = torch.from_numpy(np.load(data_path, mmap_mode="r"))
+            logits = predictor.predict_logits_from_preprocessed_data(data).cpu().numpy()
+            del data
+            # half precision halves the hand-over I/O; export only needs softmax/argmax
+            np.save(os.path.join(pipeline_dir, f"{case_id}.logits.npy"), logits.astype(np.float16))
+            os.remove(data_path)
+
+            if prediction_cancel.is_cancelled(job_metadata["input_dir"]):
+                raise prediction_cancel.PredictionCancelled()
+
+        job_id = _enqueue(EXPORT_QUEUE, export_request, job_metadata)
+        return {"status": "predicted", "job_id": job_metadata["job_id"], "export_job_id": job_id}
+
+    return _run_stage(job_metadata, "predicting", body)
+
+
+def export_request(job_metadata: dict) -> dict:
+    """Stage 3 (CPU): resample the logits, write the segmentations and finalize the request."""
+    def body():
+        from nnunetv2.inference.export_prediction import export_prediction_from_logits
+
+        plans_manager, configuration_manager, dataset_json, model_folder = _load_plans(job_metadata)
+        pipeline_dir = _pipeline_dir(job_metadata)
+        output_dir = os.path.join(job_metadata["input_dir"], "outputs")
+        os.makedirs(output_dir, exist_ok=True)
+
+        case_ids = job_metadata["case_ids"]
+        for k, case_id in enumerate(case_ids):
+            _report(job_metadata, "exporting", k, len(case_ids))
+            logits = np.load(os.path.join(pipeline_dir, f"{case_id}.logits.npy"), mmap_mode="r").astype(np.float32)
+            with open(os.path.join(pipeline_dir, f"{case_id}.properties.pkl"), "rb") as f:
+                properties = pickle.load(f)
+            # written under a scratch name and renamed, so readers never see a partial file
+            export_prediction_from_logits(
+                logits, properties, configuration_manager, plans_manager, dataset_json,
+                os.path.join(pipeline_dir, case_id), save_probabilities=False,
+            )
+            fname = f"{case_id}{dataset_json['file_ending']}"
+            os.replace(os.path.join(pipeline_dir, fname), os.path.join(output_dir, fname))
+
+        # the sidecar files nnUNetv2_predict leaves next to its outputs
+        for fname in ("dataset.json", "plans.json"):
+            shutil.copy2(os.path.join(model_folder, fname), os.path.join(output_dir, fname))
+
+        shutil.rmtree(pipeline_dir, ignore_errors=True)
+        return output_dir
+
+    def finalize(output_dir):
+        return nnunet_worker.finalize_request(job_metadata, output_dir, pipeline=True)
+
+    return _run_stage(job_metadata, "exporting", body, then=finalize)
@@ -1,6 +1,7 @@
 from pathlib import Path
 from app.core.config import settings
 from app.core.logging_config import get_logger
+from app.core import slurm_tools
 import subprocess
 import os
 
@@ -68,10 +69,11 @@ def plan_and_preprocess_slurm(dataset_num, planner, verify_dataset_integrity):
     with open(script_file, 'w') as file:
         file.write(txt)
 
-    # sbatch
-    cmd = f'module load slurm && sbatch {script_file}'
-    logger.info(f'running "{cmd}"')
-    subprocess.run(cmd, shell=True)
+    # sbatch (after settings.SLURM_SETUP, e.g. "module load slurm")
+    logger.info(f'submitting {script_file}')
+    slurm_job_id = slurm_tools.sbatch(script_file)
+    logger.info(f'slurm_job_id={slurm_job_id}')
+    return slurm_job_id
 
 def plan_and_preprocess_sh(dataset_num, planner, verify_dataset_integrity):
     logger.info(f'plan_and_preprocess_sh(dataset_num={dataset_num}, planner={planner}, verify_dataset_integrity={verify_dataset_integrity})')
@@ -0,0 +1,137 @@
+"""
+Warm cache of nnUNetPredictor instances for the in-process worker mode.
+
+Loading torch, nnunetv2 and all fold checkpoints dominates the latency of a
+single prediction on small volumes. This module keeps initialized predictors
+resident in the worker process, keyed by
+(dataset, configuration, trainer, plans, folds), and evicts the least recently
+used ones when the summed parameter size exceeds
+settings.PREDICTOR_CACHE_MAX_MB.
+
+The cache only survives across jobs when the RQ worker does not fork a new
+work horse per job, i.e. run it as:
+
+    rq worker -w rq.worker.SimpleWorker nnunet_jobs_interactive nnunet_jobs nnunet_jobs_bulk
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from app.core.config import settings
+from app.core.logging_config import get_logger
+import app.core.nnunet_tools as nnunet_tools
+
+logger = get_logger(__name__)
+
+# nnU-Net directories
+nnunet_data_dir = settings.NNUNET_DATA_DIR
+nnunet_raw_dir = os.path.join(nnunet_data_dir, 'raw')
+nnunet_preprocessed_dir = os.path.join(nnunet_data_dir, 'preprocessed')
+nnunet_results_dir = os.path.join(nnunet_data_dir, 'results')
+
+# nnunetv2 reads these at import time
+os.environ.setdefault("nnUNet_raw", nnunet_raw_dir)
+os.environ.setdefault("nnUNet_preprocessed", nnunet_preprocessed_dir)
+os.environ.setdefault("nnUNet_results", nnunet_results_dir)
+
+DEFAULT_FOLDS = (0, 1, 2, 3, 4)
+
+_cache = OrderedDict()  # key -> (predictor, size_bytes)
+_cache_lock = threading.Lock()
+
+
+def make_key(dataset_id, configuration, trainer, plans, folds):
+    return (str(dataset_id), configuration, trainer, plans, tuple(int(f) for f in folds))
+
+
+def get_model_folder(dataset_id, configuration, trainer, plans):
+    model_folder = nnunet_tools.get_model_folder(nnunet_results_dir, dataset_id, configuration, trainer, plans)
+    if model_folder is None:
+        raise FileNotFoundError(f"Dataset {dataset_id} not found in {nnunet_results_dir}")
+    return model_folder
+
+
+def get_device(device):
+    import torch
+    if device in ("gpu", "cuda") and torch.cuda.is_available():
+        return torch.device("cuda", 0)
+    if device == "mps" and torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def _predictor_size_bytes(predictor):
+    """Memory estimate: the parameters of every loaded fold."""
+    size = 0
+    for params in predictor.list_of_parameters:
+        for tensor in params.values():
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def _evict_to_budget():
+    budget = settings.PREDICTOR_CACHE_MAX_MB * 1024 * 1024
+    total = sum(size for _, size in _cache.values())
+    # always keep the most recently used predictor, even if it alone exceeds the budget
+    while len(_cache) > 1 and total > budget:
+        key, (predictor, size) = _cache.popitem(last=False)
+        total -= size
+        logger.info(f"Evicting predictor {key} ({size / 1024 / 1024:.1f} MB) from cache")
+        del predictor
+
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+def get_predictor(dataset_id, configuration, trainer="nnUNetTrainer", plans="nnUNetPlans", folds=DEFAULT_FOLDS, device="gpu"):
+    """Return an initialized nnUNetPredictor, loading it on a cache miss."""
+    key = make_key(dataset_id, configuration, trainer, plans, folds)
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            logger.info(f"Predictor cache hit: {key}")
+            return _cache[key][0]
+
+        logger.info(f"Predictor cache miss: {key}. Loading checkpoints...")
+        from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+
+        predictor = nnUNetPredictor(
+            tile_step_size=0.5,
+            use_gaussian=True,
+            use_mirroring=True,
+            perform_everything_on_device=True,
+            device=get_device(device),
+            verbose=False,
+            verbose_preprocessing=False,
+            allow_tqdm=True,  # sliding-window progress, parsed by prediction_progress
+        )
+        predictor.initialize_from_trained_model_folder(
+            get_model_folder(dataset_id, configuration, trainer, plans),
+            use_folds=key[4],
+            checkpoint_name="checkpoint_final.pth",
+        )
+
+        size = _predictor_size_bytes(predictor)
+        _cache[key] = (predictor, size)
+        logger.info(f"Loaded predictor {key} ({size / 1024 / 1024:.1f} MB)")
+        _evict_to_budget()
+        return predictor
+
+
+def clear():
+    with _cache_lock:
+        _cache.clear()
+        _evict_to_budget()
+
+
+def cache_info():
+    with _cache_lock:
+        return [
+            {"key": list(key), "size_mb": size / 1024 / 1024}
+            for key, (_, size) in _cache.items()
+        ]
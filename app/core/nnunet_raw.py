@@ -1,4 +1,5 @@
-import re, os, json
+import re, os, json, copy
+import threading
 from pathlib import Path
 import aiofiles
 import asyncio
@@ -30,15 +31,95 @@ def get_dataset_dirs() -> list[str]:
     return [entry.name for entry in Path(nnunet_raw_dir).iterdir() 
             if entry.is_dir() and re.match(pattern, entry.name)]
 
+# dataset.json files this process has read (of the raw datasets, and the copies
+# next to prediction outputs), keyed by path and validated against the file's
+# mtime, size and inode: on an NFS-mounted data dir a stat is much cheaper than
+# opening and parsing the file on every request. Writes through
+# write_dataset_json() update the entry directly.
+_dataset_json_cache = {}  # json file path -> ((mtime_ns, size, inode), dataset.json dict)
+_dataset_json_lock = threading.Lock()
+# prediction outputs each have their own copy; the oldest entries make room
+DATASET_JSON_CACHE_MAX_ENTRIES = 256
+
+
+def dataset_json_path(dirname: str) -> str:
+    return os.path.join(nnunet_raw_dir, dirname, 'dataset.json')
+
+
+def _file_key(json_file: str) -> tuple[int, int, int]:
+    st = os.stat(json_file)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _cached_dataset_json(json_file: str, key: tuple) -> dict | None:
+    with _dataset_json_lock:
+        entry = _dataset_json_cache.get(json_file)
+    if entry is None or entry[0] != key:
+        return None
+    # callers modify what they get (e.g. the image counters), never the cached dict
+    return copy.deepcopy(entry[1])
+
+
+def _cache_dataset_json(json_file: str, key: tuple, data: dict) -> dict:
+    with _dataset_json_lock:
+        _dataset_json_cache.pop(json_file, None)
+        while len(_dataset_json_cache) >= DATASET_JSON_CACHE_MAX_ENTRIES:
+            del _dataset_json_cache[next(iter(_dataset_json_cache))]
+        _dataset_json_cache[json_file] = (key, copy.deepcopy(data))
+    return data
+
+
+def load_dataset_json_file(json_file: str) -> dict:
+    """
+    Contents of a dataset.json file (a copy), from the cache while the file is
+    unchanged. Raises FileNotFoundError if it doesn't exist.
+    """
+    try:
+        key = _file_key(json_file)
+    except FileNotFoundError:
+        with _dataset_json_lock:
+            _dataset_json_cache.pop(json_file, None)
+        raise
+    data = _cached_dataset_json(json_file, key)
+    if data is None:
+        with open(json_file, 'r') as f:
+            data = _cache_dataset_json(json_file, key, json.load(f))
+    return data
+
+
+def load_dataset_json(dirname: str) -> dict:
+    """
+    Contents of the dataset's dataset.json (a copy, without 'id'). Raises
+    FileNotFoundError if the dataset doesn't exist.
+    """
+    return load_dataset_json_file(dataset_json_path(dirname))
+
+
+def write_dataset_json(dirname: str, data: dict):
+    """Replace the dataset's dataset.json atomically and update the cache."""
+    json_file = dataset_json_path(dirname)
+    data = {k: v for k, v in data.items() if k != 'id'}
+    # per-process and -thread temp name: concurrent writers (routes run it in the threadpool)
+    # never share or rename away each other's file
+    tmp_file = f'{json_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_file, json_file)
+    _cache_dataset_json(json_file, _file_key(json_file), data)
+
+
 async def read_dataset_json(dirname: str) -> dict | None:
-    """Read dataset.json file asynchronously."""
-    json_file = os.path.join(nnunet_raw_dir, dirname, 'dataset.json')
+    """Read dataset.json file asynchronously (from the cache if unchanged), with 'id' set."""
+    json_file = dataset_json_path(dirname)
     try:
-        async with aiofiles.open(json_file, 'r') as f:
-            data = await f.read()
-            data_dict = json.loads(data)
-            data_dict['id'] = dirname
-            return data_dict
+        key = _file_key(json_file)
+        data_dict = _cached_dataset_json(json_file, key)
+        if data_dict is None:
+            async with aiofiles.open(json_file, 'r') as f:
+                data = await f.read()
+            data_dict = _cache_dataset_json(json_file, key, json.loads(data))
+        data_dict['id'] = dirname
+        return data_dict
     except Exception as e:
         logger.error(f'Failed reading file {json_file}. Exception: {e}')
         return None
@@ -46,17 +127,13 @@ async def read_dataset_json(dirname: str) -> dict | None:
 async def get_image_name_list(dataset_id: str) -> dict:
     """Return lists of training/test image and label filenames."""
     dataset_path = os.path.join(nnunet_raw_dir, dataset_id)
-    dataset_json_path = os.path.join(dataset_path, "dataset.json")
 
-    if not os.path.exists(dataset_json_path):
+    if not os.path.exists(dataset_json_path(dataset_id)):
         raise FileNotFoundError(f'Dataset {dataset_id} not found')
 
-    try:
-        async with aiofiles.open(dataset_json_path, "r") as f:
-            data = await f.read()
-            dataset_info = json.loads(data)
-    except Exception as e:
-        raise Exception(f"Failed to read dataset.json: {str(e)}")
+    dataset_info = await read_dataset_json(dataset_id)
+    if dataset_info is None:
+        raise Exception("Failed to read dataset.json")
 
     file_ending = dataset_info.get("file_ending")
     if not file_ending:
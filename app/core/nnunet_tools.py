@@ -47,6 +47,26 @@ def find_label_files(folder: str, file_ending):
         
     return sorted(result, key=lambda x: x["num"])
 
+def get_dataset_name(base_dir: str, dataset_id) -> str | None:
+    """Resolve '15', '015' or 'Dataset015_Name' to the DatasetXXX_Name folder in base_dir."""
+    dataset_id = str(dataset_id)
+    if dataset_id.startswith("Dataset"):
+        return dataset_id
+    if not dataset_id.isdigit() or not os.path.exists(base_dir):
+        return None
+    prefix = f"Dataset{int(dataset_id):03d}_"
+    for name in os.listdir(base_dir):
+        if name.startswith(prefix):
+            return name
+    return None
+
+def get_model_folder(results_dir: str, dataset_id, configuration: str, trainer: str, plans: str) -> str | None:
+    """Return results/<DatasetXXX_Name>/<trainer>__<plans>__<configuration>, or None if the dataset is unknown."""
+    dataset_name = get_dataset_name(results_dir, dataset_id)
+    if dataset_name is None:
+        return None
+    return os.path.join(results_dir, dataset_name, f"{trainer}__{plans}__{configuration}")
+
 if __name__ == '__main__':
 
     from config import get_config
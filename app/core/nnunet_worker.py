@@ -4,21 +4,347 @@ RQ Worker task for nnU-Net inference.
 This worker is executed automatically by RQ when a job is enqueued
 from FastAPI (/submit).  It performs inference using nnUNetv2_predict
 and stores the segmentation result in the configured results directory.
+
+settings.PREDICT_MODE selects how inference runs:
+    "script"     - shell out to scripts/nnunet_predict.sh for every job
+    "in_process" - predict with a warm nnUNetPredictor kept resident in the
+                   worker (see app/core/nnunet_predictor_cache.py)
+    "pipeline"   - hand the request to separate preprocess, GPU inference and
+                   export jobs (see app/core/nnunet_pipeline.py)
 """
 
 import os
+import re
+import time
+import shutil
 import subprocess
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from app.core.config import settings
 from app.core.logging_config import get_logger
+from app.core import prediction_cache, prediction_cancel, prediction_index, prediction_progress, prediction_stats, prediction_webhooks
 
 logger = get_logger(__name__)
 
 # Define the absolute path to the script
 NNUNET_SCRIPT_PATH = "/home/jk/projects/nnunet_server/scripts/nnunet_predict.sh"
 
+
+def _predict_with_script(job_id, input_dir, output_dir, dataset_id, configuration, trainer, plans, folds, device, tracker,
+                         use_mirroring=True, tile_step_size=0.5):
+    """Run nnunet_predict.sh in a subprocess, streaming its output into `tracker`. Returns (ok, failure_info)."""
+    cmd = [
+        NNUNET_SCRIPT_PATH,
+        input_dir,
+        str(output_dir),
+        dataset_id,
+        configuration,
+        trainer,
+        plans,
+        " ".join(str(f) for f in folds),
+        str(tile_step_size),
+        "1" if use_mirroring else "0",
+    ]
+    logger.info(f"[{job_id}] Executing command: {' '.join(cmd)}")
+
+    # stderr is merged into stdout and read line by line ('\r' of progress bars
+    # counts as a line end), so worker memory stays bounded however much nnU-Net prints.
+    # The script runs in its own session, so cancelling can kill nnU-Net and its workers as a group.
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        start_new_session=True,
+        # IMPORTANT: Do NOT use shell=True unless necessary for security reasons.
+        # Using the list format is safer and preferred.
+    )
+    watcher = prediction_cancel.CancelWatcher(tracker.req_dirs, lambda: prediction_cancel.kill_process_group(process))
+    watcher.start()
+    try:
+        for line in process.stdout:
+            tracker.feed(line)
+        returncode = process.wait()
+    finally:
+        watcher.stop()
+
+    if watcher.cancelled:
+        logger.info(f"[{job_id}] Prediction cancelled, process group terminated")
+        return False, {"cancelled": True}
+
+    if returncode != 0:
+        logger.error(f"[{job_id}] Script failed (Exit Code {returncode}): {tracker.tail_text()}")
+        return False, {
+            "returncode": returncode,
+            "log_tail": tracker.tail_text(),
+        }
+    return True, {}
+
+
+def _predict_in_process(job_id, input_dir, output_dir, dataset_id, configuration, trainer, plans, folds, device, tracker,
+                        use_mirroring=True, tile_step_size=0.5):
+    """Predict with a cached nnUNetPredictor. Returns (ok, failure_info)."""
+    from contextlib import redirect_stdout, redirect_stderr
+    from app.core import nnunet_predictor_cache
+    from app.core.prediction_progress import TrackerStream
+
+    predictor = nnunet_predictor_cache.get_predictor(dataset_id, configuration, trainer, plans, folds, device)
+    # per-call settings of the (shared) cached predictor; they are only read at prediction time
+    predictor.use_mirroring = use_mirroring
+    predictor.tile_step_size = tile_step_size
+    logger.info(f"[{job_id}] Predicting in-process with folds {list(folds)}, mirroring={use_mirroring}, tile_step_size={tile_step_size}")
+    stream = TrackerStream(tracker)
+    # nnU-Net can't be killed here; the stream raises PredictionCancelled at its next output line instead
+    watcher = prediction_cancel.CancelWatcher(tracker.req_dirs, tracker.request_cancel)
+    watcher.start()
+    try:
+        with redirect_stdout(stream), redirect_stderr(stream):
+            predictor.predict_from_files(
+                input_dir,
+                str(output_dir),
+                save_probabilities=False,
+                overwrite=True,
+                num_processes_preprocessing=settings.PREDICT_NUM_PROCESSES_PREPROCESSING,
+                num_processes_segmentation_export=settings.PREDICT_NUM_PROCESSES_EXPORT,
+                folder_with_segs_from_prev_stage=None,
+                num_parts=1,
+                part_id=0,
+            )
+    except prediction_cancel.PredictionCancelled:
+        logger.info(f"[{job_id}] Prediction cancelled")
+        return False, {"cancelled": True}
+    finally:
+        watcher.stop()
+        stream.close()
+    return True, {}
+
+
+def predict(job_id, input_dir, output_dir, dataset_id, configuration, trainer, plans, folds, device, tracker,
+            use_mirroring=True, tile_step_size=0.5):
+    """
+    Run inference on input_dir with the backend selected by settings.PREDICT_MODE.
+    nnU-Net's output goes to `tracker` (a prediction_progress.ProgressTracker).
+    use_mirroring and tile_step_size come from the request's tier (see prediction_tiers).
+    """
+    backend = _predict_in_process if settings.PREDICT_MODE == "in_process" else _predict_with_script
+    ok, failure_info = backend(
+        job_id, input_dir, output_dir, dataset_id, configuration, trainer, plans, folds, device, tracker,
+        use_mirroring=use_mirroring, tile_step_size=tile_step_size,
+    )
+    tracker.finish(ok, cancelled=failure_info.get("cancelled", False))
+    return ok, failure_info
+
+
+def write_summary(job_metadata: dict, output_dir, **extra) -> dict:
+    """Save a small JSON summary next to the outputs for downstream usage."""
+    summary = {
+        "job_id": job_metadata.get("job_id"),
+        "dataset_id": job_metadata.get("dataset_id"),
+        "input_dir": job_metadata.get("input_dir"),
+        "output_dir": str(output_dir),
+        "completed_at": datetime.utcnow().isoformat(),
+        "status": "completed",
+        **extra,
+    }
+    summary_path = os.path.join(output_dir, "summary.json")
+    with open(summary_path + ".tmp", "w") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(summary_path + ".tmp", summary_path)
+    return summary
+
+
+def _output_labels(output_dir) -> list[str]:
+    return [fname for fname in os.listdir(output_dir) if fname.startswith("image_") and not fname.endswith(".json")]
+
+
+def _update_index(job_metadata: dict, status: str, output_dir=None):
+    """Mirror the request's status into the prediction index (best effort)."""
+    req_dir = job_metadata["input_dir"].rstrip("/")
+    dataset_name = os.path.basename(os.path.dirname(req_dir))
+    output_labels = _output_labels(output_dir) if output_dir is not None else None
+    try:
+        prediction_index.update_status(
+            dataset_name, os.path.basename(req_dir), status,
+            completed=(status == "completed"), output_labels=output_labels,
+        )
+    except Exception as e:
+        logger.warning(f"[{job_metadata.get('job_id')}] Failed to update the prediction index: {e}")
+
+
+def _postprocess_label_image(label_image_path, label_values, out_dir, file_prefix, with_stats):
+    """Contour artifacts (and optionally label statistics) of one predicted label image."""
+    import app.core.image_tools as image_tools
+
+    label_image = image_tools.read_image(label_image_path)
+    result = {
+        # always rewrite: artifacts derived from a provisional output are stale (see publish_outputs)
+        "contours": image_tools.label_image_to_contour_list_json_files(
+            label_image_path, label_values, out_dir=out_dir, file_prefix=file_prefix, label_image=label_image,
+            skip_if_output_exists=False,
+        )
+    }
+    if with_stats:
+        result["label_stats"] = image_tools.label_statistics(label_image, label_values)
+    return result
+
+
+def postprocess_outputs(job_id, output_dir) -> dict:
+    """
+    Precompute the contour artifacts of every label of every output image, in
+    parallel across images (each image's labels share one pass, see
+    image_tools.label_image_to_contour_list_json_files), so contour requests
+    are cache reads by the time the request completes.
+    """
+    started = time.time()
+    with open(os.path.join(output_dir, "dataset.json"), "r") as f:
+        dataset = json.load(f)
+    file_ending = dataset.get("file_ending", ".mha")
+    label_values = [v for v in dataset.get("labels", {}).values() if isinstance(v, int) and v != 0]
+
+    label_images = sorted(
+        fname for fname in os.listdir(output_dir)
+        if re.fullmatch(rf"image_\d+{re.escape(file_ending)}", fname)
+    )
+    logger.info(f"[{job_id}] Post-processing {len(label_images)} label image(s), labels {label_values}")
+
+    results = {}
+    # spawn, not fork: this worker process holds CUDA state and the threads of torch and the predictor cache
+    with ProcessPoolExecutor(
+        max_workers=settings.PREDICTION_POSTPROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            fname: executor.submit(
+                _postprocess_label_image,
+                os.path.join(output_dir, fname),
+                label_values,
+                str(output_dir),
+                fname,
+                settings.PREDICTION_POSTPROCESS_LABEL_STATS,
+            )
+            for fname in label_images
+        }
+        for fname, future in futures.items():
+            results[fname] = future.result()
+
+    return {"images": results, "seconds": time.time() - started}
+
+
+def publish_outputs(src_dir, output_dir, stage: str):
+    """
+    Move the outputs of a pass from src_dir into output_dir with atomic
+    replaces, so readers see either the previous or the new segmentation.
+    Derived artifacts of a replaced label image (contours, .npz, .json.gz) are
+    removed. With stage "provisional" the outputs are marked as such; the mark
+    stays until finalize_request() is done with the final outputs.
+    """
+    provisional_path = os.path.join(output_dir, prediction_index.PROVISIONAL_FILE_NAME)
+    for fname in sorted(os.listdir(src_dir)):
+        src = os.path.join(src_dir, fname)
+        if not os.path.isfile(src):
+            continue
+        os.replace(src, os.path.join(output_dir, fname))
+        for derived in os.listdir(output_dir):
+            if derived.startswith(fname + "."):
+                os.remove(os.path.join(output_dir, derived))
+
+    if stage == "provisional":
+        with open(provisional_path + ".tmp", "w") as f:
+            json.dump({"stage": stage, "published_at": datetime.now().isoformat()}, f, indent=2)
+        os.replace(provisional_path + ".tmp", provisional_path)
+
+
+def _predict_provisional(job_metadata: dict, output_dir) -> tuple[bool, dict]:
+    """
+    First pass of a progressive request: predict with the cheap provisional
+    settings into a scratch folder and publish the result as provisional output.
+    """
+    job_id = job_metadata["job_id"]
+    input_dir = job_metadata["input_dir"]
+    provisional = job_metadata["provisional"]
+    scratch_dir = Path(input_dir) / "_provisional"
+    scratch_dir.mkdir(exist_ok=True)
+
+    logger.info(f"[{job_id}] Provisional pass with tier '{provisional.get('tier')}', folds {provisional['folds']}")
+    try:
+        tracker = prediction_progress.ProgressTracker(f"{job_id}:provisional", [input_dir], stage_name="provisional")
+        ok, failure_info = predict(
+            job_id, input_dir, scratch_dir, job_metadata["dataset_id"],
+            provisional["configuration"], provisional["trainer"], provisional["plans"], provisional["folds"],
+            job_metadata.get("device", "gpu"), tracker,
+            use_mirroring=provisional["use_mirroring"], tile_step_size=provisional["tile_step_size"],
+        )
+        if ok and not prediction_cancel.is_cancelled(input_dir):
+            publish_outputs(scratch_dir, output_dir, "provisional")
+            prediction_progress.write_state(input_dir, stage="provisional")
+            _update_index(job_metadata, "provisional")
+            logger.info(f"[{job_id}] Provisional outputs published")
+        return ok, failure_info
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def finalize_request(job_metadata: dict, output_dir, **extra) -> dict:
+    """Bookkeeping after a request's outputs were written successfully."""
+    req_dir = job_metadata["input_dir"]
+    postprocess_sec = None
+    if settings.PREDICTION_POSTPROCESS_CONTOURS and "postprocess" not in extra:
+        prediction_progress.write_state(req_dir, status="postprocessing")
+        started = time.time()
+        try:
+            extra["postprocess"] = postprocess_outputs(job_metadata.get("job_id"), output_dir)
+            postprocess_sec = time.time() - started
+        except Exception as e:
+            # contours are still generated lazily on request
+            logger.exception(f"[{job_metadata.get('job_id')}] Post-processing failed: {e}")
+            extra["postprocess"] = {"error": str(e)}
+
+    provisional_path = os.path.join(output_dir, prediction_index.PROVISIONAL_FILE_NAME)
+    if os.path.exists(provisional_path):
+        os.remove(provisional_path)
+
+    summary = write_summary(job_metadata, output_dir, **extra)
+    prediction_stats.record_finished(
+        job_metadata, prediction_progress.read_state(req_dir) or {},
+        batch_size=extra.get("batch_size", 1), postprocess_sec=postprocess_sec,
+    )
+    prediction_cache.register(job_metadata)
+    _update_index(job_metadata, "completed", output_dir)
+    prediction_progress.write_state(req_dir, status="completed")
+    prediction_webhooks.notify(job_metadata, "completed", output_labels=_output_labels(output_dir))
+    return summary
+
+
+def cancel_request(job_metadata: dict, **info) -> dict:
+    """Bookkeeping after a request was cancelled. Returns the job result."""
+    logger.info(f"[{job_metadata.get('job_id')}] Request cancelled")
+    _update_index(job_metadata, "cancelled")
+    if os.path.isdir(job_metadata["input_dir"]):
+        prediction_progress.write_state(job_metadata["input_dir"], status="cancelled")
+    return {
+        "status": "cancelled",
+        "job_id": job_metadata.get("job_id"),
+        **info,
+    }
+
+
+def fail_request(job_metadata: dict, **info) -> dict:
+    """Bookkeeping after a request failed. Returns the job result."""
+    _update_index(job_metadata, "failed")
+    if os.path.isdir(job_metadata["input_dir"]):
+        prediction_progress.write_state(job_metadata["input_dir"], status="failed")
+        prediction_webhooks.notify(job_metadata, "failed", error=info.get("error"))
+    return {
+        "status": "failed",
+        "job_id": job_metadata.get("job_id"),
+        **info,
+    }
+
+
 def run_nnunet_predict(job_metadata: dict) -> dict:
     """
     Run nnU-Net inference on the provided input file.
@@ -34,6 +360,11 @@ def run_nnunet_predict(job_metadata: dict) -> dict:
             "configuration": str,
             "trainer": str,
             "plans": str,
+            "folds": list[int],
+            "use_mirroring": bool,
+            "tile_step_size": float,
+            "device": str,
+            "provisional": dict,   # optional: settings of a quick first pass (progressive request)
             ...
         }
 
@@ -49,15 +380,27 @@ def run_nnunet_predict(job_metadata: dict) -> dict:
     configuration = job_metadata.get("configuration", "3d_lowres")
     trainer = job_metadata.get("trainer", "nnUNetTrainer")
     plans = job_metadata.get("plans", "nnUNetPlans")
-
+    folds = job_metadata.get("folds", [0, 1, 2, 3, 4])
+    use_mirroring = job_metadata.get("use_mirroring", True)
+    tile_step_size = job_metadata.get("tile_step_size", 0.5)
+    device = job_metadata.get("device", "gpu")
 
     if not job_id or not dataset_id or not input_dir:
         logger.error("Job metadata missing required fields: %s", job_metadata)
         return {"status": "failed", "reason": "missing metadata"}
 
+    if prediction_cancel.is_cancelled(input_dir):
+        return cancel_request(job_metadata)
+
     # --- Prepare output directory ---
+    # (no parents=True: a request folder deleted meanwhile must not be recreated)
     output_dir = Path(os.path.join(input_dir, "outputs")) 
-    output_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(exist_ok=True)
+
+    # staged preprocess/infer/export jobs (progressive requests keep the two-pass path below)
+    if settings.PREDICT_MODE == "pipeline" and not job_metadata.get("provisional"):
+        from app.core import nnunet_pipeline
+        return nnunet_pipeline.submit(job_metadata)
 
     logger.info(f"[{job_id}] Starting nnU-Net inference using model '{dataset_id}-{configuration}'")
     logger.info(f"[{job_id}] Input file: {input_dir}")
@@ -66,61 +409,48 @@ def run_nnunet_predict(job_metadata: dict) -> dict:
     # example command:
     #nnUNetv2_predict -d 015 -i /home/jk/data/nnunet_data/predictions/Dataset015_CBCTBladderRectumBowel2/req_000 -o /home/jk/data/nnunet_data/predictions/Dataset015_CBCTBladderRectumBowel2/req_000/outputs -f  0 1 2 3 4 -c 3d_lowres -device cuda
 
+    # progressive requests: a quick provisional pass first, then the requested
+    # settings into a scratch folder whose outputs atomically replace the provisional ones
+    progressive = bool(job_metadata.get("provisional"))
+    final_dir = Path(input_dir) / "_final" if progressive else output_dir
+
     try:
-        # --- Construct the command to run the script ---
-        cmd = [
-            NNUNET_SCRIPT_PATH,
-            input_dir, 
-            str(output_dir), 
-            dataset_id,
-            configuration,
-            trainer,
-            plans,
-        ]
-        logger.info(f"[{job_id}] Executing command: {' '.join(cmd)}")
+        if progressive:
+            ok, failure_info = _predict_provisional(job_metadata, output_dir)
+            if failure_info.get("cancelled") or prediction_cancel.is_cancelled(input_dir):
+                return cancel_request(job_metadata)
+            if not ok:
+                logger.warning(f"[{job_id}] Provisional pass failed, continuing with the final pass")
+            final_dir.mkdir(exist_ok=True)
 
         # --- Run inference ---
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False,
-            # IMPORTANT: Do NOT use shell=True unless necessary for security reasons.
-            # Using the list format is safer and preferred.
+        # (after a provisional pass, the request's clock keeps running: its durations cover both passes)
+        tracker = prediction_progress.ProgressTracker(job_id, [input_dir], resume=progressive)
+        ok, failure_info = predict(
+            job_id, input_dir, final_dir, dataset_id, configuration, trainer, plans, folds, device, tracker,
+            use_mirroring=use_mirroring, tile_step_size=tile_step_size,
         )
 
-        if result.returncode != 0:
-            logger.error(f"[{job_id}] Script failed (Exit Code {result.returncode}): {result.stderr}")
-            return {
-                "status": "failed",
-                "job_id": job_id,
-                "stderr": result.stderr,
-                "stdout": result.stdout, # Log stdout too for debugging
-            }
+        if failure_info.get("cancelled") or prediction_cancel.is_cancelled(input_dir):
+            return cancel_request(job_metadata)
+
+        if not ok:
+            return fail_request(job_metadata, **failure_info)
 
         logger.info(f"[{job_id}] nnU-Net inference completed successfully")
 
-        # --- Save a small JSON summary for downstream usage ---
-        summary_path = output_dir / "summary.json"
-        summary = {
-            "job_id": job_id,
-            "dataset_id": dataset_id,
-            "input_dir": input_dir,
-            "output_dir": str(output_dir),
-            "completed_at": datetime.utcnow().isoformat(),
-            "status": "completed",
-        }
-        with open(summary_path, "w") as f:
-            json.dump(summary, f, indent=2)
+        if progressive:
+            publish_outputs(final_dir, output_dir, "final")
+            prediction_progress.write_state(input_dir, stage="final")
 
-        return summary
+        # --- Save a small JSON summary for downstream usage ---
+        return finalize_request(job_metadata, output_dir)
 
     except Exception as e:
-        logger.exception(f"[{job_id}] Exception during nnunet_predict shell execution: {e}")
-        return {
-            "status": "failed",
-            "job_id": job_id,
-            "error": str(e),
-        }
+        logger.exception(f"[{job_id}] Exception during nnU-Net inference: {e}")
+        return fail_request(job_metadata, error=str(e))
+
+    finally:
+        if progressive:
+            shutil.rmtree(final_dir, ignore_errors=True)
 
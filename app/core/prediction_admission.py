@@ -0,0 +1,198 @@
+"""
+Admission control of prediction requests.
+
+POST /predictions estimates how long a new request would take to its result:
+the work already queued ahead of it plus its own prediction, divided over
+settings.PREDICTION_ADMISSION_WORKERS. Lanes are served in priority order, so
+the work ahead of an interactive request is the unfinished interactive work,
+that of a bulk request everything unfinished.
+
+Work is measured in seconds estimated from the durations the worker records
+for finished predictions (prediction_stats, durations table of the index): the median time
+per image and unit of cost of the dataset's recent predictions, scaled by the
+relative cost of the request's tier (folds, mirroring, tile step; the
+default "full" preset with five folds costs 1). Every admitted request keeps
+its estimate in req.json, so the queued work is a single query on the index.
+
+Per lane, two limits apply (lanes without them accept everything):
+
+    PREDICTION_LANE_MAX_QUEUED    unfinished requests in the lane  -> 429
+    PREDICTION_LANE_MAX_WAIT_SEC  estimated time to result         -> cheaper tier, else 503
+
+Both rejections carry a Retry-After estimate. A request that did not ask for
+a specific tier is routed to the best cheaper tier that meets the wait limit
+(settings.PREDICTION_ADMISSION_DEGRADE).
+"""
+
+import math
+import time
+import statistics
+from datetime import datetime, timedelta
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import prediction_index, prediction_scheduler, prediction_slurm, prediction_tiers
+
+logger = get_logger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """The request exceeds a lane limit. status_code is 429 or 503, retry_after in seconds."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+# share of a full prediction that doesn't scale with folds, mirroring and tiles (preprocessing, export)
+FIXED_COST_SHARE = 0.2
+
+
+def relative_cost(tier_settings: dict) -> float:
+    """Cost of a prediction with these settings relative to five folds with mirroring at tile step 0.5."""
+    folds = tier_settings.get("folds") or [0, 1, 2, 3, 4]
+    mirroring = 1.0 if tier_settings.get("use_mirroring", True) else 1 / 8  # 3D mirroring predicts 8 flips
+    tiles = (0.5 / float(tier_settings.get("tile_step_size", 0.5))) ** 3
+    return FIXED_COST_SHARE + (1 - FIXED_COST_SHARE) * len(folds) / 5 * mirroring * tiles
+
+
+def unit_seconds(dataset_id: str) -> float:
+    """Median seconds per image and unit of cost of the dataset's recent predictions."""
+    units = prediction_index.recent_unit_durations(dataset_id, settings.PREDICTION_ADMISSION_HISTORY)
+    if not units:
+        units = prediction_index.recent_unit_durations(None, settings.PREDICTION_ADMISSION_HISTORY)
+    return statistics.median(units) if units else settings.PREDICTION_ADMISSION_DEFAULT_SEC
+
+
+def estimate_seconds(dataset_id: str, tier_settings: dict, num_images: int = 1) -> float:
+    return unit_seconds(dataset_id) * relative_cost(tier_settings) * num_images
+
+
+# scheduled_counts() is read on every GET /prediction of an unfinished request
+SCHEDULED_TTL_SEC = 2.0
+_scheduled = (0.0, None)
+
+
+def scheduled_counts() -> dict | None:
+    """
+    {lane: requests} the scheduler still has queued (with SLURM: parked, or in
+    a submitted batch that hasn't finished), or None if it can't be reached.
+    Cached for SCHEDULED_TTL_SEC.
+    """
+    global _scheduled
+    read_at, scheduled = _scheduled
+    if time.time() - read_at < SCHEDULED_TTL_SEC:
+        return scheduled
+    scheduled = _read_scheduled_counts()
+    _scheduled = (time.time(), scheduled)
+    return scheduled
+
+
+def _read_scheduled_counts() -> dict | None:
+    try:
+        counts = prediction_scheduler.pending_counts()
+        scheduled = {lane: sum(counts.get(lane, {}).values()) for lane in prediction_scheduler.LANES}
+        if settings.JOB_PROCESSOR == "slurm":
+            since = time.time() - settings.PREDICTION_ADMISSION_HORIZON_SEC
+            for lane, requests in prediction_slurm.submitted_counts(since).items():
+                if lane in scheduled:
+                    scheduled[lane] += requests
+    except Exception as e:
+        logger.warning(f"Admission: could not read the scheduler's queues: {e}")
+        return None
+    return scheduled
+
+
+def running_limit() -> int:
+    """Most requests that can be running at once: every worker on a full batch."""
+    return max(settings.PREDICTION_ADMISSION_WORKERS, 1) * max(settings.PREDICTION_BATCH_MAX_REQUESTS, 1)
+
+
+def bound_work(work: dict, limit: int) -> dict:
+    """Scale {"requests", "estimated_sec"} down to at most `limit` requests."""
+    if work["requests"] <= limit:
+        return work
+    per_request = (work["estimated_sec"] or 0.0) / work["requests"]
+    return {"requests": limit, "estimated_sec": per_request * limit}
+
+
+def queued_work() -> dict:
+    """
+    {lane: {"requests", "estimated_sec"}} of the unfinished requests. The index
+    can hold rows of requests whose job is gone (e.g. a worker killed before it
+    recorded the outcome), so a lane never counts more than the scheduler has
+    queued in it plus what can be running.
+    """
+    since = (datetime.now() - timedelta(seconds=settings.PREDICTION_ADMISSION_HORIZON_SEC)).isoformat()
+    work = prediction_index.in_flight_by_lane(since, settings.PREDICTION_ADMISSION_DEFAULT_SEC)
+    scheduled = scheduled_counts()
+    result = {}
+    for lane in prediction_scheduler.LANES:
+        result[lane] = work.get(lane, {"requests": 0, "estimated_sec": 0.0})
+        if scheduled is not None:
+            result[lane] = bound_work(result[lane], scheduled[lane] + running_limit())
+    return result
+
+
+def wait_seconds(work: dict, lane: str) -> float:
+    """Estimated time until a new request of `lane` starts: the work of its lane and the lanes before it."""
+    lanes = prediction_scheduler.LANES
+    ahead = sum(work[name]["estimated_sec"] or 0.0 for name in lanes[:lanes.index(lane) + 1])
+    return ahead / max(settings.PREDICTION_ADMISSION_WORKERS, 1)
+
+
+def _cheaper_tiers(dataset_id: str, tier_settings: dict) -> list[dict]:
+    """Available tiers cheaper than tier_settings, most expensive (best) first."""
+    cost = relative_cost(tier_settings)
+    candidates = []
+    for name, preset in prediction_tiers.load_tiers(dataset_id).items():
+        try:
+            candidate = prediction_tiers.resolve_preset(dataset_id, name, preset)
+        except prediction_tiers.TierError:
+            continue
+        if relative_cost(candidate) < cost:
+            candidates.append(candidate)
+    return sorted(candidates, key=relative_cost, reverse=True)
+
+
+def admit(dataset_id: str, lane: str, tier_settings: dict, num_images: int = 1, allow_degrade: bool = False) -> dict:
+    """
+    Decide on a new request. Returns {"tier_settings", "estimated_sec", "wait_sec",
+    "degraded_from"} of the admitted request, or raises AdmissionRejected.
+    """
+    work = queued_work()
+    unit = unit_seconds(dataset_id)
+    wait = wait_seconds(work, lane)
+
+    max_queued = settings.PREDICTION_LANE_MAX_QUEUED.get(lane)
+    queued = work[lane]["requests"]
+    if max_queued is not None and queued >= max_queued:
+        # until enough of the lane has drained to make room
+        per_request = (work[lane]["estimated_sec"] or 0.0) / max(queued, 1)
+        retry_after = per_request * (queued - max_queued + 1) / max(settings.PREDICTION_ADMISSION_WORKERS, 1)
+        raise AdmissionRejected(
+            429, max(1, math.ceil(retry_after)),
+            f"Lane '{lane}' is full ({queued} unfinished requests, limit {max_queued})",
+        )
+
+    estimated = unit * relative_cost(tier_settings) * num_images
+    decision = {"tier_settings": tier_settings, "estimated_sec": estimated, "wait_sec": wait, "degraded_from": None}
+
+    max_wait = settings.PREDICTION_LANE_MAX_WAIT_SEC.get(lane)
+    if max_wait is None or wait + estimated <= max_wait:
+        return decision
+
+    if allow_degrade and settings.PREDICTION_ADMISSION_DEGRADE:
+        for candidate in _cheaper_tiers(dataset_id, tier_settings):
+            candidate_estimate = unit * relative_cost(candidate) * num_images
+            if wait + candidate_estimate <= max_wait:
+                logger.info(f"Admission: lane '{lane}' backed up ({wait:.0f}s), "
+                            f"routing to tier '{candidate['tier']}' instead of '{tier_settings['tier']}'")
+                return {**decision, "tier_settings": candidate, "estimated_sec": candidate_estimate,
+                        "degraded_from": tier_settings["tier"]}
+
+    raise AdmissionRejected(
+        503, max(1, math.ceil(wait + estimated - max_wait)),
+        f"Lane '{lane}' is backed up: estimated time to result {wait + estimated:.0f}s exceeds {max_wait:.0f}s",
+    )
@@ -0,0 +1,145 @@
+"""
+Cross-request micro-batching of prediction jobs.
+
+A batch is a list of requests for the same model (dataset, configuration,
+trainer, plans, folds) and inference settings (mirroring, tile step), collected by the fair-share scheduler when
+settings.PREDICTION_BATCH_WINDOW_SEC > 0 (see app/core/prediction_scheduler.py).
+run_batch() runs a single prediction pass over a combined input directory of
+symlinks and then moves the outputs back into each req_*/outputs folder.
+"""
+
+import os
+import uuid
+import shutil
+from pathlib import Path
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import nnunet_worker, prediction_cancel, prediction_progress
+
+logger = get_logger(__name__)
+
+# files nnUNetv2_predict writes next to the segmentations
+OUTPUT_SIDECAR_FILES = ["dataset.json", "plans.json", "predict_from_raw_data_args.json"]
+
+
+def model_key(job_metadata: dict) -> str:
+    folds = job_metadata.get("folds", [0, 1, 2, 3, 4])
+    return "|".join([
+        str(job_metadata.get("dataset_id")),
+        job_metadata.get("configuration", "3d_lowres"),
+        job_metadata.get("trainer", "nnUNetTrainer"),
+        job_metadata.get("plans", "nnUNetPlans"),
+        ",".join(str(f) for f in folds),
+        str(job_metadata.get("use_mirroring", True)),
+        str(job_metadata.get("tile_step_size", 0.5)),
+    ])
+
+
+def _link_inputs(batch_input_dir: str, batch: list[dict]):
+    """Symlink every request's input images into one folder with unique case prefixes."""
+    for k, job_metadata in enumerate(batch):
+        input_dir = job_metadata["input_dir"]
+        for fname in os.listdir(input_dir):
+            src = os.path.join(input_dir, fname)
+            if fname.startswith("image_") and os.path.isfile(src):
+                os.symlink(src, os.path.join(batch_input_dir, f"r{k}_{fname}"))
+
+
+def _fan_out_outputs(batch_output_dir: str, k: int, job_metadata: dict) -> str:
+    """Move the r{k}_* segmentations back into the k-th request's outputs folder."""
+    output_dir = os.path.join(job_metadata["input_dir"], "outputs")
+    Path(output_dir).mkdir(exist_ok=True)
+
+    prefix = f"r{k}_"
+    for fname in os.listdir(batch_output_dir):
+        if fname.startswith(prefix):
+            shutil.move(os.path.join(batch_output_dir, fname), os.path.join(output_dir, fname[len(prefix):]))
+
+    for fname in OUTPUT_SIDECAR_FILES:
+        src = os.path.join(batch_output_dir, fname)
+        if os.path.exists(src):
+            shutil.copy2(src, os.path.join(output_dir, fname))
+    return output_dir
+
+
+def run_batch(batch: list[dict]) -> dict:
+    """Run one nnU-Net pass over all requests of a batch (all for the same model)."""
+    cancelled = [
+        nnunet_worker.cancel_request(job_metadata)
+        for job_metadata in batch if prediction_cancel.is_cancelled(job_metadata["input_dir"])
+    ]
+    batch = [job_metadata for job_metadata in batch if not prediction_cancel.is_cancelled(job_metadata["input_dir"])]
+    if not batch:
+        return {"status": "cancelled", "results": cancelled}
+
+    if len(batch) == 1 or settings.PREDICT_MODE == "pipeline":
+        # pipeline stages work per request and keep the GPU busy on their own
+        results = [nnunet_worker.run_nnunet_predict(job_metadata) for job_metadata in batch]
+        return {"status": "completed", "results": cancelled + results}
+
+    first = batch[0]
+    batch_id = f"batch_{uuid.uuid4()}"
+    dataset_path = os.path.dirname(first["input_dir"].rstrip("/"))
+    batch_dir = os.path.join(dataset_path, "_batches", batch_id)
+    batch_input_dir = os.path.join(batch_dir, "inputs")
+    batch_output_dir = os.path.join(batch_dir, "outputs")
+    Path(batch_input_dir).mkdir(parents=True, exist_ok=True)
+    Path(batch_output_dir).mkdir(parents=True, exist_ok=True)
+
+    job_ids = [job_metadata["job_id"] for job_metadata in batch]
+    finished = set()  # job ids already completed, cancelled or failed: the error handler leaves them alone
+    logger.info(f"[{batch_id}] Running batched prediction for {len(batch)} requests: {job_ids}")
+
+    try:
+        _link_inputs(batch_input_dir, batch)
+        tracker = prediction_progress.ProgressTracker(batch_id, [job_metadata["input_dir"] for job_metadata in batch])
+        ok, failure_info = nnunet_worker.predict(
+            batch_id,
+            batch_input_dir,
+            batch_output_dir,
+            first["dataset_id"],
+            first.get("configuration", "3d_lowres"),
+            first.get("trainer", "nnUNetTrainer"),
+            first.get("plans", "nnUNetPlans"),
+            first.get("folds", [0, 1, 2, 3, 4]),
+            first.get("device", "gpu"),
+            tracker,
+            use_mirroring=first.get("use_mirroring", True),
+            tile_step_size=first.get("tile_step_size", 0.5),
+        )
+        if failure_info.get("cancelled"):
+            results = [nnunet_worker.cancel_request(job_metadata, batch_id=batch_id) for job_metadata in batch]
+            return {"status": "cancelled", "batch_id": batch_id, "results": cancelled + results}
+
+        if not ok:
+            for job_metadata in batch:
+                nnunet_worker.fail_request(job_metadata, batch_id=batch_id)
+            return {"status": "failed", "job_ids": job_ids, **failure_info}
+
+        # the pass only stops once all of its requests are cancelled; skip the ones cancelled meanwhile
+        results = []
+        for k, job_metadata in enumerate(batch):
+            if prediction_cancel.is_cancelled(job_metadata["input_dir"]):
+                results.append(nnunet_worker.cancel_request(job_metadata, batch_id=batch_id))
+                finished.add(job_metadata["job_id"])
+                continue
+            try:
+                output_dir = _fan_out_outputs(batch_output_dir, k, job_metadata)
+                results.append(nnunet_worker.finalize_request(job_metadata, output_dir, batch_id=batch_id, batch_size=len(batch)))
+            except Exception as e:
+                # one request's outputs don't fail the others of the batch
+                logger.exception(f"[{batch_id}] Finalizing {job_metadata['job_id']} failed: {e}")
+                results.append(nnunet_worker.fail_request(job_metadata, batch_id=batch_id, error=str(e)))
+            finished.add(job_metadata["job_id"])
+        logger.info(f"[{batch_id}] Batched prediction completed successfully")
+        return {"status": "completed", "batch_id": batch_id, "results": cancelled + results}
+
+    except Exception as e:
+        logger.exception(f"[{batch_id}] Exception during batched prediction: {e}")
+        for job_metadata in batch:
+            if job_metadata["job_id"] not in finished:
+                nnunet_worker.fail_request(job_metadata, batch_id=batch_id)
+        return {"status": "failed", "job_ids": job_ids, "error": str(e)}
+
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
@@ -0,0 +1,142 @@
+"""
+Content-addressed cache of prediction results.
+
+An entry maps a cache key - the hash of (image hash, dataset, configuration,
+trainer, plans, folds, mirroring, tile step, model checkpoint fingerprint) - to the request that
+produced the outputs. Entries live as small JSON files in
+predictions/<dataset>/_cache/<key>.json and are written by the worker once a
+request completes. A resubmission of the same volume to the same model gets a
+new req_id whose outputs are hard links to the cached ones.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from app.core.config import settings
+from app.core.logging_config import get_logger
+import app.core.nnunet_tools as nnunet_tools
+
+logger = get_logger(__name__)
+
+# nnU-Net directories
+nnunet_data_dir = settings.NNUNET_DATA_DIR
+nnunet_results_dir = os.path.join(nnunet_data_dir, 'results')
+
+CACHE_DIR_NAME = "_cache"
+
+
+def checkpoint_fingerprint(dataset_id, configuration, trainer, plans, folds) -> str | None:
+    """Fingerprint the model from plans.json and the fold checkpoints (path, size, mtime)."""
+    model_folder = nnunet_tools.get_model_folder(nnunet_results_dir, dataset_id, configuration, trainer, plans)
+    if model_folder is None:
+        return None
+
+    files = [os.path.join(model_folder, "plans.json")]
+    files += [os.path.join(model_folder, f"fold_{fold}", "checkpoint_final.pth") for fold in folds]
+
+    h = hashlib.sha256()
+    for path in files:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        h.update(f"{os.path.relpath(path, model_folder)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def cache_key(image_hash: str, job_metadata: dict) -> str | None:
+    """Return the cache key for an image hash and the job's model, or None if the model can't be fingerprinted."""
+    dataset_id = job_metadata.get("dataset_id")
+    model = {
+        "dataset_id": nnunet_tools.get_dataset_name(nnunet_results_dir, dataset_id) or str(dataset_id),
+        "configuration": job_metadata.get("configuration", "3d_lowres"),
+        "trainer": job_metadata.get("trainer", "nnUNetTrainer"),
+        "plans": job_metadata.get("plans", "nnUNetPlans"),
+        "folds": list(job_metadata.get("folds", [0, 1, 2, 3, 4])),
+        "use_mirroring": bool(job_metadata.get("use_mirroring", True)),
+        "tile_step_size": float(job_metadata.get("tile_step_size", 0.5)),
+    }
+    fingerprint = checkpoint_fingerprint(
+        model["dataset_id"], model["configuration"], model["trainer"], model["plans"], model["folds"]
+    )
+    if fingerprint is None:
+        return None
+
+    key_src = json.dumps({"image_hash": image_hash, "checkpoint": fingerprint, **model}, sort_keys=True)
+    return hashlib.sha256(key_src.encode()).hexdigest()
+
+
+def _entry_path(dataset_path: str, key: str) -> str:
+    return os.path.join(dataset_path, CACHE_DIR_NAME, f"{key}.json")
+
+
+def lookup(dataset_path: str, key: str) -> str | None:
+    """Return the req_dir holding completed outputs for `key`, or None."""
+    entry_path = _entry_path(dataset_path, key)
+    if not os.path.exists(entry_path):
+        return None
+
+    try:
+        with open(entry_path, "r") as f:
+            entry = json.load(f)
+        req_dir = os.path.join(dataset_path, entry["req_id"])
+        with open(os.path.join(req_dir, "outputs", "summary.json"), "r") as f:
+            summary = json.load(f)
+        if summary.get("status") == "completed":
+            return req_dir
+    except (OSError, ValueError, KeyError) as e:
+        logger.debug(f"Cache entry {key} is not usable: {e}")
+
+    # stale entry (source deleted or failed)
+    logger.info(f"Removing stale cache entry: {entry_path}")
+    try:
+        os.remove(entry_path)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def register(job_metadata: dict):
+    """Record the request's outputs under its cache key (if it has one)."""
+    key = job_metadata.get("cache_key")
+    if not key:
+        return
+
+    req_dir = job_metadata["input_dir"].rstrip("/")
+    dataset_path = os.path.dirname(req_dir)
+    entry_path = _entry_path(dataset_path, key)
+    Path(os.path.dirname(entry_path)).mkdir(parents=True, exist_ok=True)
+
+    entry = {
+        "req_id": os.path.basename(req_dir),
+        "image_sha256": job_metadata.get("image_sha256"),
+        "created_at": datetime.now().isoformat(),
+    }
+    tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, entry_path)
+    logger.info(f"Registered cache entry {key} -> {entry['req_id']}")
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def link_outputs(src_req_dir: str, dst_req_dir: str):
+    """
+    Populate dst_req_dir/outputs with hard links to the cached outputs.
+    Linked files must only ever be replaced (os.replace), never rewritten in place.
+    """
+    shutil.copytree(
+        os.path.join(src_req_dir, "outputs"),
+        os.path.join(dst_req_dir, "outputs"),
+        copy_function=_link_or_copy,
+        ignore=shutil.ignore_patterns("summary.json"),
+    )
@@ -0,0 +1,84 @@
+"""
+Cancellation of prediction requests.
+
+The API marks a request as cancelled with an empty req_*/cancel file; a
+request whose folder was deleted counts as cancelled too. Requests still
+parked in their lane are removed there by the API (see
+prediction_scheduler.cancel_pending). For a running prediction pass the worker
+polls the markers of all its requests with a CancelWatcher thread and, once
+every request of the pass is cancelled, stops nnU-Net: the script backend's
+process group is terminated (SIGTERM, then SIGKILL after
+settings.PREDICTION_CANCEL_GRACE_SEC), the in-process backend is interrupted
+at its next line of output.
+"""
+
+import os
+import signal
+import threading
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+CANCEL_FILE_NAME = "cancel"
+
+
+class PredictionCancelled(Exception):
+    """Raised inside an in-process prediction whose requests were all cancelled."""
+
+
+def mark_cancelled(req_dir: str):
+    with open(os.path.join(req_dir, CANCEL_FILE_NAME), "w"):
+        pass
+
+
+def is_cancelled(req_dir: str) -> bool:
+    return not os.path.isdir(req_dir) or os.path.exists(os.path.join(req_dir, CANCEL_FILE_NAME))
+
+
+def all_cancelled(req_dirs) -> bool:
+    req_dirs = list(req_dirs)
+    return bool(req_dirs) and all(is_cancelled(req_dir) for req_dir in req_dirs)
+
+
+def kill_process_group(process, grace_sec: float | None = None):
+    """SIGTERM the process group of `process` (started with start_new_session=True), SIGKILL it if it lingers."""
+    grace_sec = settings.PREDICTION_CANCEL_GRACE_SEC if grace_sec is None else grace_sec
+    try:
+        pgid = os.getpgid(process.pid)
+    except ProcessLookupError:
+        return
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+        process.wait(timeout=grace_sec)
+    except ProcessLookupError:
+        return
+    except Exception:
+        logger.warning(f"Process group {pgid} still running {grace_sec}s after SIGTERM, killing it")
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class CancelWatcher(threading.Thread):
+    """Calls on_cancel() once all of req_dirs are cancelled. Stop it with stop() when the pass is over."""
+
+    def __init__(self, req_dirs, on_cancel, poll_sec: float | None = None):
+        super().__init__(daemon=True)
+        self.req_dirs = list(req_dirs)
+        self.on_cancel = on_cancel
+        self.poll_sec = settings.PREDICTION_CANCEL_POLL_SEC if poll_sec is None else poll_sec
+        self.cancelled = False
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.poll_sec):
+            if all_cancelled(self.req_dirs):
+                self.cancelled = True
+                logger.info(f"All requests cancelled, stopping prediction: {self.req_dirs}")
+                self.on_cancel()
+                return
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,165 @@
+"""
+Push notifications of prediction status changes (GET /predictions/events).
+
+Instead of polling GET /prediction, clients open one Server-Sent Events
+stream, either for one request or for all unfinished requests of a requester
+in a dataset. The stream is driven by what the worker already writes: every
+transition (queued, running, postprocessing, the provisional and final
+stages, completed, failed, cancelled) is a write of the request's state.json,
+so a watcher only stats that file every settings.PREDICTION_EVENTS_POLL_SEC
+and reads it when it changed. While a request is running, the progress its
+job publishes (see prediction_progress) is forwarded as well.
+
+Events, one JSON object each:
+
+    event: status     {"req_id", "status", "stage", "updated_at"}
+    event: progress   {"req_id", "progress"}
+    event: deleted    {"req_id"}
+
+A request stream ends after the request's final status; a requester stream
+stays open and picks up new requests from the prediction index every
+settings.PREDICTION_EVENTS_REFRESH_SEC. Both send a comment line every
+PREDICTION_EVENTS_KEEPALIVE_SEC so proxies don't close idle streams.
+"""
+
+import os
+import json
+import time
+import asyncio
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import job_executor, prediction_index, prediction_progress
+
+logger = get_logger(__name__)
+
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def format_event(event: str, data: dict, event_id: int | None = None) -> str:
+    """One Server-Sent Events message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class RequestWatcher:
+    """Turns changes of one request's state.json (and its job's progress) into events."""
+
+    def __init__(self, req_dir: str, file_ending: str | None = None):
+        self.req_dir = req_dir
+        self.req_id = os.path.basename(req_dir.rstrip("/"))
+        self.file_ending = file_ending
+        self.finished = False
+        self._state_key = None
+        self._status = None
+        self._job_id = None
+        self._progress_at = None
+
+    def _read(self) -> dict | None:
+        """state.json if it changed since the last call, else None."""
+        path = os.path.join(self.req_dir, prediction_progress.STATE_FILE_NAME)
+        try:
+            st = os.stat(path)
+            key = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            key = None
+        if key == self._state_key and self._status is not None:
+            return None
+        self._state_key = key
+        state = prediction_progress.read_state(self.req_dir) or {}
+        if not state and self.file_ending:
+            # requests finished before state.json was written
+            item = prediction_index.read_request_dir(self.req_dir, self.file_ending)
+            if item and item["completed"]:
+                state = {"status": "completed", "stage": "final"}
+        return state
+
+    def poll(self, progress_of: dict) -> list[tuple[str, dict]]:
+        """
+        The events since the last poll. progress_of caches the executor's job
+        progress by job id for one round over all watchers.
+        """
+        if self.finished:
+            return []
+        if not os.path.isdir(self.req_dir):
+            self.finished = True
+            return [("deleted", {"req_id": self.req_id})]
+
+        events = []
+        state = self._read()
+        if state is not None:
+            status = (state.get("status") or "queued", state.get("stage"))
+            self._job_id = state.get("rq_job_id")
+            if status != self._status:
+                self._status = status
+                events.append(("status", {
+                    "req_id": self.req_id, "status": status[0], "stage": status[1],
+                    "updated_at": state.get("updated_at"),
+                }))
+            self.finished = status[0] in FINAL_STATUSES
+
+        if self._status[0] == "running" and self._job_id:
+            if self._job_id not in progress_of:
+                try:
+                    job = job_executor.get_executor().fetch(self._job_id)
+                except Exception as e:
+                    logger.warning(f"Failed to fetch job {self._job_id}: {e}")
+                    job = None
+                progress_of[self._job_id] = (job or {}).get("meta", {}).get("progress")
+            progress = progress_of[self._job_id]
+            if progress and progress.get("updated_at") != self._progress_at:
+                self._progress_at = progress.get("updated_at")
+                events.append(("progress", {"req_id": self.req_id, "progress": progress}))
+        return events
+
+
+def _in_flight_req_ids(dataset_id: str, requester_id: str) -> list[str]:
+    items = prediction_index.list_requests(dataset_id, requester_id=requester_id, completed=False)
+    return [item["req_id"] for item in items
+            if item["status"] not in FINAL_STATUSES and item["status"] not in prediction_index.IDLE_STATUSES]
+
+
+async def stream(dataset_dir: str, file_ending: str, is_disconnected, req_id: str | None = None,
+                 dataset_id: str | None = None, requester_id: str | None = None):
+    """
+    Server-Sent Events of one request (req_id) or of the unfinished requests
+    of a requester (dataset_id and requester_id). is_disconnected is the
+    request's async disconnect check.
+    """
+    watchers = {}
+    seen = set()
+    if req_id is not None:
+        watchers[req_id] = RequestWatcher(os.path.join(dataset_dir, req_id), file_ending)
+
+    event_id = 0
+    refreshed_at = 0.0
+    sent_at = time.time()
+    while not await is_disconnected():
+        if requester_id is not None and time.time() - refreshed_at >= settings.PREDICTION_EVENTS_REFRESH_SEC:
+            refreshed_at = time.time()
+            for new_id in await asyncio.to_thread(_in_flight_req_ids, dataset_id, requester_id):
+                if new_id not in seen:
+                    seen.add(new_id)
+                    watchers[new_id] = RequestWatcher(os.path.join(dataset_dir, new_id), file_ending)
+
+        def poll_all():
+            progress_of = {}
+            return [event for watcher in watchers.values() for event in watcher.poll(progress_of)]
+
+        for event, data in await asyncio.to_thread(poll_all):
+            event_id += 1
+            sent_at = time.time()
+            yield format_event(event, data, event_id)
+
+        for finished_id in [w_id for w_id, watcher in watchers.items() if watcher.finished]:
+            del watchers[finished_id]
+        if req_id is not None and not watchers:
+            return
+
+        if time.time() - sent_at >= settings.PREDICTION_EVENTS_KEEPALIVE_SEC:
+            sent_at = time.time()
+            yield ": keepalive\n\n"
+        await asyncio.sleep(settings.PREDICTION_EVENTS_POLL_SEC)
@@ -0,0 +1,478 @@
+"""
+Index of prediction requests and their status in SQLite (settings.DATABASE_URL).
+
+Rows are written when a request is submitted, when the worker finishes it and
+when it is deleted, so GET /predictions becomes an indexed query instead of a
+walk over every req_* folder. The worker also records how long each finished
+prediction took (durations), which admission control estimates queued work from. A dataset's existing request folders are
+imported once, the first time the dataset is listed.
+
+The worker updates the same database, so DATABASE_URL should point to an
+absolute path visible to both the API and the workers. That may be a network
+filesystem (SLURM nodes), so the database keeps SQLite's default rollback
+journal; WAL needs shared memory between all processes using it.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from json import JSONDecodeError
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+SORT_COLUMNS = {"req_id", "submitted_at", "updated_at", "requester_id", "status"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    dataset_id TEXT NOT NULL,
+    req_id TEXT NOT NULL,
+    requester_id TEXT,
+    image_ids TEXT NOT NULL DEFAULT '[]',
+    submitted_at TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    completed INTEGER NOT NULL DEFAULT 0,
+    req_info TEXT NOT NULL DEFAULT '{}',
+    input_images TEXT NOT NULL DEFAULT '[]',
+    output_labels TEXT NOT NULL DEFAULT '[]',
+    updated_at TEXT,
+    PRIMARY KEY (dataset_id, req_id)
+);
+CREATE INDEX IF NOT EXISTS ix_predictions_submitted ON predictions (dataset_id, submitted_at);
+CREATE INDEX IF NOT EXISTS ix_predictions_requester ON predictions (dataset_id, requester_id);
+CREATE INDEX IF NOT EXISTS ix_predictions_status ON predictions (dataset_id, completed, status);
+CREATE TABLE IF NOT EXISTS indexed_datasets (
+    dataset_id TEXT PRIMARY KEY,
+    indexed_at TEXT
+);
+CREATE TABLE IF NOT EXISTS durations (
+    dataset_id TEXT NOT NULL,
+    tier TEXT,
+    num_images INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    seconds REAL NOT NULL,
+    finished_at TEXT,
+    configuration TEXT,
+    lane TEXT,
+    voxels INTEGER,
+    queue_sec REAL,
+    stage_seconds TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS ix_durations_dataset ON durations (dataset_id, finished_at);
+"""
+
+# columns added since a table was first created, for older databases: table -> [(column, type)]
+_ADDED_COLUMNS = {
+    "durations": [
+        ("configuration", "TEXT"),
+        ("lane", "TEXT"),
+        ("voxels", "INTEGER"),
+        ("queue_sec", "REAL"),
+        ("stage_seconds", "TEXT NOT NULL DEFAULT '{}'"),
+    ],
+}
+
+# statuses of unfinished requests no job is working on: failed, cancelled, or
+# uploaded without a prediction (POST /predictions_zip)
+IDLE_STATUSES = ("failed", "cancelled", "uploaded")
+
+_local = threading.local()
+
+
+def get_db_path() -> str:
+    url = settings.DATABASE_URL
+    if not url.startswith("sqlite:///"):
+        raise ValueError(f"Only sqlite DATABASE_URLs are supported: {url}")
+    return url[len("sqlite:///"):]
+
+
+def connect() -> sqlite3.Connection:
+    """Per-thread connection with the schema in place."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(get_db_path(), timeout=30)
+        conn.row_factory = sqlite3.Row
+        # the rollback journal: workers on other hosts share the file over NFS, where WAL's shared
+        # memory doesn't work (also switches back databases created in WAL mode)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.executescript(_SCHEMA)
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, column_type in columns:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+        _local.conn = conn
+    return conn
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+def upsert_request(dataset_id: str, req_id: str, req_info: dict, input_images: list[str],
+                   status: str = "queued", completed: bool = False, output_labels: list[str] | None = None,
+                   overwrite: bool = True):
+    """Write a request's row. With overwrite=False an existing row is left as it is."""
+    on_conflict = """
+            ON CONFLICT (dataset_id, req_id) DO UPDATE SET
+                requester_id = excluded.requester_id,
+                image_ids = excluded.image_ids,
+                submitted_at = excluded.submitted_at,
+                status = excluded.status,
+                completed = excluded.completed,
+                req_info = excluded.req_info,
+                input_images = excluded.input_images,
+                output_labels = excluded.output_labels,
+                updated_at = excluded.updated_at
+    """ if overwrite else "ON CONFLICT (dataset_id, req_id) DO NOTHING"
+    conn = connect()
+    with conn:
+        conn.execute(
+            f"""
+            INSERT INTO predictions (dataset_id, req_id, requester_id, image_ids, submitted_at, status,
+                                     completed, req_info, input_images, output_labels, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            {on_conflict}
+            """,
+            (
+                dataset_id,
+                req_id,
+                req_info.get("requester_id"),
+                json.dumps(req_info.get("image_id_list", [])),
+                req_info.get("at"),
+                status,
+                int(completed),
+                json.dumps(req_info),
+                json.dumps(sorted(input_images)),
+                json.dumps(sorted(output_labels or [])),
+                _now(),
+            ),
+        )
+
+
+def update_status(dataset_id: str, req_id: str, status: str, completed: bool | None = None,
+                  output_labels: list[str] | None = None):
+    fields = {"status": status, "updated_at": _now()}
+    if completed is not None:
+        fields["completed"] = int(completed)
+    if output_labels is not None:
+        fields["output_labels"] = json.dumps(sorted(output_labels))
+
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn = connect()
+    with conn:
+        conn.execute(
+            f"UPDATE predictions SET {assignments} WHERE dataset_id = ? AND req_id = ?",
+            (*fields.values(), dataset_id, req_id),
+        )
+
+
+def update_req_info(dataset_id: str, req_id: str, req_info: dict):
+    """Replace a request's req.json copy (e.g. once its job id is known), leaving its status alone."""
+    conn = connect()
+    with conn:
+        conn.execute(
+            "UPDATE predictions SET req_info = ?, updated_at = ? WHERE dataset_id = ? AND req_id = ?",
+            (json.dumps(req_info), _now(), dataset_id, req_id),
+        )
+
+
+def delete_request(dataset_id: str, req_id: str):
+    conn = connect()
+    with conn:
+        conn.execute("DELETE FROM predictions WHERE dataset_id = ? AND req_id = ?", (dataset_id, req_id))
+
+
+def _row_to_item(row) -> dict:
+    return {
+        "req_id": row["req_id"],
+        "req_info": json.loads(row["req_info"]),
+        "input_images": json.loads(row["input_images"]),
+        "completed": bool(row["completed"]),
+        "output_labels": json.loads(row["output_labels"]),
+        "status": row["status"],
+    }
+
+
+def list_requests(dataset_id: str, offset: int = 0, limit: int | None = None,
+                  sort: str = "req_id", order: str = "asc",
+                  requester_id: str | None = None, image_id: str | None = None,
+                  date_from: str | None = None, date_to: str | None = None,
+                  completed: bool | None = None) -> list[dict]:
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Invalid sort column '{sort}'. Allowed: {', '.join(sorted(SORT_COLUMNS))}")
+    if order.lower() not in ("asc", "desc"):
+        raise ValueError(f"Invalid order '{order}'. Allowed: asc, desc")
+
+    where = ["dataset_id = ?"]
+    params = [dataset_id]
+    if requester_id is not None:
+        where.append("requester_id = ?")
+        params.append(requester_id)
+    if image_id is not None:
+        where.append("EXISTS (SELECT 1 FROM json_each(image_ids) WHERE json_each.value = ?)")
+        params.append(image_id)
+    if date_from is not None:
+        where.append("submitted_at >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        where.append("submitted_at <= ?")
+        params.append(date_to)
+    if completed is not None:
+        where.append("completed = ?")
+        params.append(int(completed))
+
+    sql = f"SELECT * FROM predictions WHERE {' AND '.join(where)} ORDER BY {sort} {order.upper()}, req_id"
+    sql += " LIMIT ? OFFSET ?"
+    params += [-1 if limit is None else limit, offset]
+
+    return [_row_to_item(row) for row in connect().execute(sql, params)]
+
+
+def list_in_flight(dataset_id: str) -> list[dict]:
+    """Requests not yet known to be finished."""
+    rows = connect().execute(
+        f"SELECT * FROM predictions WHERE dataset_id = ? AND completed = 0 AND status NOT IN {IDLE_STATUSES}",
+        (dataset_id,),
+    )
+    return [_row_to_item(row) for row in rows]
+
+
+def in_flight_by_lane(since: str, default_estimated_sec: float) -> dict:
+    """
+    {lane: {"requests", "estimated_sec"}} of the requests submitted since
+    `since` that are not finished yet, from the estimate stored with each
+    request (default_estimated_sec where it has none).
+    """
+    rows = connect().execute(
+        f"""
+        SELECT json_extract(req_info, '$.priority') AS lane, COUNT(*) AS requests,
+               SUM(COALESCE(json_extract(req_info, '$.estimated_sec'), ?)) AS estimated_sec
+        FROM predictions
+        WHERE completed = 0 AND status NOT IN {IDLE_STATUSES} AND submitted_at >= ?
+        GROUP BY lane
+        """,
+        (default_estimated_sec, since),
+    )
+    return {row["lane"]: {"requests": row["requests"], "estimated_sec": row["estimated_sec"]} for row in rows}
+
+
+def record_duration(dataset_id: str, tier: str | None, num_images: int, cost: float, seconds: float,
+                    configuration: str | None = None, lane: str | None = None, voxels: int | None = None,
+                    queue_sec: float | None = None, stage_seconds: dict | None = None):
+    conn = connect()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO durations (dataset_id, tier, num_images, cost, seconds, finished_at,
+                                   configuration, lane, voxels, queue_sec, stage_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (dataset_id, tier, num_images, cost, seconds, _now(),
+             configuration, lane, voxels, queue_sec, json.dumps(stage_seconds or {})),
+        )
+
+
+def list_durations(dataset_id: str | None = None, configuration: str | None = None, tier: str | None = None,
+                   since: str | None = None, limit: int = 10000) -> list[dict]:
+    """The latest recorded durations, newest first."""
+    where = []
+    params = []
+    for column, value in (("dataset_id", dataset_id), ("configuration", configuration), ("tier", tier)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("finished_at >= ?")
+        params.append(since)
+
+    sql = "SELECT * FROM durations"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    sql += " ORDER BY finished_at DESC LIMIT ?"
+    params.append(limit)
+
+    rows = []
+    for row in connect().execute(sql, params):
+        item = dict(row)
+        item["stage_seconds"] = json.loads(item["stage_seconds"] or "{}")
+        rows.append(item)
+    return rows
+
+
+def in_flight_ahead(dataset_id: str, req_id: str, lanes_before: list[str], lane: str, submitted_at: str,
+                    since: str, default_estimated_sec: float) -> dict:
+    """
+    {"requests", "estimated_sec"} of the unfinished requests served before the
+    given one: all of the lanes before its lane and the older ones of its lane.
+    """
+    placeholders = ", ".join("?" for _ in lanes_before) or "NULL"
+    row = connect().execute(
+        f"""
+        SELECT COUNT(*) AS requests,
+               SUM(COALESCE(json_extract(req_info, '$.estimated_sec'), ?)) AS estimated_sec
+        FROM predictions
+        WHERE completed = 0 AND status NOT IN {IDLE_STATUSES} AND submitted_at >= ?
+          AND NOT (dataset_id = ? AND req_id = ?)
+          AND (json_extract(req_info, '$.priority') IN ({placeholders})
+               OR (json_extract(req_info, '$.priority') = ? AND submitted_at < ?))
+        """,
+        (default_estimated_sec, since, dataset_id, req_id, *lanes_before, lane, submitted_at),
+    ).fetchone()
+    return {"requests": row["requests"], "estimated_sec": row["estimated_sec"] or 0.0}
+
+
+def recent_unit_durations(dataset_id: str | None, limit: int) -> list[float]:
+    """Seconds per image and unit of cost of the latest predictions of a dataset (of all datasets if None)."""
+    sql = "SELECT seconds / (num_images * cost) AS unit FROM durations"
+    params = []
+    if dataset_id is not None:
+        sql += " WHERE dataset_id = ?"
+        params.append(dataset_id)
+    sql += " ORDER BY finished_at DESC LIMIT ?"
+    params.append(limit)
+    return [row["unit"] for row in connect().execute(sql, params)]
+
+
+# ---------------- Disk import ----------------
+# marks outputs/ of a progressive request while it only holds the provisional segmentation
+PROVISIONAL_FILE_NAME = "provisional.json"
+
+
+def outputs_finalized(outputs_dir: str) -> bool:
+    """
+    Provisional outputs never count as completed. With eager post-processing on,
+    the worker writes summary.json only after the contour artifacts exist, so a
+    request counts as completed from then on.
+    """
+    if os.path.exists(os.path.join(outputs_dir, PROVISIONAL_FILE_NAME)):
+        return False
+    if not settings.PREDICTION_POSTPROCESS_CONTOURS:
+        return True
+    return os.path.exists(os.path.join(outputs_dir, "summary.json"))
+
+
+def output_stage(outputs_dir: str, completed: bool) -> str | None:
+    """'final', 'provisional' or None (no segmentation yet)."""
+    if completed:
+        return "final"
+    if os.path.exists(os.path.join(outputs_dir, PROVISIONAL_FILE_NAME)):
+        return "provisional"
+    return None
+
+
+# statuses of state.json (see prediction_progress) the index keeps as they are
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# the upload of POST /predictions_zip, which queues no prediction
+ZIP_UPLOAD_FILE_NAME = "images.zip"
+
+
+def _disk_status(req_dir: str, outputs_dir: str, completed: bool) -> str:
+    """Index status of a request folder: its outputs, else the final status in its state.json."""
+    if completed:
+        return "completed"
+    try:
+        with open(os.path.join(req_dir, "state.json"), "r") as f:
+            status = json.load(f).get("status")
+    except (OSError, ValueError):
+        status = None
+    if status in FINISHED_STATUSES:
+        return status
+    if status is None and os.path.exists(os.path.join(req_dir, ZIP_UPLOAD_FILE_NAME)):
+        return "uploaded"
+    return "provisional" if output_stage(outputs_dir, completed) == "provisional" else "queued"
+
+
+def read_request_dir(req_dir: str, file_ending: str) -> dict | None:
+    """Build a request item from its folder (req.json, inputs and expected outputs)."""
+    req_json_path = os.path.join(req_dir, "req.json")
+    try:
+        with open(req_json_path, "r") as f:
+            req_info = json.load(f)
+    except (JSONDecodeError, OSError) as e:
+        logger.warning(f"Unreadable req.json in {req_dir}: {e}")
+        return None
+
+    input_images = sorted([
+        fname for fname in os.listdir(req_dir)
+        if fname.startswith("image_") and fname.endswith(file_ending)
+    ])
+
+    expected_output_label_images = [f'image_{fname.split("_")[1]}{file_ending}' for fname in input_images]
+    outputs_dir = os.path.join(req_dir, "outputs")
+    output_labels = []
+    completed = True
+    for expected_output_label in expected_output_label_images:
+        if not os.path.exists(os.path.join(outputs_dir, expected_output_label)):
+            completed = False
+            break
+        output_labels.append(expected_output_label)
+
+    completed = completed and outputs_finalized(outputs_dir)
+
+    return {
+        "req_id": os.path.basename(req_dir),
+        "req_info": req_info,
+        "input_images": input_images,
+        "completed": completed,
+        "output_labels": sorted(output_labels),
+        "status": _disk_status(req_dir, outputs_dir, completed),
+    }
+
+
+def is_dataset_indexed(dataset_id: str) -> bool:
+    row = connect().execute("SELECT 1 FROM indexed_datasets WHERE dataset_id = ?", (dataset_id,)).fetchone()
+    return row is not None
+
+
+def index_dataset_from_disk(dataset_id: str, dataset_path: str, file_ending: str) -> int:
+    """
+    Import every req_* folder of a dataset. Returns the number of requests
+    indexed. Rows already in the index are kept; reconcile_in_flight() brings
+    the unfinished ones up to date.
+    """
+    count = 0
+    for entry in sorted(os.listdir(dataset_path)):
+        req_dir = os.path.join(dataset_path, entry)
+        if not entry.startswith("req_") or not os.path.isdir(req_dir):
+            continue
+        item = read_request_dir(req_dir, file_ending)
+        if item is None:
+            continue
+        upsert_request(
+            dataset_id, entry, item["req_info"], item["input_images"],
+            status=item["status"],
+            completed=item["completed"],
+            output_labels=item["output_labels"],
+            overwrite=False,
+        )
+        count += 1
+
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO indexed_datasets (dataset_id, indexed_at) VALUES (?, ?)",
+            (dataset_id, _now()),
+        )
+    logger.info(f"Indexed {count} prediction requests of {dataset_id} from disk")
+    return count
+
+
+def reconcile_in_flight(dataset_id: str, dataset_path: str, file_ending: str):
+    """Re-check on disk only the requests the index still considers running."""
+    for item in list_in_flight(dataset_id):
+        req_dir = os.path.join(dataset_path, item["req_id"])
+        if not os.path.isdir(req_dir):
+            delete_request(dataset_id, item["req_id"])
+            continue
+        disk_item = read_request_dir(req_dir, file_ending)
+        if disk_item is None:
+            continue
+        if disk_item["completed"]:
+            update_status(dataset_id, item["req_id"], "completed", completed=True,
+                          output_labels=disk_item["output_labels"])
+        elif disk_item["status"] in IDLE_STATUSES:
+            update_status(dataset_id, item["req_id"], disk_item["status"], completed=False)
@@ -0,0 +1,272 @@
+"""
+Live progress and logs of running predictions.
+
+The worker streams nnU-Net's output line by line into req_*/predict.log
+(one per request, so a batched pass writes the same lines to every request of
+the batch) and parses progress events from it:
+
+    There are 3 cases that I would like to predict   -> cases_total
+    Predicting image_0:                              -> stage "predicting"
+     40%|####      | 11/27 [00:03<00:04, ...]        -> sliding-window steps
+    sending off prediction to background worker ...  -> stage "exporting"
+    done with image_0                                -> cases_done
+
+Progress is published to the running job's meta (meta["progress"], see job_executor),
+throttled to settings.PREDICTION_PROGRESS_INTERVAL_SEC. req_*/state.json
+records which job is running the request, so the API can find it.
+"""
+
+import os
+import re
+import json
+import time
+from collections import deque
+from datetime import datetime
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import job_executor
+
+logger = get_logger(__name__)
+
+LOG_FILE_NAME = "predict.log"
+STATE_FILE_NAME = "state.json"
+
+LOG_TAIL_LINES = 50
+
+_CASES_TOTAL_RE = re.compile(r"There are (\d+) cases that I would like to predict")
+_CASE_START_RE = re.compile(r"Predicting (\S+?):")
+_STEPS_RE = re.compile(r"(\d+)/(\d+) \[")
+_EXPORT_RE = re.compile(r"sending off prediction to background worker")
+_CASE_DONE_RE = re.compile(r"done with (\S+)")
+
+
+def parse_progress_line(line: str) -> dict | None:
+    """Return the progress event in one output line, or None."""
+    m = _CASES_TOTAL_RE.search(line)
+    if m:
+        return {"event": "cases_total", "cases_total": int(m.group(1))}
+    m = _CASE_START_RE.search(line)
+    if m:
+        return {"event": "case_started", "case": m.group(1)}
+    m = _STEPS_RE.search(line)
+    if m:
+        return {"event": "steps", "steps_done": int(m.group(1)), "steps_total": int(m.group(2))}
+    if _EXPORT_RE.search(line):
+        return {"event": "exporting"}
+    m = _CASE_DONE_RE.search(line)
+    if m:
+        return {"event": "case_done", "case": os.path.basename(m.group(1))}
+    return None
+
+
+def log_path(req_dir: str) -> str:
+    return os.path.join(req_dir, LOG_FILE_NAME)
+
+
+def _state_path(req_dir: str) -> str:
+    return os.path.join(req_dir, STATE_FILE_NAME)
+
+
+def read_state(req_dir: str) -> dict | None:
+    try:
+        with open(_state_path(req_dir), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_state(req_dir: str, **fields) -> dict:
+    """Merge `fields` into req_dir/state.json (atomic replace)."""
+    state = read_state(req_dir) or {}
+    state.update(fields, updated_at=datetime.now().isoformat())
+    path = _state_path(req_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+    return state
+
+
+def add_stage_seconds(req_dir: str, stage_seconds: dict):
+    """Add time spent per stage to state.json stage_seconds, for the duration statistics."""
+    totals = dict((read_state(req_dir) or {}).get("stage_seconds") or {})
+    for stage, seconds in stage_seconds.items():
+        totals[stage] = round(totals.get(stage, 0.0) + seconds, 3)
+    write_state(req_dir, stage_seconds=totals)
+
+
+def read_log(req_dir: str, offset: int = 0, max_bytes: int = 65536) -> dict:
+    """Read up to max_bytes of a request's log from byte `offset`."""
+    path = log_path(req_dir)
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return {"offset": offset, "next_offset": offset, "size": 0, "data": ""}
+
+    offset = min(offset, size)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    return {
+        "offset": offset,
+        "next_offset": offset + len(data),
+        "size": size,
+        "data": data.decode("utf-8", errors="replace"),
+    }
+
+
+class ProgressTracker:
+    """
+    Sink for the output lines of one prediction pass: appends them to the log
+    of every request in the pass, keeps a bounded tail for error reports and
+    publishes parsed progress to the current job.
+
+    A pass records its time per nnU-Net stage into state.json, or as a whole
+    under `stage_name` (the provisional pass of a progressive request). With
+    resume=True it continues the request's clock (started_at, stage_seconds)
+    instead of restarting it, for the second pass of the same job.
+    """
+
+    def __init__(self, job_id: str, req_dirs: list[str], stage_name: str | None = None, resume: bool = False):
+        self.job_id = job_id
+        self.req_dirs = list(req_dirs)
+        self.stage_name = stage_name
+        self.tail = deque(maxlen=LOG_TAIL_LINES)
+        self.progress = {
+            "stage": "preprocessing",
+            "cases_total": None,
+            "cases_started": 0,
+            "cases_done": 0,
+            "current_case": None,
+            "steps_done": 0,
+            "steps_total": None,
+            "fraction": 0.0,
+        }
+        self._last_publish = 0.0
+        self._stage_seconds = {}
+        self._stage_since = time.time()
+        self._logs = []
+        self.cancel_requested = False
+
+        self._executor = job_executor.get_executor()
+        rq_job_id = self._executor.current_job_id()
+
+        started = datetime.now().isoformat()
+        for req_dir in self.req_dirs:
+            f = open(log_path(req_dir), "a", buffering=1)
+            f.write(f"=== {job_id} started at {started} ===\n")
+            self._logs.append(f)
+            clock = {} if resume else {"started_at": started, "stage_seconds": {}}
+            write_state(req_dir, status="running", job_id=job_id, rq_job_id=rq_job_id, **clock)
+
+    def feed(self, line: str):
+        line = line.rstrip("\r\n")
+        if not line:
+            return
+        for f in self._logs:
+            f.write(line + "\n")
+        self.tail.append(line)
+
+        event = parse_progress_line(line)
+        if event is not None:
+            previous_stage = self.progress["stage"]
+            stage_changed = self._apply(event)
+            if stage_changed:
+                self._count_stage_time(previous_stage)
+            self.publish(force=stage_changed)
+
+    def _apply(self, event: dict) -> bool:
+        p = self.progress
+        previous_stage = p["stage"]
+        kind = event["event"]
+        if kind == "cases_total":
+            p["cases_total"] = event["cases_total"]
+        elif kind == "case_started":
+            p["stage"] = "predicting"
+            p["current_case"] = event["case"]
+            p["cases_started"] += 1
+            p["steps_done"], p["steps_total"] = 0, None
+        elif kind == "steps":
+            p["steps_done"], p["steps_total"] = event["steps_done"], event["steps_total"]
+        elif kind == "exporting":
+            p["stage"] = "exporting"
+        elif kind == "case_done":
+            p["cases_done"] += 1
+
+        if p["cases_total"]:
+            current = 0.0
+            if p["stage"] == "predicting" and p["steps_total"]:
+                current = p["steps_done"] / p["steps_total"]
+            elif p["cases_started"] > p["cases_done"]:
+                current = 1.0
+            p["fraction"] = round(min(1.0, (p["cases_done"] + current) / p["cases_total"]), 4)
+        return p["stage"] != previous_stage
+
+    def publish(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_publish < settings.PREDICTION_PROGRESS_INTERVAL_SEC:
+            return
+        self._last_publish = now
+        try:
+            self._executor.update_current_job_meta(progress={**self.progress, "updated_at": datetime.now().isoformat()})
+        except Exception as e:
+            logger.warning(f"[{self.job_id}] Failed to publish progress: {e}")
+
+    def _count_stage_time(self, stage: str):
+        now = time.time()
+        self._stage_seconds[stage] = self._stage_seconds.get(stage, 0.0) + now - self._stage_since
+        self._stage_since = now
+
+    def request_cancel(self):
+        """Make the next line fed through a TrackerStream raise PredictionCancelled."""
+        self.cancel_requested = True
+
+    def finish(self, ok: bool, cancelled: bool = False):
+        """Publish the final progress and close the logs."""
+        outcome = "done" if ok else "cancelled" if cancelled else "failed"
+        self._count_stage_time(self.progress["stage"])
+        if ok or (self.stage_name and not cancelled):
+            # nnU-Net stages alternate per case; each request of a batched pass gets the whole pass
+            stage_seconds = self._stage_seconds
+            if self.stage_name:
+                stage_seconds = {self.stage_name: sum(self._stage_seconds.values())}
+            for req_dir in self.req_dirs:
+                if os.path.isdir(req_dir):
+                    add_stage_seconds(req_dir, stage_seconds)
+        self.progress["stage"] = outcome
+        if ok:
+            self.progress["fraction"] = 1.0
+        self.publish(force=True)
+        for f in self._logs:
+            f.write(f"=== {self.job_id} {outcome} at {datetime.now().isoformat()} ===\n")
+            f.close()
+        self._logs = []
+
+    def tail_text(self) -> str:
+        return "\n".join(self.tail)
+
+
+class TrackerStream:
+    """File-like object feeding everything written to it, line by line, into a ProgressTracker."""
+
+    def __init__(self, tracker: ProgressTracker):
+        self.tracker = tracker
+        self._buffer = ""
+
+    def write(self, text: str) -> int:
+        if self.tracker.cancel_requested:
+            from app.core.prediction_cancel import PredictionCancelled
+            raise PredictionCancelled()
+        self._buffer += text
+        *lines, self._buffer = re.split(r"[\r\n]", self._buffer)
+        for line in lines:
+            self.tracker.feed(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self.tracker.feed(self._buffer)
+            self._buffer = ""
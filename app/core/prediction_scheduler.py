@@ -0,0 +1,265 @@
+"""
+Priority lanes and fair-share scheduling of prediction requests.
+
+Every request is submitted to one of three lanes, each with its own RQ queue:
+
+    interactive -> nnunet_jobs_interactive   (viewer / contouring clients)
+    normal      -> nnunet_jobs
+    bulk        -> nnunet_jobs_bulk          (scripts, large studies)
+
+Workers listen to the queues in that order (see scripts/start_predict_worker.sh),
+so RQ always takes interactive work first.
+
+Within a lane, requests are not enqueued as RQ jobs directly. They are parked
+in one Redis list per requester_id, and an anonymous "slot" job is enqueued
+for each of them. A slot job runs whichever pending request is next by
+weighted fair share: the requester with the smallest virtual time
+(images served / weight, settings.PREDICTION_REQUESTER_WEIGHTS) goes first,
+and a requester becoming active again starts at the lane's current virtual
+time instead of cashing in its idle period. One requester submitting 200
+volumes therefore only delays others by about one request each.
+
+With micro-batching on (settings.PREDICTION_BATCH_WINDOW_SEC > 0), the slot
+job first waits until the batching window of the request next in line has
+closed (not in the interactive lane), then takes up to
+PREDICTION_BATCH_MAX_REQUESTS pending requests of the lane for the same model
+as one batch, see app/core/prediction_batcher.py.
+
+With the local job executor (settings.JOB_PROCESSOR = "local") there is no
+Redis: each request is enqueued directly as a batch of one with its lane as
+priority and its requester as fair-share group, and the executor applies the
+same ordering, see app/core/job_executor.py. With SLURM
+(JOB_PROCESSOR = "slurm") requests are parked on disk and submitted in
+batches, one allocation each, see app/core/prediction_slurm.py.
+"""
+
+import json
+import time
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import job_executor, prediction_batcher, prediction_slurm
+
+logger = get_logger(__name__)
+
+LANES = ("interactive", "normal", "bulk")
+
+LANE_QUEUE_NAMES = {
+    "interactive": "nnunet_jobs_interactive",
+    "normal": "nnunet_jobs",
+    "bulk": "nnunet_jobs_bulk",
+}
+
+KEY_PREFIX = "nnunet:fair:"
+
+
+def _key(lane: str, *parts) -> str:
+    return KEY_PREFIX + ":".join([lane, *parts])
+
+
+def get_redis():
+    return job_executor.get_executor().connection
+
+
+def validate_lane(lane: str | None) -> str:
+    lane = lane or settings.PREDICTION_DEFAULT_LANE
+    if lane not in LANES:
+        raise ValueError(f"Invalid priority '{lane}'. Allowed: {', '.join(LANES)}")
+    return lane
+
+
+def requester_weight(requester_id: str) -> float:
+    return max(float(settings.PREDICTION_REQUESTER_WEIGHTS.get(requester_id, 1.0)), 1e-6)
+
+
+def request_cost(job_metadata: dict) -> float:
+    return float(job_metadata.get("num_images", 1))
+
+
+def submit(job_metadata: dict, lane: str, **enqueue_kwargs) -> str | None:
+    """
+    Queue a prediction request in its lane. Returns the id of the job that will
+    run it, or None while the request waits to be batched into a SLURM job.
+    """
+    lane = validate_lane(lane)
+    requester = job_metadata.get("requester_id") or "anonymous"
+    job_metadata = {**job_metadata, "requester_id": requester, "lane": lane, "submitted_at": time.time()}
+    executor = job_executor.get_executor()
+
+    if executor.name == "local":
+        job_id = executor.enqueue(
+            prediction_batcher.run_batch, [job_metadata],
+            queue=LANE_QUEUE_NAMES[lane], priority=LANES.index(lane), group=f"{lane}:{requester}",
+            cost=request_cost(job_metadata), weight=requester_weight(requester), **enqueue_kwargs,
+        )
+        logger.info(f"Queued {job_metadata['job_id']} of '{requester}' in lane '{lane}'")
+        return job_id
+
+    if executor.name == "slurm":
+        prediction_slurm.park(job_metadata, lane, **enqueue_kwargs)
+        return None
+
+    connection = executor.connection
+    with connection.lock(_key(lane, "lock"), timeout=30, blocking_timeout=30):
+        if connection.sadd(_key(lane, "requesters"), requester):
+            # (re)activated requester: no credit for the time it had nothing queued
+            floor = float(connection.get(_key(lane, "floor")) or 0.0)
+            vtime = float(connection.hget(_key(lane, "vtime"), requester) or 0.0)
+            connection.hset(_key(lane, "vtime"), requester, max(vtime, floor))
+        connection.rpush(_key(lane, "q", requester), json.dumps(job_metadata))
+
+    logger.info(f"Parked {job_metadata['job_id']} of '{requester}' in lane '{lane}'")
+    return executor.enqueue(run_next, lane, queue=LANE_QUEUE_NAMES[lane], **enqueue_kwargs)
+
+
+def _pop_next(connection, lane: str) -> tuple[dict | None, float]:
+    """
+    Pop the oldest request of the requester with the smallest virtual time and
+    charge the requester for it. Returns (job_metadata, the requester's virtual
+    time before the charge). Call with the lane lock held.
+    """
+    requesters = [m.decode() for m in connection.smembers(_key(lane, "requesters"))]
+    if not requesters:
+        return None, 0.0
+
+    vtimes = connection.hmget(_key(lane, "vtime"), requesters)
+    order = sorted(zip((float(v or 0.0) for v in vtimes), requesters))
+    for vtime, requester in order:
+        item = connection.lpop(_key(lane, "q", requester))
+        if item is None:
+            connection.srem(_key(lane, "requesters"), requester)
+            continue
+
+        job_metadata = json.loads(item)
+        connection.hset(_key(lane, "vtime"), requester, vtime + request_cost(job_metadata) / requester_weight(requester))
+        if connection.llen(_key(lane, "q", requester)) == 0:
+            connection.srem(_key(lane, "requesters"), requester)
+        return job_metadata, vtime
+    return None, 0.0
+
+
+def _put_back(connection, lane: str, job_metadata: dict):
+    """Undo _pop_next() for one request."""
+    requester = job_metadata["requester_id"]
+    connection.lpush(_key(lane, "q", requester), json.dumps(job_metadata))
+    connection.sadd(_key(lane, "requesters"), requester)
+    connection.hincrbyfloat(_key(lane, "vtime"), requester, -request_cost(job_metadata) / requester_weight(requester))
+
+
+def _take_next(connection, lane: str, max_requests: int) -> list[dict]:
+    """
+    Take the next request by fair share and, if max_requests > 1, further
+    pending requests of the lane for the same model, in fair-share order.
+    Call with the lane lock held.
+    """
+    first, vtime = _pop_next(connection, lane)
+    if first is None:
+        return []
+    floor = vtime
+    if first.get("provisional"):
+        # progressive requests run their two passes on their own
+        max_requests = 1
+
+    key = prediction_batcher.model_key(first)
+    batch = [first]
+    skipped = []
+    while len(batch) < max_requests:
+        job_metadata, vtime = _pop_next(connection, lane)
+        if job_metadata is None:
+            break
+        if prediction_batcher.model_key(job_metadata) == key and not job_metadata.get("provisional"):
+            batch.append(job_metadata)
+            floor = max(floor, vtime)
+        else:
+            skipped.append(job_metadata)
+
+    # the others go back to the head of their requester's list, in their order
+    for job_metadata in reversed(skipped):
+        _put_back(connection, lane, job_metadata)
+
+    connection.set(_key(lane, "floor"), floor)
+    return batch
+
+
+def run_next(lane: str) -> dict:
+    """RQ slot job: run the next request of `lane` by fair share (with its batch, if batching is on)."""
+    connection = get_redis()
+    lock_name = _key(lane, "lock")
+    window = settings.PREDICTION_BATCH_WINDOW_SEC
+
+    if window > 0 and lane != "interactive":
+        # let the batching window of the request next in line close first
+        with connection.lock(lock_name, timeout=30, blocking_timeout=60):
+            head, _ = _pop_next(connection, lane)
+            if head is not None:
+                _put_back(connection, lane, head)
+        if head is not None:
+            wait = head["submitted_at"] + window - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+    max_requests = settings.PREDICTION_BATCH_MAX_REQUESTS if window > 0 else 1
+    with connection.lock(lock_name, timeout=30, blocking_timeout=60):
+        batch = _take_next(connection, lane, max_requests)
+    if not batch:
+        logger.info(f"No pending requests in lane '{lane}' (already taken by an earlier slot)")
+        return {"status": "empty"}
+    return prediction_batcher.run_batch(batch)
+
+
+def cancel_pending(lane: str, requester_id: str, input_dir: str, job_id: str | None = None) -> bool:
+    """
+    Take a queued request out of its lane, together with its job if that is
+    still queued. Returns False if the request is not (or no longer) queued.
+    """
+    executor = job_executor.get_executor()
+    if executor.name == "local":
+        return bool(job_id) and executor.cancel(job_id)
+    if executor.name == "slurm":
+        return prediction_slurm.unpark(validate_lane(lane), input_dir) or prediction_slurm.cancel_submitted(input_dir)
+
+    connection = executor.connection
+    lane = validate_lane(lane)
+    requester = requester_id or "anonymous"
+    list_key = _key(lane, "q", requester)
+    input_dir = input_dir.rstrip("/")
+
+    with connection.lock(_key(lane, "lock"), timeout=30, blocking_timeout=30):
+        for item in connection.lrange(list_key, 0, -1):
+            if json.loads(item).get("input_dir", "").rstrip("/") != input_dir:
+                continue
+            connection.lrem(list_key, 1, item)
+            if connection.llen(list_key) == 0:
+                connection.srem(_key(lane, "requesters"), requester)
+            break
+        else:
+            return False
+
+    if job_id:
+        # slot jobs are interchangeable, so dropping this request's slot keeps slots and requests balanced
+        executor.cancel(job_id)
+    return True
+
+
+def pending_counts() -> dict:
+    """Number of queued requests per lane and requester."""
+    executor = job_executor.get_executor()
+    counts = {lane: {} for lane in LANES}
+    if executor.name == "local":
+        for record in executor.pending():
+            for lane, queue_name in LANE_QUEUE_NAMES.items():
+                if record["queue"] == queue_name:
+                    requester = record["group"].split(":", 1)[1]
+                    counts[lane][requester] = counts[lane].get(requester, 0) + 1
+        return counts
+    if executor.name == "slurm":
+        for lane in LANES:
+            for _, item in prediction_slurm.parked([lane]):
+                requester = item["job_metadata"]["requester_id"]
+                counts[lane][requester] = counts[lane].get(requester, 0) + 1
+        return counts
+
+    connection = executor.connection
+    for lane in LANES:
+        requesters = [m.decode() for m in connection.smembers(_key(lane, "requesters"))]
+        counts[lane] = {requester: connection.llen(_key(lane, "q", requester)) for requester in requesters}
+    return counts
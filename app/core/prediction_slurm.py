@@ -0,0 +1,239 @@
+"""
+Batching of prediction requests into SLURM allocations
+(settings.JOB_PROCESSOR = "slurm").
+
+Queueing, node startup and loading the model cost about as much per SLURM job
+as a small prediction, so requests are not submitted one by one. They are
+parked as JSON files in <SLURM jobs dir>/parked/<lane>/, and a flusher in the
+API process (started by app.main) submits them once the oldest one has waited
+settings.SLURM_BATCH_WINDOW_SEC (the interactive lane right away). The
+parked requests are taken in lane order, then by requester fair share, and
+grouped per model into batches of up to SLURM_BATCH_MAX_REQUESTS; each batch
+becomes one SLURM job running prediction_batcher.run_batch(), i.e. one
+nnU-Net pass over all of its requests on one node.
+
+The flusher records the executor job id in every request's state.json, so
+progress lookups and cancellation find it.
+"""
+
+import os
+import json
+import time
+import asyncio
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import job_executor, nnunet_worker, prediction_batcher, prediction_cancel, prediction_progress, slurm_tools
+
+logger = get_logger(__name__)
+
+PARKED_DIR_NAME = "parked"
+FLUSH_POLL_SEC = 1.0
+
+_vtime = {}  # "<lane>:<requester>" -> virtual time, in the flushing process
+_task = None
+
+
+def _lane_dir(lane: str) -> str:
+    return os.path.join(job_executor.get_executor().jobs_dir, PARKED_DIR_NAME, lane)
+
+
+def park(job_metadata: dict, lane: str, **enqueue_kwargs):
+    """Park a request (job_metadata with lane, requester_id and submitted_at set) until the next flush."""
+    lane_dir = _lane_dir(lane)
+    os.makedirs(lane_dir, exist_ok=True)
+    path = os.path.join(lane_dir, f"{job_metadata['job_id']}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"job_metadata": job_metadata, "enqueue_kwargs": enqueue_kwargs}, f)
+    os.replace(path + ".tmp", path)
+    logger.info(f"Parked {job_metadata['job_id']} of '{job_metadata['requester_id']}' in lane '{lane}' for SLURM")
+
+
+def parked(lanes) -> list[tuple[str, dict]]:
+    """(path, parked item) of the parked requests of the lanes."""
+    items = []
+    for lane in lanes:
+        lane_dir = _lane_dir(lane)
+        if not os.path.isdir(lane_dir):
+            continue
+        for fname in os.listdir(lane_dir):
+            if not fname.endswith(".json"):
+                continue
+            path = os.path.join(lane_dir, fname)
+            try:
+                with open(path, "r") as f:
+                    items.append((path, json.load(f)))
+            except (OSError, ValueError):
+                continue  # taken or cancelled meanwhile
+    return items
+
+
+def unpark(lane: str, input_dir: str) -> bool:
+    """Remove a parked request. Returns False if it is not parked (anymore)."""
+    input_dir = input_dir.rstrip("/")
+    for path, item in parked([lane]):
+        if item["job_metadata"]["input_dir"].rstrip("/") != input_dir:
+            continue
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+    return False
+
+
+def cancel_submitted(input_dir: str) -> bool:
+    """
+    Cancel the SLURM job of a flushed request if it is still queued and all
+    requests of its batch are cancelled. Returns True if the job was cancelled.
+    """
+    executor = job_executor.get_executor()
+    job_id = (prediction_progress.read_state(input_dir) or {}).get("rq_job_id")
+    record = executor.record(job_id) if job_id else None
+    if record is None or record["func"] != job_executor.func_path(prediction_batcher.run_batch):
+        return False
+
+    batch = record["args"][0]
+    if not prediction_cancel.all_cancelled(job_metadata["input_dir"] for job_metadata in batch):
+        return False
+    if not executor.cancel(job_id):
+        return False
+    for job_metadata in batch:
+        if job_metadata["input_dir"].rstrip("/") != input_dir.rstrip("/") and os.path.isdir(job_metadata["input_dir"]):
+            nnunet_worker.cancel_request(job_metadata, slurm_job_id=record.get("slurm_job_id"))
+    return True
+
+
+def submitted_counts(since: float) -> dict:
+    """
+    {lane: requests} of the batches submitted since `since` (epoch seconds)
+    whose SLURM job is still queued or running.
+    """
+    executor = job_executor.get_executor()
+    func = job_executor.func_path(prediction_batcher.run_batch)
+    counts = {}
+    with os.scandir(os.path.join(executor.jobs_dir, "jobs")) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json") or entry.name.endswith(".meta.json"):
+                continue
+            if entry.stat().st_mtime < since:
+                continue
+            job_id = entry.name[:-len(".json")]
+            record = executor.record(job_id)
+            if record is None or record.get("func") != func or record["status"] in slurm_tools.FINAL_STATUSES:
+                continue
+            job = executor.fetch(job_id)
+            if job is None or job["status"] in slurm_tools.FINAL_STATUSES:
+                continue
+            batch = record["args"][0]
+            lane = batch[0].get("lane") if batch else None
+            counts[lane] = counts.get(lane, 0) + len(batch)
+    return counts
+
+
+def _make_batches(items: list[tuple[str, dict]]) -> list[list[tuple[str, dict]]]:
+    """Fair-share order, grouped per model into batches of at most SLURM_BATCH_MAX_REQUESTS."""
+    from app.core.prediction_scheduler import LANES, requester_weight, request_cost
+
+    def group(item):
+        job_metadata = item[1]["job_metadata"]
+        return f"{job_metadata['lane']}:{job_metadata['requester_id']}"
+
+    # (re)activated requesters: no credit for the time they had nothing parked
+    active = {group(item) for item in items}
+    floor = min((_vtime[g] for g in active if g in _vtime), default=0.0)
+    for g in active:
+        _vtime[g] = max(_vtime.get(g, 0.0), floor)
+
+    batches = []
+    open_batches = {}  # model key -> batch still taking requests
+    remaining = list(items)
+    while remaining:
+        item = min(remaining, key=lambda it: (
+            LANES.index(it[1]["job_metadata"]["lane"]), _vtime[group(it)], it[1]["job_metadata"]["submitted_at"],
+        ))
+        remaining.remove(item)
+        job_metadata = item[1]["job_metadata"]
+        _vtime[group(item)] += request_cost(job_metadata) / requester_weight(job_metadata["requester_id"])
+
+        if job_metadata.get("provisional"):
+            # progressive requests run their two passes on their own
+            batches.append([item])
+            continue
+        key = (job_metadata["lane"], prediction_batcher.model_key(job_metadata))
+        batch = open_batches.get(key)
+        if batch is None or len(batch) >= settings.SLURM_BATCH_MAX_REQUESTS:
+            batch = open_batches[key] = []
+            batches.append(batch)
+        batch.append(item)
+    return batches
+
+
+def flush(force: bool = False) -> list[str]:
+    """Submit the parked requests if the batching window is over. Returns the ids of the submitted jobs."""
+    from app.core.prediction_scheduler import LANES, LANE_QUEUE_NAMES
+
+    # a lane is flushed as a whole once its oldest request has waited out the window
+    items = []
+    for lane in LANES:
+        lane_items = parked([lane])
+        if not lane_items:
+            continue
+        oldest = min(item["job_metadata"]["submitted_at"] for _, item in lane_items)
+        if force or lane == "interactive" or time.time() - oldest >= settings.SLURM_BATCH_WINDOW_SEC:
+            items += lane_items
+    if not items:
+        return []
+
+    executor = job_executor.get_executor()
+    job_ids = []
+    for batch_items in _make_batches(items):
+        batch = []
+        for path, item in batch_items:
+            try:
+                os.remove(path)  # claims the request; gone if it was cancelled meanwhile
+            except FileNotFoundError:
+                continue
+            batch.append(item["job_metadata"])
+        if not batch:
+            continue
+
+        lane = batch[0]["lane"]
+        try:
+            job_id = executor.enqueue(
+                prediction_batcher.run_batch, batch,
+                queue=LANE_QUEUE_NAMES[lane], **batch_items[0][1]["enqueue_kwargs"],
+            )
+        except Exception as e:
+            logger.exception(f"Failed to submit a batch of {len(batch)} requests to SLURM: {e}")
+            for job_metadata in batch:
+                nnunet_worker.fail_request(job_metadata, error=f"SLURM submission failed: {e}")
+            continue
+
+        for job_metadata in batch:
+            if os.path.isdir(job_metadata["input_dir"]):
+                prediction_progress.write_state(job_metadata["input_dir"], rq_job_id=job_id)
+        logger.info(f"Submitted {len(batch)} requests of lane '{lane}' as job {job_id}: "
+                    f"{[job_metadata['job_id'] for job_metadata in batch]}")
+        job_ids.append(job_id)
+    return job_ids
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_POLL_SEC)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception as e:
+            logger.exception(f"Flushing parked prediction requests failed: {e}")
+
+
+def start():
+    """Start flushing parked requests; call from the running event loop (FastAPI startup)."""
+    global _task
+    _task = asyncio.get_running_loop().create_task(_flush_loop())
+    logger.info(f"SLURM prediction batching started (window {settings.SLURM_BATCH_WINDOW_SEC}s)")
+
+
+def stop():
+    if _task is not None:
+        _task.cancel()
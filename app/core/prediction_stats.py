@@ -0,0 +1,165 @@
+"""
+Duration statistics and ETAs of prediction requests.
+
+For every finished prediction the worker records into the durations table of
+the prediction index (see record_finished): the dataset, configuration, tier
+and lane, the number of input voxels, the time the request waited in the
+queue and the time spent per stage (preprocessing, predicting, exporting,
+postprocessing). A batched pass is shared by its requests, so its time is
+divided among them.
+
+duration_stats() reports p50/p95/p99 of these per dataset, configuration and
+tier (GET /predictions/stats). queue_eta() estimates the position and the
+time to result of an unfinished request (GET /prediction): the estimated
+work of the unfinished requests served before it (prediction_admission),
+spread over settings.PREDICTION_ADMISSION_WORKERS, plus its own remaining
+work. Within a lane, requests are assumed to be served in submission order;
+fair share can reorder them.
+"""
+
+import os
+import math
+from datetime import datetime, timedelta
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.core import prediction_admission, prediction_index, prediction_scheduler
+
+logger = get_logger(__name__)
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def _summary(values: list[float]) -> dict:
+    result = {f"p{q}": percentile(values, q) for q in PERCENTILES}
+    result["mean"] = sum(values) / len(values) if values else None
+    return result
+
+
+def input_voxels(req_dir: str) -> int | None:
+    """Voxels of the request's input images (first channel), from the image headers."""
+    import SimpleITK as sitk
+
+    voxels = 0
+    for fname in os.listdir(req_dir):
+        if not (fname.startswith("image_") and "_0000." in fname):
+            continue
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(os.path.join(req_dir, fname))
+        reader.ReadImageInformation()
+        voxels += math.prod(reader.GetSize())
+    return voxels or None
+
+
+def record_finished(job_metadata: dict, state: dict, batch_size: int = 1, postprocess_sec: float | None = None):
+    """Record the durations of a finished prediction from its state.json (best effort)."""
+    try:
+        started_at = state.get("started_at")
+        if not started_at:
+            return
+        started = datetime.fromisoformat(started_at)
+        seconds = (datetime.now() - started).total_seconds() / batch_size
+
+        stage_seconds = {stage: s / batch_size for stage, s in (state.get("stage_seconds") or {}).items()}
+        if postprocess_sec is not None:
+            stage_seconds["postprocessing"] = postprocess_sec / batch_size
+
+        queue_sec = None
+        if job_metadata.get("submitted_at"):
+            queue_sec = max(0.0, started.timestamp() - job_metadata["submitted_at"])
+
+        try:
+            voxels = input_voxels(job_metadata["input_dir"])
+        except Exception as e:
+            logger.debug(f"[{job_metadata.get('job_id')}] Could not read the input size: {e}")
+            voxels = None
+
+        prediction_index.record_duration(
+            job_metadata["dataset_id"], job_metadata.get("tier"), job_metadata.get("num_images", 1),
+            prediction_admission.relative_cost(job_metadata), seconds,
+            configuration=job_metadata.get("configuration"), lane=job_metadata.get("lane"), voxels=voxels,
+            queue_sec=queue_sec, stage_seconds={stage: round(s, 3) for stage, s in stage_seconds.items()},
+        )
+    except Exception as e:
+        logger.warning(f"[{job_metadata.get('job_id')}] Failed to record the prediction durations: {e}")
+
+
+def duration_stats(dataset_id: str | None = None, configuration: str | None = None, tier: str | None = None,
+                   since: str | None = None, limit: int = 10000) -> list[dict]:
+    """Latency percentiles of the recorded predictions, per dataset, configuration and tier."""
+    groups = {}
+    for row in prediction_index.list_durations(dataset_id, configuration, tier, since, limit):
+        groups.setdefault((row["dataset_id"], row["configuration"], row["tier"]), []).append(row)
+
+    result = []
+    for (group_dataset, group_configuration, group_tier), rows in sorted(groups.items(), key=lambda g: str(g[0])):
+        stages = {}
+        for row in rows:
+            for stage, seconds in row["stage_seconds"].items():
+                stages.setdefault(stage, []).append(seconds)
+        per_megavoxel = [row["seconds"] / row["voxels"] * 1e6 for row in rows if row["voxels"]]
+        result.append({
+            "dataset_id": group_dataset,
+            "configuration": group_configuration,
+            "tier": group_tier,
+            "count": len(rows),
+            "seconds": _summary([row["seconds"] for row in rows]),
+            "queue_sec": _summary([row["queue_sec"] for row in rows if row["queue_sec"] is not None]),
+            "stage_seconds": {stage: _summary(values) for stage, values in stages.items()},
+            "seconds_per_megavoxel": _summary(per_megavoxel),
+            "first": rows[-1]["finished_at"],
+            "last": rows[0]["finished_at"],
+        })
+    return result
+
+
+def queue_eta(dataset_id: str, req_id: str, req_info: dict, state: dict) -> dict | None:
+    """
+    {"position", "requests_ahead_sec", "eta_sec", "eta"} of an unfinished
+    request: position 0 once it is running. None if it is not a queued
+    prediction (no lane recorded).
+    """
+    lane = req_info.get("priority")
+    if lane not in prediction_scheduler.LANES:
+        return None
+
+    workers = max(settings.PREDICTION_ADMISSION_WORKERS, 1)
+    own_sec = req_info.get("estimated_sec") or settings.PREDICTION_ADMISSION_DEFAULT_SEC
+
+    if state.get("status") in ("running", "postprocessing"):
+        # its own estimate, less the time it has been running
+        elapsed = 0.0
+        if state.get("started_at"):
+            elapsed = (datetime.now() - datetime.fromisoformat(state["started_at"])).total_seconds()
+        eta_sec = max(own_sec - elapsed, 0.0)
+        position = 0
+        ahead_sec = 0.0
+    else:
+        since = (datetime.now() - timedelta(seconds=settings.PREDICTION_ADMISSION_HORIZON_SEC)).isoformat()
+        lanes = prediction_scheduler.LANES
+        ahead = prediction_index.in_flight_ahead(
+            dataset_id, req_id, list(lanes[:lanes.index(lane)]), lane, req_info.get("at") or "",
+            since, settings.PREDICTION_ADMISSION_DEFAULT_SEC,
+        )
+        # stale index rows (jobs gone without an outcome) don't hold the request back
+        scheduled = prediction_admission.scheduled_counts()
+        if scheduled is not None:
+            limit = sum(scheduled[name] for name in lanes[:lanes.index(lane) + 1])
+            ahead = prediction_admission.bound_work(ahead, limit + prediction_admission.running_limit())
+        position = ahead["requests"] + 1
+        ahead_sec = ahead["estimated_sec"]
+        eta_sec = ahead_sec / workers + own_sec
+
+    return {
+        "position": position,
+        "requests_ahead_sec": round(ahead_sec, 1),
+        "eta_sec": round(eta_sec, 1),
+        "eta": (datetime.now() + timedelta(seconds=eta_sec)).isoformat(),
+    }
@@ -0,0 +1,146 @@
+"""
+Latency tiers of prediction requests.
+
+A tier is a named preset of how much work nnU-Net puts into a prediction:
+
+    preview   one fold, no test-time mirroring, coarser sliding window (tile step 0.75)
+    standard  all folds, no mirroring
+    full      all folds with mirroring, i.e. the full ensemble (nnU-Net's default)
+
+The defaults can be overridden or extended per dataset with a tiers.json in the
+dataset's results folder (results/DatasetXXX_Name/tiers.json), e.g.
+
+    {
+        "preview": {"configuration": "2d", "folds": [0], "use_mirroring": false, "tile_step_size": 0.75},
+        "full": {"configuration": "3d_fullres", "folds": "all"}
+    }
+
+Keys left out of a preset take the value of the default preset of the same
+name (or of "full"). "folds": "all" means every fold with a final checkpoint.
+Presets are resolved against the models actually present in the results
+folder, so a request for a tier whose configuration or folds are not trained
+is rejected up front instead of failing in the worker.
+"""
+
+import os
+import re
+import json
+from app.core.config import settings
+from app.core.logging_config import get_logger
+import app.core.nnunet_tools as nnunet_tools
+
+logger = get_logger(__name__)
+
+# nnU-Net directories
+nnunet_data_dir = settings.NNUNET_DATA_DIR
+nnunet_results_dir = os.path.join(nnunet_data_dir, 'results')
+
+TIERS_FILE_NAME = "tiers.json"
+
+_BASE_PRESET = {
+    "configuration": "3d_lowres",
+    "trainer": "nnUNetTrainer",
+    "plans": "nnUNetPlans",
+    "folds": "all",
+    "use_mirroring": True,
+    "tile_step_size": 0.5,
+}
+
+DEFAULT_TIERS = {
+    "preview": {**_BASE_PRESET, "folds": [0], "use_mirroring": False, "tile_step_size": 0.75},
+    "standard": {**_BASE_PRESET, "use_mirroring": False},
+    "full": dict(_BASE_PRESET),
+}
+
+
+class TierError(ValueError):
+    """Raised for an unknown tier or one whose model is not available."""
+
+
+def load_tiers(dataset_id) -> dict:
+    """The dataset's tier presets: the defaults, overridden by results/<dataset>/tiers.json if present."""
+    tiers = {name: dict(preset) for name, preset in DEFAULT_TIERS.items()}
+    dataset_name = nnunet_tools.get_dataset_name(nnunet_results_dir, dataset_id)
+    if dataset_name is None:
+        return tiers
+
+    tiers_path = os.path.join(nnunet_results_dir, dataset_name, TIERS_FILE_NAME)
+    if not os.path.exists(tiers_path):
+        return tiers
+
+    try:
+        with open(tiers_path, "r") as f:
+            overrides = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring unreadable {tiers_path}: {e}")
+        return tiers
+
+    for name, preset in overrides.items():
+        tiers[name] = {**tiers.get(name, DEFAULT_TIERS["full"]), **preset}
+    return tiers
+
+
+def available_folds(dataset_id, configuration: str, trainer: str, plans: str) -> list[int]:
+    """Folds of the model with a checkpoint_final.pth."""
+    model_folder = nnunet_tools.get_model_folder(nnunet_results_dir, dataset_id, configuration, trainer, plans)
+    if model_folder is None or not os.path.isdir(model_folder):
+        return []
+
+    folds = []
+    for name in os.listdir(model_folder):
+        m = re.fullmatch(r"fold_(\d+)", name)
+        if m and os.path.exists(os.path.join(model_folder, name, "checkpoint_final.pth")):
+            folds.append(int(m.group(1)))
+    return sorted(folds)
+
+
+def resolve_preset(dataset_id, name: str, preset: dict) -> dict:
+    """Validate a preset against the trained models. Returns the prediction settings of the tier."""
+    configuration = preset["configuration"]
+    trainer = preset["trainer"]
+    plans = preset["plans"]
+
+    folds = available_folds(dataset_id, configuration, trainer, plans)
+    if not folds:
+        raise TierError(f"Tier '{name}': no trained model {trainer}__{plans}__{configuration} for dataset {dataset_id}")
+
+    if preset["folds"] != "all":
+        requested = [int(f) for f in preset["folds"]]
+        missing = sorted(set(requested) - set(folds))
+        if missing:
+            raise TierError(f"Tier '{name}': folds {missing} of {configuration} are not trained (available: {folds})")
+        folds = requested
+
+    tile_step_size = float(preset["tile_step_size"])
+    if not 0 < tile_step_size <= 1:
+        raise TierError(f"Tier '{name}': tile_step_size must be in (0, 1], got {tile_step_size}")
+
+    return {
+        "tier": name,
+        "configuration": configuration,
+        "trainer": trainer,
+        "plans": plans,
+        "folds": folds,
+        "use_mirroring": bool(preset["use_mirroring"]),
+        "tile_step_size": tile_step_size,
+    }
+
+
+def resolve_tier(dataset_id, name: str | None) -> dict:
+    """Prediction settings of tier `name` (default settings.PREDICTION_DEFAULT_TIER) for the dataset."""
+    name = name or settings.PREDICTION_DEFAULT_TIER
+    tiers = load_tiers(dataset_id)
+    if name not in tiers:
+        raise TierError(f"Unknown tier '{name}'. Allowed: {', '.join(sorted(tiers))}")
+    return resolve_preset(dataset_id, name, tiers[name])
+
+
+def list_tiers(dataset_id) -> list[dict]:
+    """All tiers of the dataset with their resolved settings, or the reason they are unavailable."""
+    result = []
+    for name, preset in load_tiers(dataset_id).items():
+        try:
+            result.append({**resolve_preset(dataset_id, name, preset), "available": True})
+        except TierError as e:
+            result.append({"tier": name, **preset, "available": False, "reason": str(e)})
+    return result
@@ -0,0 +1,249 @@
+"""
+Completion webhooks of prediction requests.
+
+A request submitted with a `callback_url` form field (kept in req.json with
+the other extra fields) is reported to that URL once it completes or fails.
+Only hosts matching settings.WEBHOOK_ALLOWED_HOSTS (fnmatch patterns such as
+"*.example.org"; empty disables callbacks) are accepted, so clients can't make
+the server call internal addresses.
+
+Workers may run where the integrations can't be reached (SLURM nodes), so
+they don't call out themselves: notify() drops a small JSON record into the
+outbox directory (settings.WEBHOOK_DIR, default NNUNET_DATA_DIR/webhooks)
+and a dispatcher in the API process (started by app.main) delivers it.
+
+Every POLL_SEC the dispatcher takes the due records, groups them per
+callback URL and POSTs each group as one body
+
+    {"events": [{"event": "prediction.completed", "dataset_id", "req_id", ...}, ...]}
+
+of at most WEBHOOK_MAX_BATCH events, with at most WEBHOOK_WORKERS deliveries
+in flight. A failed delivery is retried after WEBHOOK_BACKOFF_SEC, doubling
+per attempt up to WEBHOOK_BACKOFF_MAX_SEC; after WEBHOOK_MAX_ATTEMPTS the
+records are moved to failed/; records queued behind a failed chunk wait with
+it without using up attempts. With WEBHOOK_SECRET set, bodies are signed in
+an X-Webhook-Signature header (sha256=<HMAC of the body>). An flock on the
+outbox keeps several API processes from delivering the same records.
+"""
+
+import os
+import json
+import time
+import hmac
+import fcntl
+import fnmatch
+import asyncio
+import hashlib
+import urllib.request
+from datetime import datetime
+from urllib.parse import urlparse
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+POLL_SEC = 1.0
+FAILED_DIR_NAME = "failed"
+LOCK_FILE_NAME = "dispatcher.lock"
+
+_task = None
+
+
+def outbox_dir() -> str:
+    return settings.WEBHOOK_DIR or os.path.join(settings.NNUNET_DATA_DIR, "webhooks")
+
+
+def validate_callback_url(url: str) -> str:
+    """Raise ValueError unless url is an http(s) URL to a host in settings.WEBHOOK_ALLOWED_HOSTS."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"Invalid callback_url '{url}': must be an http(s) URL")
+    host = parsed.hostname.lower()
+    if not any(fnmatch.fnmatchcase(host, pattern.lower()) for pattern in settings.WEBHOOK_ALLOWED_HOSTS):
+        raise ValueError(f"Invalid callback_url '{url}': host '{host}' is not in WEBHOOK_ALLOWED_HOSTS")
+    return url
+
+
+def _read_req_info(req_dir: str) -> dict:
+    try:
+        with open(os.path.join(req_dir, "req.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_record(record: dict):
+    directory = outbox_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{time.time_ns()}_{record['event']['req_id']}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(record, f)
+    os.replace(path + ".tmp", path)
+
+
+def notify(job_metadata: dict, status: str, output_labels: list[str] | None = None, error: str | None = None,
+           req_info: dict | None = None):
+    """Queue the webhook of a finished request if it has a callback_url (best effort)."""
+    req_dir = job_metadata["input_dir"].rstrip("/")
+    try:
+        req_info = req_info if req_info is not None else _read_req_info(req_dir)
+        url = req_info.get("callback_url")
+        if not url:
+            return
+        event = {
+            "event": f"prediction.{status}",
+            "dataset_id": os.path.basename(os.path.dirname(req_dir)),
+            "req_id": os.path.basename(req_dir),
+            "requester_id": req_info.get("requester_id"),
+            "image_id_list": req_info.get("image_id_list", []),
+            "status": status,
+            "tier": req_info.get("tier"),
+            "output_labels": sorted(output_labels or []),
+            "finished_at": datetime.now().isoformat(),
+        }
+        if error:
+            event["error"] = error
+        _write_record({"url": url, "event": event, "attempts": 0, "next_attempt_at": 0.0})
+    except Exception as e:
+        logger.warning(f"[{job_metadata.get('job_id')}] Failed to queue the webhook: {e}")
+
+
+def _pending() -> list[tuple[str, dict]]:
+    directory = outbox_dir()
+    if not os.path.isdir(directory):
+        return []
+    items = []
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith(".json"):
+            continue
+        path = os.path.join(directory, fname)
+        try:
+            with open(path, "r") as f:
+                items.append((path, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return items
+
+
+def _post(url: str, payload: dict):
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if settings.WEBHOOK_SECRET:
+        signature = hmac.new(settings.WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        headers["X-Webhook-Signature"] = f"sha256={signature}"
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    # raises HTTPError for 4xx/5xx
+    with urllib.request.urlopen(request, timeout=settings.WEBHOOK_TIMEOUT_SEC) as response:
+        response.read()
+
+
+def _backoff_sec(attempts: int) -> float:
+    return min(settings.WEBHOOK_BACKOFF_SEC * 2 ** (attempts - 1), settings.WEBHOOK_BACKOFF_MAX_SEC)
+
+
+def _save(path: str, record: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(record, f)
+    os.replace(path + ".tmp", path)
+
+
+def _give_up(path: str, record: dict, error):
+    failed_dir = os.path.join(outbox_dir(), FAILED_DIR_NAME)
+    os.makedirs(failed_dir, exist_ok=True)
+    record["last_error"] = str(error)
+    _save(path, record)
+    os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+    logger.error(f"Giving up on the webhook of {record['event']['req_id']} to {record['url']}: {error}")
+
+
+def _retry_later(chunk: list[tuple[str, dict]], rest: list[tuple[str, dict]], error: Exception):
+    """
+    Reschedule the records of a failed delivery (chunk), or give up on them.
+    The records after it (rest) were not sent: they wait as long, without
+    counting an attempt.
+    """
+    next_attempt_at = time.time()
+    for path, record in chunk:
+        record["attempts"] += 1
+        record["last_error"] = str(error)
+        if record["attempts"] >= settings.WEBHOOK_MAX_ATTEMPTS:
+            _give_up(path, record, error)
+            continue
+        record["next_attempt_at"] = time.time() + _backoff_sec(record["attempts"])
+        next_attempt_at = max(next_attempt_at, record["next_attempt_at"])
+        _save(path, record)
+    for path, record in rest:
+        record["next_attempt_at"] = max(record["next_attempt_at"], next_attempt_at)
+        _save(path, record)
+
+
+def _remove(items: list[tuple[str, dict]]):
+    for path, _ in items:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def _deliver(url: str, items: list[tuple[str, dict]], slots: asyncio.Semaphore):
+    """POST the records of one URL in order, in chunks; stop at the first failure."""
+    async with slots:
+        try:
+            validate_callback_url(url)  # WEBHOOK_ALLOWED_HOSTS may have changed since the request
+        except ValueError as e:
+            for path, record in items:
+                await asyncio.to_thread(_give_up, path, record, e)
+            return
+        for start in range(0, len(items), settings.WEBHOOK_MAX_BATCH):
+            chunk = items[start:start + settings.WEBHOOK_MAX_BATCH]
+            try:
+                await asyncio.to_thread(_post, url, {"events": [record["event"] for _, record in chunk]})
+            except Exception as e:
+                logger.warning(f"Webhook delivery of {len(chunk)} events to {url} failed: {e}")
+                await asyncio.to_thread(_retry_later, chunk, items[start + len(chunk):], e)
+                return
+            await asyncio.to_thread(_remove, chunk)
+            logger.info(f"Delivered {len(chunk)} webhook events to {url}")
+
+
+async def dispatch() -> int:
+    """Deliver the due records. Returns the number of URLs called."""
+    os.makedirs(outbox_dir(), exist_ok=True)
+    with open(os.path.join(outbox_dir(), LOCK_FILE_NAME), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0  # another API process is dispatching
+
+        now = time.time()
+        by_url = {}
+        for path, record in await asyncio.to_thread(_pending):
+            by_url.setdefault(record["url"], []).append((path, record))
+        # a URL that is backing off waits as a whole, so its events stay in order
+        due = {url: items for url, items in by_url.items()
+               if max(record["next_attempt_at"] for _, record in items) <= now}
+        if due:
+            slots = asyncio.Semaphore(max(settings.WEBHOOK_WORKERS, 1))
+            await asyncio.gather(*(_deliver(url, items, slots) for url, items in due.items()))
+        return len(due)
+
+
+async def _dispatch_loop():
+    while True:
+        await asyncio.sleep(POLL_SEC)
+        try:
+            await dispatch()
+        except Exception as e:
+            logger.exception(f"Webhook dispatch failed: {e}")
+
+
+def start():
+    """Start delivering webhooks; call from the running event loop (FastAPI startup)."""
+    global _task
+    _task = asyncio.get_running_loop().create_task(_dispatch_loop())
+    logger.info(f"Webhook dispatcher started (outbox {outbox_dir()})")
+
+
+def stop():
+    if _task is not None:
+        _task.cancel()
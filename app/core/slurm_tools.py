@@ -0,0 +1,154 @@
+"""
+Helpers for submitting and tracking SLURM jobs.
+
+The SLURM commands (sbatch, squeue, sacct, scancel) are looked up on PATH, so
+tests can put fake scripts there. If settings.SLURM_SETUP is set (e.g.
+"module load slurm"), every command runs in a login shell after it.
+"""
+
+import os
+import re
+import shlex
+import time
+import threading
+import subprocess
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# SLURM job state -> job status as reported by the executors (RQ names)
+_STATUS_OF_STATE = {
+    "PENDING": "queued",
+    "CONFIGURING": "queued",
+    "REQUEUED": "queued",
+    "REQUEUE_HOLD": "queued",
+    "SUSPENDED": "queued",
+    "RUNNING": "started",
+    "COMPLETING": "started",
+    "STAGE_OUT": "started",
+    "COMPLETED": "finished",
+    "CANCELLED": "canceled",
+}
+
+FINAL_STATUSES = ("finished", "failed", "canceled")
+
+
+def job_status(state: str) -> str:
+    """Executor job status of a SLURM state ("CANCELLED by 1000" -> "canceled"); unknown states count as failed."""
+    return _STATUS_OF_STATE.get(state.split()[0].rstrip("+"), "failed")
+
+
+def slurm_command(args: list[str]) -> list[str]:
+    if not settings.SLURM_SETUP:
+        return args
+    return ["bash", "-lc", f"{settings.SLURM_SETUP} && {shlex.join(args)}"]
+
+
+def run(args: list[str], check: bool = True) -> subprocess.CompletedProcess:
+    logger.debug(f"Running {args}")
+    return subprocess.run(slurm_command(args), capture_output=True, text=True, check=check)
+
+
+def render_template(template_file: str, script_file: str, **variables):
+    """Write template_file with its {name} placeholders replaced to script_file."""
+    with open(template_file) as f:
+        txt = f.read()
+    for name, value in variables.items():
+        txt = txt.replace("{" + name + "}", str(value))
+    with open(script_file, "w") as f:
+        f.write(txt)
+
+
+def time_limit(job_timeout) -> str:
+    """sbatch --time of an RQ-style job timeout (seconds, or "90m" / "3h" / "2d")."""
+    if isinstance(job_timeout, str):
+        m = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", job_timeout)
+        if m is None:
+            raise ValueError(f"Invalid job timeout '{job_timeout}'")
+        job_timeout = int(m.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[m.group(2)]
+    minutes = max(1, -(-int(job_timeout) // 60))
+    return f"{minutes // 1440}-{minutes % 1440 // 60:02}:{minutes % 60:02}:00"
+
+
+def sbatch(script_file: str, *options: str) -> str:
+    """Submit a batch script. Returns the SLURM job id."""
+    result = run(["sbatch", "--parsable", *options, script_file])
+    # --parsable prints "<job id>[;<cluster>]"
+    slurm_job_id = result.stdout.strip().split(";")[0]
+    if not slurm_job_id:
+        raise RuntimeError(f"sbatch printed no job id for {script_file}: {result.stderr.strip()}")
+    logger.info(f"Submitted {script_file} as SLURM job {slurm_job_id}")
+    return slurm_job_id
+
+
+def scancel(slurm_job_id: str):
+    run(["scancel", slurm_job_id], check=False)
+
+
+def _parse_states(output: str) -> dict:
+    states = {}
+    for line in output.splitlines():
+        parts = line.strip().split("|")
+        if len(parts) >= 2 and parts[0]:
+            states[parts[0]] = parts[1]
+    return states
+
+
+def query_states(slurm_job_ids: list[str]) -> dict:
+    """
+    {job id: state} of the given jobs, with one squeue call for all of them and
+    one sacct call for the ones squeue no longer lists (finished jobs).
+    """
+    if not slurm_job_ids:
+        return {}
+    # squeue fails for job ids it doesn't know; that just means they are done
+    result = run(["squeue", "--noheader", "--format=%i|%T", "--jobs", ",".join(slurm_job_ids)], check=False)
+    states = _parse_states(result.stdout)
+
+    missing = [job_id for job_id in slurm_job_ids if job_id not in states]
+    if missing:
+        result = run(["sacct", "--noheader", "--parsable2", "--allocations",
+                      "--format=JobID,State", "--jobs", ",".join(missing)], check=False)
+        states.update(_parse_states(result.stdout))
+    return {job_id: state for job_id, state in states.items() if job_id in slurm_job_ids}
+
+
+class StatusCache:
+    """
+    States of the SLURM jobs this process asked about, refreshed for all of
+    them at once at most every ttl_sec, so polling many requests costs one
+    squeue (+ sacct) call per interval instead of one per request.
+    """
+
+    def __init__(self, ttl_sec: float):
+        self.ttl_sec = ttl_sec
+        self._states = {}
+        self._watched = set()
+        self._polled_at = 0.0
+        self._lock = threading.Lock()
+
+    def state(self, slurm_job_id: str) -> str | None:
+        """The job's last known state, or None if SLURM doesn't know it (anymore)."""
+        with self._lock:
+            state = self._states.get(slurm_job_id)
+            if state is not None and job_status(state) in FINAL_STATUSES:
+                return state
+            if slurm_job_id not in self._watched or time.time() - self._polled_at > self.ttl_sec:
+                self._watched.add(slurm_job_id)
+                self._poll()
+            state = self._states.get(slurm_job_id)
+            if state is not None and job_status(state) in FINAL_STATUSES:
+                self._watched.discard(slurm_job_id)
+            return state
+
+    def _poll(self):
+        try:
+            self._states.update(query_states(sorted(self._watched)))
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Failed to query SLURM job states: {e}")
+        self._polled_at = time.time()
+
+
+def default_job_template() -> str:
+    return settings.SLURM_JOB_TEMPLATE or os.path.join(settings.scripts_dir, "job.slurm")
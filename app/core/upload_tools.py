@@ -0,0 +1,65 @@
+import os
+import hashlib
+import aiofiles
+from fastapi import UploadFile
+
+# settings
+from app.core.config import settings
+
+# logging
+from app.core.logging_config import get_logger
+logger = get_logger(__name__)
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the size limit of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+async def save_upload_file(
+    upload: UploadFile,
+    path: str,
+    chunk_size: int | None = None,
+    max_bytes: int | None = None,
+    hash_algorithm: str | None = None,
+) -> dict:
+    """
+    Stream an uploaded file to `path` in chunks without blocking the event loop.
+
+    - `chunk_size`: bytes per read/write (default settings.UPLOAD_CHUNK_SIZE).
+    - `max_bytes`: size limit, 0 for none (default settings.UPLOAD_MAX_BYTES).
+      The partial file is removed and UploadTooLargeError raised when exceeded.
+    - `hash_algorithm`: optional hashlib name (e.g. "sha256") computed incrementally.
+
+    Returns {"path", "size", "hash"}.
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    max_bytes = settings.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    hasher = hashlib.new(hash_algorithm) if hash_algorithm else None
+
+    size = 0
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                if hasher:
+                    hasher.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    logger.debug(f"Saved upload {upload.filename} to {path} ({size} bytes)")
+    return {
+        "path": path,
+        "size": size,
+        "hash": hasher.hexdigest() if hasher else None,
+    }
@@ -36,6 +36,7 @@ async def ping():
 
 
 # routes
+from app.core import job_executor, prediction_slurm, prediction_webhooks
 from app.api.v1 import routes_jobs, routes_models, routes_status, routes_raw_dataset_json, routes_raw_images_and_labels, routes_plan_and_preprocess, routes_predictions
 #app.include_router(routes_raw_dataset_json.router, prefix="/api/v1/raw/datasets", tags=["RawDatasets"])
 app.include_router(routes_raw_dataset_json.router)
@@ -48,9 +49,22 @@ app.include_router(routes_models.router, prefix="/api/v1/models", tags=["Models"
 app.include_router(routes_status.router, prefix="/api/v1/status", tags=["Status"])
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     logger.info("Starting nnUNet Server...")
     logger.info(f"NNUNet raw dir: {routes_raw_dataset_json.nnunet_raw_dir}")
+    if settings.JOB_PROCESSOR == "local":
+        job_executor.get_executor().start()
+    elif settings.JOB_PROCESSOR == "slurm":
+        prediction_slurm.start()
+    prediction_webhooks.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if settings.JOB_PROCESSOR == "local":
+        await job_executor.get_executor().stop()
+    elif settings.JOB_PROCESSOR == "slurm":
+        prediction_slurm.stop()
+    prediction_webhooks.stop()
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -26,19 +26,29 @@ conda activate $VENV_NAME
 
 # --- 3. Execute nnUNet Command ---
 # $1: input_dir, $2: output_dir, $3: dataset_id, $4: configuration
+# $5: trainer, $6: plans, $7: folds ("0 1 2 3 4"), $8: tile step size, $9: mirroring (1/0)
 INPUT_DIR="$1"
 OUTPUT_DIR="$2"
 DATASET_ID="$3"
 CONFIGURATION="$4"
 TRAINER="${5:-nnUNetTrainer}"
 PLANS="${6:-nnUNetPlans}"
-# Add other arguments as necessary (trainer, plans, device)
+FOLDS="${7:-0 1 2 3 4}"
+STEP_SIZE="${8:-0.5}"
+MIRRORING="${9:-1}"
+
+TTA_ARGS=()
+if [ "$MIRRORING" = "0" ]; then
+    TTA_ARGS+=(--disable_tta)
+fi
 
 echo "Starting nnUNetv2_predict for Dataset $DATASET_ID, Config $CONFIGURATION"
 echo "Input: $INPUT_DIR"
 echo "Output: $OUTPUT_DIR"
+echo "Folds: $FOLDS, step size: $STEP_SIZE, mirroring: $MIRRORING"
 
 # Execute the nnUNet command. Since the VENV is active, 'nnUNetv2_predict' is found in PATH.
+# The progress bar is kept: the worker parses its sliding-window steps from the output.
 nnUNetv2_predict \
     -i "$INPUT_DIR" \
     -o "$OUTPUT_DIR" \
@@ -46,9 +56,10 @@ nnUNetv2_predict \
     -c "$CONFIGURATION" \
     -tr "$TRAINER" \
     -p "$PLANS" \
-    -f 0 1 2 3 4 \
-    -device cuda \
-    --disable_progress_bar
+    -f $FOLDS \
+    -step_size "$STEP_SIZE" \
+    "${TTA_ARGS[@]}" \
+    -device cuda
 
 # Check the exit status of the nnUNet command
 NNUNET_STATUS=$?
@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Worker pools of the staged prediction pipeline (PREDICT_MODE=pipeline, see
+# app/core/nnunet_pipeline.py):
+#   - one GPU worker on nnunet_infer; SimpleWorker keeps the predictor warm
+#   - N CPU workers on the export and preprocess queues (export first, so
+#     finished inferences drain before new ones are prepared) and on the
+#     priority lanes, whose slot jobs only start pipelines in this mode
+# Usage: ./start_pipeline_workers.sh [num_cpu_workers]
+
+NUM_CPU_WORKERS="${1:-4}"
+REDIS_URL="${REDIS_URL:-redis://localhost:6379/0}"
+
+export PREDICT_MODE=pipeline
+
+rq worker -w rq.worker.SimpleWorker --url "$REDIS_URL" nnunet_infer &
+
+for i in $(seq 1 "$NUM_CPU_WORKERS"); do
+    rq worker --url "$REDIS_URL" nnunet_export nnunet_preprocess nnunet_jobs_interactive nnunet_jobs nnunet_jobs_bulk &
+done
+
+wait
@@ -0,0 +1,15 @@
+#!/bin/bash
+
+# Long-lived prediction worker.
+# SimpleWorker runs jobs in the worker process itself (no fork per job), so the
+# nnUNetPredictor cache survives across jobs when PREDICT_MODE=in_process.
+# Queues are listed in priority order: interactive, normal, bulk (see
+# app/core/prediction_scheduler.py). Workers dedicated to one lane can be
+# started by passing its queue only.
+# Usage: ./start_predict_worker.sh [queue ...]
+
+QUEUES="${@:-nnunet_jobs_interactive nnunet_jobs nnunet_jobs_bulk}"
+
+export PREDICT_MODE="${PREDICT_MODE:-in_process}"
+
+rq worker -w rq.worker.SimpleWorker --url "${REDIS_URL:-redis://localhost:6379/0}" $QUEUES
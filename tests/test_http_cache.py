@@ -0,0 +1,147 @@
+"""
+Conditional GETs: ETags of files by size and mtime, If-None-Match matching,
+and the 304 answers of the raw file download and of GET /prediction. Also
+the Accept / Accept-Encoding negotiation with q-values.
+
+    python -m pytest -q tests/test_http_cache.py
+"""
+
+import os
+import json
+import time
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_http_cache_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from app.core import http_cache, nnunet_raw
+from app.api.v1 import routes_predictions, routes_raw_images_and_labels
+
+DATASET_ID = "Dataset001_Test"
+FILE_ENDING = ".mha"
+
+
+def request_with(**headers) -> Request:
+    return Request({"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]})
+
+
+def touch(path: str, content: str, mtime_ns: int | None = None):
+    with open(path, "w") as f:
+        f.write(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_file_etag_follows_size_and_mtime():
+    path = os.path.join(tempfile.mkdtemp(dir=DATA_DIR), "file.txt")
+    missing = http_cache.file_etag([path])
+    touch(path, "abc", mtime_ns=1_000_000_000)
+    etag = http_cache.file_etag([path])
+    assert etag != missing and etag == http_cache.file_etag([path])
+
+    touch(path, "abd", mtime_ns=1_000_000_000)  # same size and mtime: not read, same ETag
+    assert http_cache.file_etag([path]) == etag
+    touch(path, "abd", mtime_ns=2_000_000_000)
+    assert http_cache.file_etag([path]) != etag
+    assert http_cache.file_etag([path], "extra") != http_cache.file_etag([path])
+
+
+def test_if_none_match():
+    etag = http_cache.make_etag("a")
+    assert http_cache.is_not_modified(request_with(if_none_match=etag), etag)
+    assert http_cache.is_not_modified(request_with(if_none_match=f'"other", W/{etag}'), etag)
+    assert http_cache.is_not_modified(request_with(if_none_match="*"), etag)
+    assert not http_cache.is_not_modified(request_with(if_none_match='"other"'), etag)
+    assert not http_cache.is_not_modified(request_with(), etag)
+    assert not http_cache.is_not_modified(None, etag)
+
+
+def test_accept_negotiation():
+    offered = ["application/json", "application/x-npz"]
+    for accept, expected in (
+        (None, "application/json"),
+        ("application/x-npz", "application/x-npz"),
+        ("application/x-npz;q=0", "application/json"),
+        ("application/x-npz;q=0, */*", "application/json"),
+        ("application/json;q=0.5, application/x-npz", "application/x-npz"),
+        ("application/x-npz;q=0.2, application/json", "application/json"),
+        ("application/x-npz, */*;q=0.1", "application/x-npz"),
+        ("*/*", "application/json"),
+        ("APPLICATION/X-NPZ; Q=0.9", "application/x-npz"),
+        ("text/html", "application/json"),
+    ):
+        headers = {} if accept is None else {"accept": accept}
+        assert http_cache.preferred_media_type(request_with(**headers), offered) == expected, accept
+
+    assert http_cache.accepts_gzip(request_with(accept_encoding="gzip, deflate"))
+    assert http_cache.accepts_gzip(request_with(accept_encoding="br;q=1.0, *;q=0.5"))
+    assert not http_cache.accepts_gzip(request_with(accept_encoding="gzip;q=0, deflate"))
+    assert not http_cache.accepts_gzip(request_with())
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A client of the raw dataset and prediction routes on a fresh data folder with one dataset."""
+    data_dir = tempfile.mkdtemp(dir=DATA_DIR)
+    raw_dir = os.path.join(data_dir, "raw")
+    predictions_dir = os.path.join(data_dir, "predictions")
+    os.makedirs(os.path.join(raw_dir, DATASET_ID, "imagesTr"))
+    os.makedirs(predictions_dir)
+    with open(os.path.join(raw_dir, DATASET_ID, "dataset.json"), "w") as f:
+        json.dump({"file_ending": FILE_ENDING, "labels": {"background": 0, "organ": 1}}, f)
+
+    monkeypatch.setattr(nnunet_raw, "nnunet_raw_dir", raw_dir)
+    monkeypatch.setattr(routes_raw_images_and_labels, "nnunet_raw_dir", raw_dir)
+    monkeypatch.setattr(routes_predictions, "nnunet_predictions_dir", predictions_dir)
+
+    app = FastAPI()
+    app.include_router(routes_raw_images_and_labels.router)
+    app.include_router(routes_predictions.router)
+    client = TestClient(app)
+    client.data_dir = data_dir
+    return client
+
+
+def get_revalidated(client: TestClient, url: str, params: dict):
+    """GET, then GET again with the ETag of the first answer. Returns both responses."""
+    first = client.get(url, params=params)
+    assert first.status_code == 200 and first.headers["cache-control"] == "no-cache"
+    return first, client.get(url, params=params, headers={"If-None-Match": first.headers["etag"]})
+
+
+def test_raw_file_download_is_revalidated(client):
+    image_path = os.path.join(client.data_dir, "raw", DATASET_ID, "imagesTr", f"case_001_0000{FILE_ENDING}")
+    touch(image_path, "image")
+    params = {"dataset_id": DATASET_ID, "images_for": "train", "type": "image", "num": 1}
+
+    first, second = get_revalidated(client, "/dataset/download_file", params)
+    assert first.content == b"image"
+    assert second.status_code == 304 and second.content == b"" and second.headers["etag"] == first.headers["etag"]
+
+    touch(image_path, "replaced image", mtime_ns=time.time_ns() + 1_000_000_000)
+    third = client.get("/dataset/download_file", params=params, headers={"If-None-Match": first.headers["etag"]})
+    assert third.status_code == 200 and third.content == b"replaced image"
+
+
+def test_finished_prediction_is_revalidated(client):
+    req_dir = os.path.join(client.data_dir, "predictions", DATASET_ID, "req_000")
+    os.makedirs(os.path.join(req_dir, "outputs"))
+    touch(os.path.join(req_dir, "req.json"), json.dumps({"req_id": "req_000", "requester_id": "tester"}))
+    touch(os.path.join(req_dir, f"image_0_0000{FILE_ENDING}"), "image")
+    touch(os.path.join(req_dir, "state.json"), json.dumps({"status": "failed"}))
+    params = {"dataset_id": DATASET_ID, "req_id": "req_000"}
+
+    first, second = get_revalidated(client, "/prediction", params)
+    assert first.json()["completed"] is False and first.json()["queue"] is None
+    assert second.status_code == 304 and second.headers["etag"] == first.headers["etag"]
+
+    # a new state (e.g. a retry) changes the ETag
+    touch(os.path.join(req_dir, "state.json"), json.dumps({"status": "queued"}))
+    third = client.get("/prediction", params=params, headers={"If-None-Match": first.headers["etag"]})
+    assert third.status_code == 200 and third.headers["etag"] != first.headers["etag"]
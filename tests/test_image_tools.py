@@ -0,0 +1,195 @@
+"""
+Contour extraction of app/core/image_tools.py against the previous per-slice,
+per-point code on small synthetic volumes: the one-pass multi-label
+extraction, the flat point arrays and their .npz format, and the resampling
+of only the labels' bounding box onto a rotated base image grid.
+
+image_tools imports image_coord, rect and dict_helper from base_code/, as
+the server's PYTHONPATH does:
+
+    python -m pytest -q tests/test_image_tools.py
+"""
+
+import os
+import io
+import sys
+import json
+import tempfile
+
+BASE_CODE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "base_code")
+if BASE_CODE_DIR not in sys.path:
+    sys.path.append(BASE_CODE_DIR)
+
+import cv2
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from app.core import image_tools
+
+ROTATION_DEG = 20.0
+
+
+def label_volume() -> sitk.Image:
+    """(x, y, z) = (40, 32, 12) label image: label 1 is a ring (a hole) on slices 2-5, label 2 two blobs on 4-8."""
+    label_np = np.zeros((12, 32, 40), dtype=np.uint8)
+    label_np[2:6, 5:20, 4:22] = 1
+    label_np[2:6, 9:15, 9:16] = 0
+    label_np[4:9, 22:28, 25:33] = 2
+    label_np[6:8, 8:12, 30:36] = 2
+    image = sitk.GetImageFromArray(label_np)
+    image.SetSpacing((0.8, 0.9, 2.5))
+    image.SetOrigin((-12.0, 4.0, 30.0))
+    return image
+
+
+def base_grid(image: sitk.Image) -> sitk.Image:
+    """A finer grid, rotated about z, covering the label image."""
+    angle = np.deg2rad(ROTATION_DEG)
+    direction = (np.cos(angle), -np.sin(angle), 0.0, np.sin(angle), np.cos(angle), 0.0, 0.0, 0.0, 1.0)
+    base = sitk.Image((64, 64, 16), sitk.sitkInt16)
+    base.SetSpacing((0.6, 0.6, 2.0))
+    base.SetDirection(direction)
+    base.SetOrigin((-10.0, -4.0, 28.0))
+    return base
+
+
+def reference_contours(binary_image: sitk.Image, H=None) -> list:
+    """
+    The previous binary_image_to_contour (index points, H=None) and
+    transform_contour_list: every slice, one 4-vector matmul per point.
+    """
+    mask_np = sitk.GetArrayFromImage(binary_image)
+    contour_list = []
+    for z in range(mask_np.shape[0]):
+        slice_2d = (mask_np[z] != 0).astype(np.uint8) * 255
+        if not slice_2d.any():
+            continue
+        contours, hierarchy = cv2.findContours(slice_2d, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        traced = []
+        image_tools.trace_contour(0, contours, hierarchy[0], False, traced)
+        if H is not None:
+            traced = [{"points": [[float(v) for v in (H @ np.array([x, y, z, 1.0]))[:3]] for x, y in contour["points"]],
+                       "hole": contour["hole"]} for contour in traced]
+        contour_list.append({"slice": z, "contours": traced})
+    return contour_list
+
+
+def assert_same_contours(actual: list, expected: list):
+    assert [item["slice"] for item in actual] == [item["slice"] for item in expected]
+    for actual_z, expected_z in zip(actual, expected):
+        assert [c["hole"] for c in actual_z["contours"]] == [c["hole"] for c in expected_z["contours"]]
+        for actual_c, expected_c in zip(actual_z["contours"], expected_z["contours"]):
+            np.testing.assert_allclose(actual_c["points"], expected_c["points"], rtol=0, atol=1e-9)
+
+
+def test_one_pass_contours_match_the_per_label_path():
+    image = label_volume()
+    img_coord = image_tools.get_image_coord_from_itkImage(image)
+    contours = image_tools.label_image_to_contours(image, [1, 2])
+
+    assert contours[1]["holes"].any()  # the ring
+    for v in (1, 2):
+        binary = sitk.BinaryThreshold(image, v, v, 1, 0)
+        assert_same_contours(image_tools.contour_arrays_to_list(contours[v]), reference_contours(binary))
+        for H in (img_coord.o_H_I(), img_coord.w_H_I()):
+            points = image_tools.transform_contour_points(contours[v], H)
+            assert_same_contours(image_tools.contour_arrays_to_list(contours[v], points), reference_contours(binary, H))
+
+
+def test_transform_contour_list_keeps_its_output():
+    image = label_volume()
+    w_H_I = image_tools.get_image_coord_from_itkImage(image).w_H_I()
+    binary = sitk.BinaryThreshold(image, 1, 1, 1, 0)
+    contour_list_I = image_tools.binary_image_to_contour(binary)
+
+    assert_same_contours(contour_list_I, reference_contours(binary))
+    assert_same_contours(image_tools.transform_contour_list(contour_list_I, w_H_I), reference_contours(binary, w_H_I))
+
+
+def test_empty_labels_have_no_contours():
+    contours = image_tools.label_image_to_contours(label_volume(), [3])
+    assert len(contours[3]["points"]) == 0 and image_tools.contour_arrays_to_list(contours[3]) == []
+
+
+@pytest.fixture
+def out_dir():
+    return tempfile.mkdtemp(prefix="nnunet_image_tools_test_")
+
+
+def write_label_image(out_dir: str) -> str:
+    path = os.path.join(out_dir, "image_0.mha")
+    sitk.WriteImage(label_volume(), path)
+    return path
+
+
+def test_npz_round_trips_the_json_files(out_dir):
+    files = image_tools.label_image_to_contour_list_json_files(write_label_image(out_dir), [1, 2], out_dir=out_dir)
+
+    for v in (1, 2):
+        points_I_json, points_o_json, points_w_json, contours_npz = [os.path.join(out_dir, f) for f in files[v]]
+        with np.load(contours_npz) as data:
+            arrays = {"points": data["points_I"], "offsets": data["offsets"],
+                      "slices": data["slices"], "holes": data["holes"].astype(bool)}
+            assert data["points_I"].dtype == np.int16 and data["points_w"].dtype == np.float32
+            for key, json_file, atol in (("points_I", points_I_json, 0), ("points_o", points_o_json, 1e-4),
+                                         ("points_w", points_w_json, 1e-4)):
+                with open(json_file) as f:
+                    expected = json.load(f)
+                points = None if key == "points_I" else data[key].astype(np.float64)
+                actual = image_tools.contour_arrays_to_list(arrays, points)
+                assert [item["slice"] for item in actual] == [item["slice"] for item in expected]
+                for actual_z, expected_z in zip(actual, expected):
+                    for actual_c, expected_c in zip(actual_z["contours"], expected_z["contours"]):
+                        assert actual_c["hole"] == expected_c["hole"]
+                        np.testing.assert_allclose(actual_c["points"], expected_c["points"], rtol=0, atol=atol)
+
+
+def test_npz_bytes_keep_only_the_requested_points(out_dir):
+    files = image_tools.label_image_to_contour_list_json_files(write_label_image(out_dir), [1], out_dir=out_dir)
+    contours_npz = os.path.join(out_dir, files[1][3])
+
+    with open(contours_npz, "rb") as f:
+        assert image_tools.read_contour_npz_bytes(contours_npz, ["points_I", "points_o", "points_w"]) == f.read()
+
+    with np.load(io.BytesIO(image_tools.read_contour_npz_bytes(contours_npz, ["points_w"]))) as reduced, \
+            np.load(contours_npz) as full:
+        assert sorted(reduced.files) == ["holes", "offsets", "points_w", "slices"]
+        for key in reduced.files:
+            np.testing.assert_array_equal(reduced[key], full[key])
+
+
+def test_roi_resample_matches_the_full_resample():
+    image = label_volume()
+    base = base_grid(image)
+    full_np = sitk.GetArrayFromImage(image_tools.resample_binary_image_at_image_grid(image, base))
+    assert np.unique(full_np).tolist() == [0, 1, 2]
+
+    roi_image, (x0, y0, z0) = image_tools.resample_roi_at_image_grid(image, base)
+    roi_np = sitk.GetArrayFromImage(roi_image)
+    z1, y1, x1 = np.array([z0, y0, x0]) + roi_np.shape
+
+    np.testing.assert_array_equal(roi_np, full_np[z0:z1, y0:y1, x0:x1])
+    outside = full_np.copy()
+    outside[z0:z1, y0:y1, x0:x1] = 0
+    assert not outside.any()
+
+    # only some of the labels: the box of those
+    roi_image, _ = image_tools.resample_roi_at_image_grid(image, base, label_values=[2])
+    assert roi_image.GetNumberOfPixels() < roi_np.size
+
+
+def test_contours_on_a_base_grid_match_the_full_resample(out_dir):
+    base_image_path = os.path.join(out_dir, "base.mha")
+    base = base_grid(label_volume())
+    sitk.WriteImage(base, base_image_path)
+    files = image_tools.label_image_to_contour_list_json_files(
+        write_label_image(out_dir), [1, 2], out_dir=out_dir, base_image_path=base_image_path)
+
+    resampled = image_tools.resample_binary_image_at_image_grid(label_volume(), base)
+    w_H_I = image_tools.get_image_coord_from_itkImage(base).w_H_I()
+    for v in (1, 2):
+        with open(os.path.join(out_dir, files[v][2])) as f:
+            contour_list_w = json.load(f)
+        assert contour_list_w
+        assert_same_contours(contour_list_w, reference_contours(sitk.BinaryThreshold(resampled, v, v, 1, 0), w_H_I))
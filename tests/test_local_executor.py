@@ -0,0 +1,103 @@
+"""
+Local job executor: JSON job records, jobs run in a spawn-context process
+pool, dispatch order (priority, then fair share between groups), cancelling
+queued jobs and recovering from a restart.
+
+    python -m pytest -q tests/test_local_executor.py
+"""
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_local_executor_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+
+from app.core import job_executor
+from app.core.config import settings
+
+JOB_WAIT_SEC = 60.0
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(settings, "LOCAL_EXECUTOR_POLL_SEC", 0.1)
+    return job_executor.LocalExecutor(tempfile.mkdtemp(dir=DATA_DIR), max_workers=1)
+
+
+def pending_ids(executor) -> list[str]:
+    return os.listdir(os.path.join(executor.jobs_dir, "pending"))
+
+
+async def wait_for(executor, job_id: str, statuses=("finished", "failed")) -> dict:
+    deadline = time.time() + JOB_WAIT_SEC
+    while time.time() < deadline:
+        job = executor.fetch(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"job {job_id} is still {executor.fetch(job_id)['status']}")
+
+
+def test_jobs_run_in_spawned_processes(executor):
+    async def run():
+        executor.start()
+        try:
+            assert executor._pool._mp_context.get_start_method() == "spawn"
+            ok = executor.enqueue(os.getpid, queue="nnunet_jobs")
+            bad = executor.enqueue(os.getcwd, "unexpected argument", queue="nnunet_jobs")
+            return await wait_for(executor, ok), await wait_for(executor, bad)
+        finally:
+            await executor.stop()
+
+    ok, bad = asyncio.run(run())
+    assert ok["status"] == "finished" and ok["result"] != os.getpid()
+    assert bad["status"] == "failed" and "TypeError" in executor.record(bad["id"])["exc_info"]
+    assert pending_ids(executor) == []
+
+    with open(os.path.join(executor.jobs_dir, "jobs", f"{ok['id']}.json")) as f:
+        record = json.load(f)
+    assert record["func"] == job_executor.func_path(os.getpid) and record["queue"] == "nnunet_jobs"
+    assert record["started_at"] <= record["ended_at"]
+
+
+def test_cancel_only_queued_jobs(executor):
+    job_id = executor.enqueue(os.getpid)
+    assert executor.fetch(job_id)["status"] == "queued" and pending_ids(executor) == [job_id]
+
+    assert executor.cancel(job_id)
+    assert executor.fetch(job_id)["status"] == "canceled" and pending_ids(executor) == []
+    assert not executor.cancel(job_id)
+    assert executor.fetch("no-such-job") is None and not executor.cancel("no-such-job")
+
+
+def test_dispatch_order(executor):
+    a = [executor.enqueue(os.getpid, group="a") for _ in range(3)]
+    b = executor.enqueue(os.getpid, group="b")
+    urgent = executor.enqueue(os.getpid, group="a", at_front=True)
+    canceled = executor.enqueue(os.getpid, group="b")
+    executor.cancel(canceled)
+
+    executor._load_pending()
+    order = []
+    while (record := executor._pick()) is not None:
+        order.append(record["id"])
+    # at_front first; then "b", which had no turn yet, ahead of the older jobs of "a"
+    assert order == [urgent, b, a[0], a[1], a[2]]
+
+
+def test_jobs_interrupted_by_a_restart_are_failed(executor):
+    job_id = executor.enqueue(os.getpid)
+    executor._update_record(job_id, status="started")
+    queued = executor.enqueue(os.getpid)
+
+    restarted = job_executor.LocalExecutor(executor.jobs_dir, max_workers=1)
+    restarted._recover()
+    assert restarted.fetch(job_id)["status"] == "failed"
+    assert restarted.record(job_id)["exc_info"] == "interrupted by a restart"
+    assert [record["id"] for record in restarted.pending()] == [queued]
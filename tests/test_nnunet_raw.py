@@ -0,0 +1,59 @@
+"""
+The dataset.json cache of app/core/nnunet_raw.py: entries are keyed by path,
+revalidated by the file's stat and bounded in number.
+
+    python -m pytest -q tests/test_nnunet_raw.py
+"""
+
+import os
+import json
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_raw_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+
+from app.core import nnunet_raw
+
+
+def write_json(path: str, data: dict, mtime_ns: int):
+    with open(path, "w") as f:
+        json.dump(data, f)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_outputs_dataset_json_is_parsed_once_per_version(monkeypatch):
+    json_file = os.path.join(tempfile.mkdtemp(dir=DATA_DIR), "dataset.json")
+    write_json(json_file, {"labels": {"background": 0, "organ": 1}}, mtime_ns=1_000_000_000)
+
+    parsed = []
+    real_load = json.load
+    monkeypatch.setattr(nnunet_raw.json, "load", lambda f: parsed.append(f.name) or real_load(f))
+
+    first = nnunet_raw.load_dataset_json_file(json_file)
+    first["labels"]["changed"] = 2  # callers get copies
+    assert nnunet_raw.load_dataset_json_file(json_file) == {"labels": {"background": 0, "organ": 1}}
+    assert parsed == [json_file]
+
+    write_json(json_file, {"labels": {"background": 0, "organ": 2}}, mtime_ns=2_000_000_000)
+    assert nnunet_raw.load_dataset_json_file(json_file)["labels"]["organ"] == 2
+    assert parsed == [json_file, json_file]
+
+    os.remove(json_file)
+    with pytest.raises(FileNotFoundError):
+        nnunet_raw.load_dataset_json_file(json_file)
+    assert json_file not in nnunet_raw._dataset_json_cache
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(nnunet_raw, "DATASET_JSON_CACHE_MAX_ENTRIES", 3)
+    monkeypatch.setattr(nnunet_raw, "_dataset_json_cache", {})
+    folder = tempfile.mkdtemp(dir=DATA_DIR)
+    json_files = [os.path.join(folder, f"{i}.json") for i in range(5)]
+    for i, json_file in enumerate(json_files):
+        write_json(json_file, {"i": i}, mtime_ns=1_000_000_000)
+        nnunet_raw.load_dataset_json_file(json_file)
+
+    assert list(nnunet_raw._dataset_json_cache) == json_files[2:]
@@ -0,0 +1,145 @@
+"""
+Queued totals of the prediction index: finished requests must not count as
+load for admission control, the stats and the queue ETAs.
+
+Runs without Redis or SLURM (local job executor, temporary data folder):
+
+    python -m pytest -q tests/test_prediction_index.py
+"""
+
+import os
+import json
+import tempfile
+from datetime import datetime
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_index_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+
+from app.core.config import settings
+
+settings.DATABASE_URL = f"sqlite:///{os.path.join(DATA_DIR, 'index.sqlite')}"
+settings.JOB_PROCESSOR = "local"
+settings.LOCAL_EXECUTOR_DIR = os.path.join(DATA_DIR, "local_jobs")
+
+from app.core import prediction_admission, prediction_index, prediction_stats
+
+FILE_ENDING = ".mha"
+
+
+@pytest.fixture
+def dataset(monkeypatch):
+    """A fresh dataset id and its predictions folder; scheduler counts are not cached."""
+    monkeypatch.setattr(prediction_admission, "SCHEDULED_TTL_SEC", 0.0)
+    dataset_id = f"Dataset{len(os.listdir(DATA_DIR)):03d}_Test"
+    dataset_path = os.path.join(DATA_DIR, dataset_id)
+    os.makedirs(dataset_path)
+    yield dataset_id, dataset_path
+    connection = prediction_index.connect()
+    with connection:
+        connection.execute("DELETE FROM predictions")
+
+
+def make_request(dataset_path: str, req_id: str, status: str | None = None, lane: str = "normal") -> dict:
+    req_dir = os.path.join(dataset_path, req_id)
+    os.makedirs(os.path.join(req_dir, "outputs"))
+    req = {"requester_id": "tester", "image_id_list": ["img"], "req_id": req_id,
+           "at": datetime.now().isoformat(), "priority": lane, "estimated_sec": 10.0}
+    with open(os.path.join(req_dir, "req.json"), "w") as f:
+        json.dump(req, f)
+    open(os.path.join(req_dir, f"image_0_0000{FILE_ENDING}"), "w").close()
+    if status is not None:
+        with open(os.path.join(req_dir, "state.json"), "w") as f:
+            json.dump({"status": status}, f)
+    return req
+
+
+def queued(lane: str = "normal") -> int:
+    return prediction_admission.queued_work()[lane]["requests"]
+
+
+def test_failed_request_drops_out_of_queued_total(dataset):
+    dataset_id, dataset_path = dataset
+    for req_id in ("req_000", "req_001"):
+        req = make_request(dataset_path, req_id)
+        prediction_index.upsert_request(dataset_id, req_id, req, [f"image_0_0000{FILE_ENDING}"])
+    assert queued() == 2
+
+    prediction_index.update_status(dataset_id, "req_000", "failed", completed=False)
+    assert queued() == 1
+
+
+def test_import_from_disk_keeps_failed_and_cancelled(dataset):
+    dataset_id, dataset_path = dataset
+    make_request(dataset_path, "req_000", status="failed")
+    make_request(dataset_path, "req_001", status="cancelled")
+    make_request(dataset_path, "req_002")
+
+    prediction_index.index_dataset_from_disk(dataset_id, dataset_path, FILE_ENDING)
+    statuses = {item["req_id"]: item["status"] for item in prediction_index.list_requests(dataset_id)}
+    assert statuses == {"req_000": "failed", "req_001": "cancelled", "req_002": "queued"}
+    assert queued() == 1
+
+
+def test_reindex_does_not_reset_finished_rows(dataset):
+    dataset_id, dataset_path = dataset
+    req = make_request(dataset_path, "req_000")  # no state.json: the worker only updated the index
+    prediction_index.upsert_request(dataset_id, "req_000", req, [], status="failed")
+
+    prediction_index.index_dataset_from_disk(dataset_id, dataset_path, FILE_ENDING)
+    assert prediction_index.list_requests(dataset_id)[0]["status"] == "failed"
+    assert queued() == 0
+
+
+def test_reconcile_marks_failed_from_disk(dataset):
+    dataset_id, dataset_path = dataset
+    req = make_request(dataset_path, "req_000")
+    prediction_index.upsert_request(dataset_id, "req_000", req, [])
+    assert queued() == 1
+
+    with open(os.path.join(dataset_path, "req_000", "state.json"), "w") as f:
+        json.dump({"status": "failed"}, f)
+    prediction_index.reconcile_in_flight(dataset_id, dataset_path, FILE_ENDING)
+    assert queued() == 0
+
+
+def test_stale_rows_are_bounded_by_the_scheduler(dataset):
+    dataset_id, dataset_path = dataset
+    stale = prediction_admission.running_limit() + 5
+    for i in range(stale):
+        req = make_request(dataset_path, f"req_{i:03d}")
+        prediction_index.upsert_request(dataset_id, req["req_id"], req, [])
+
+    # nothing is queued in the local executor: only what could be running counts
+    assert queued() == prediction_admission.running_limit()
+
+    last = prediction_index.list_requests(dataset_id, sort="submitted_at", order="desc", limit=1)[0]
+    eta = prediction_stats.queue_eta(dataset_id, last["req_id"], last["req_info"], {"status": "queued"})
+    assert eta["position"] == prediction_admission.running_limit() + 1
+
+
+def test_update_req_info_keeps_status(dataset):
+    dataset_id, dataset_path = dataset
+    req = make_request(dataset_path, "req_000")
+    prediction_index.upsert_request(dataset_id, "req_000", req, [])
+    prediction_index.update_status(dataset_id, "req_000", "completed", completed=True)
+
+    prediction_index.update_req_info(dataset_id, "req_000", {**req, "job_id": "job"})
+    item = prediction_index.list_requests(dataset_id)[0]
+    assert item["status"] == "completed" and item["req_info"]["job_id"] == "job"
+
+
+def test_zip_uploads_are_not_in_flight(dataset):
+    dataset_id, dataset_path = dataset
+    req = make_request(dataset_path, "req_000")
+    open(os.path.join(dataset_path, "req_000", prediction_index.ZIP_UPLOAD_FILE_NAME), "w").close()
+    prediction_index.upsert_request(dataset_id, "req_000", req, [], status="uploaded")
+    assert prediction_index.list_in_flight(dataset_id) == [] and queued() == 0
+
+    # rows of older versions ("submitted") are settled by the next reconcile
+    prediction_index.update_status(dataset_id, "req_000", "submitted")
+    prediction_index.reconcile_in_flight(dataset_id, dataset_path, FILE_ENDING)
+    assert prediction_index.list_requests(dataset_id)[0]["status"] == "uploaded"
+    assert prediction_index.list_in_flight(dataset_id) == []
@@ -0,0 +1,83 @@
+"""
+Latency tier resolution against a fake results folder: presets are checked
+against the folds that have a final checkpoint, "all" means those folds, and
+tiers.json overrides are merged into the default presets.
+
+    python -m pytest -q tests/test_prediction_tiers.py
+"""
+
+import os
+import json
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_tiers_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+
+from app.core import prediction_tiers
+from app.core.config import settings
+
+DATASET_NAME = "Dataset001_Test"
+MODEL = "nnUNetTrainer__nnUNetPlans__3d_lowres"
+
+
+@pytest.fixture
+def results_dir(monkeypatch):
+    """A results folder with folds 1 and 2 of the 3d_lowres model trained; fold 3 has no final checkpoint."""
+    results_dir = tempfile.mkdtemp(dir=DATA_DIR)
+    for fold, checkpoint in ((1, "checkpoint_final.pth"), (2, "checkpoint_final.pth"), (3, "checkpoint_best.pth")):
+        fold_dir = os.path.join(results_dir, DATASET_NAME, MODEL, f"fold_{fold}")
+        os.makedirs(fold_dir)
+        open(os.path.join(fold_dir, checkpoint), "w").close()
+    monkeypatch.setattr(prediction_tiers, "nnunet_results_dir", results_dir)
+    monkeypatch.setattr(settings, "PREDICTION_DEFAULT_TIER", "full")
+    return results_dir
+
+
+def write_tiers(results_dir: str, tiers):
+    with open(os.path.join(results_dir, DATASET_NAME, prediction_tiers.TIERS_FILE_NAME), "w") as f:
+        f.write(tiers if isinstance(tiers, str) else json.dumps(tiers))
+
+
+def test_all_folds_means_the_trained_ones(results_dir):
+    full = prediction_tiers.resolve_tier("1", None)  # the default tier, dataset by number
+    assert full["tier"] == "full" and full["folds"] == [1, 2]
+    assert full["use_mirroring"] is True and full["tile_step_size"] == 0.5
+
+    standard = prediction_tiers.resolve_tier(DATASET_NAME, "standard")
+    assert standard["folds"] == [1, 2] and standard["use_mirroring"] is False
+
+
+def test_untrained_folds_and_models_are_rejected(results_dir):
+    # the default preview preset asks for fold 0
+    with pytest.raises(prediction_tiers.TierError, match=r"folds \[0\]"):
+        prediction_tiers.resolve_tier(DATASET_NAME, "preview")
+    with pytest.raises(prediction_tiers.TierError, match="Unknown tier 'fast'"):
+        prediction_tiers.resolve_tier(DATASET_NAME, "fast")
+    with pytest.raises(prediction_tiers.TierError, match="no trained model"):
+        prediction_tiers.resolve_tier("Dataset002_Other", "full")
+
+
+def test_tiers_json_overrides_the_defaults(results_dir):
+    write_tiers(results_dir, {
+        "preview": {"folds": [2]},
+        "fast": {"folds": [1], "use_mirroring": False},
+        "coarse": {"tile_step_size": 1.5},
+    })
+
+    preview = prediction_tiers.resolve_tier(DATASET_NAME, "preview")
+    assert preview["folds"] == [2] and preview["tile_step_size"] == 0.75  # the rest of the default preview preset
+    fast = prediction_tiers.resolve_tier(DATASET_NAME, "fast")
+    assert fast["folds"] == [1] and fast["use_mirroring"] is False and fast["configuration"] == "3d_lowres"
+    with pytest.raises(prediction_tiers.TierError, match="tile_step_size"):
+        prediction_tiers.resolve_tier(DATASET_NAME, "coarse")
+
+    available = {tier["tier"]: tier["available"] for tier in prediction_tiers.list_tiers(DATASET_NAME)}
+    assert available == {"preview": True, "standard": True, "full": True, "fast": True, "coarse": False}
+
+
+def test_unreadable_tiers_json_is_ignored(results_dir):
+    write_tiers(results_dir, "{not json")
+    assert prediction_tiers.load_tiers(DATASET_NAME) == prediction_tiers.DEFAULT_TIERS
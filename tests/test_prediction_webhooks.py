@@ -0,0 +1,143 @@
+"""
+Webhook outbox delivery against a local HTTP stand-in: coalescing per URL,
+backoff of failed deliveries, giving up, and the callback host allowlist.
+
+    python -m pytest -q tests/test_prediction_webhooks.py
+"""
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_webhook_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+
+from app.core import prediction_webhooks
+from app.core.config import settings
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Records the posted bodies; answers 500 to the posts numbered in `fail`."""
+
+    bodies = []
+    fail = set()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        number = len(StandIn.bodies)
+        StandIn.bodies.append(body)
+        self.send_response(500 if number in StandIn.fail else 200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def callback_url(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StandIn.bodies, StandIn.fail = [], set()
+
+    outbox = tempfile.mkdtemp(dir=DATA_DIR)
+    monkeypatch.setattr(settings, "WEBHOOK_DIR", outbox)
+    monkeypatch.setattr(settings, "WEBHOOK_ALLOWED_HOSTS", ["127.0.0.1"])
+    monkeypatch.setattr(settings, "WEBHOOK_MAX_BATCH", 2)
+    monkeypatch.setattr(settings, "WEBHOOK_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "WEBHOOK_BACKOFF_SEC", 0.05)
+    monkeypatch.setattr(settings, "WEBHOOK_BACKOFF_MAX_SEC", 0.2)
+    yield f"http://127.0.0.1:{server.server_address[1]}/hook"
+    server.shutdown()
+
+
+def notify(url: str, count: int):
+    for i in range(count):
+        job_metadata = {"job_id": f"job_{i}", "input_dir": os.path.join(DATA_DIR, "Dataset001_Test", f"req_{i:03d}")}
+        prediction_webhooks.notify(job_metadata, "completed", req_info={"callback_url": url, "requester_id": "tester"})
+
+
+def pending() -> list[dict]:
+    return [record for _, record in prediction_webhooks._pending()]
+
+
+def failed() -> list[str]:
+    failed_dir = os.path.join(prediction_webhooks.outbox_dir(), prediction_webhooks.FAILED_DIR_NAME)
+    return os.listdir(failed_dir) if os.path.isdir(failed_dir) else []
+
+
+def dispatch_when_due():
+    """Wait out the backoff of the pending records, then dispatch once."""
+    due = max((record["next_attempt_at"] for record in pending()), default=0.0)
+    time.sleep(max(due - time.time(), 0.0) + 0.01)
+    asyncio.run(prediction_webhooks.dispatch())
+
+
+def test_events_of_one_url_are_coalesced(callback_url):
+    notify(callback_url, 5)
+    asyncio.run(prediction_webhooks.dispatch())
+
+    assert [len(body["events"]) for body in StandIn.bodies] == [2, 2, 1]
+    delivered = [event["req_id"] for body in StandIn.bodies for event in body["events"]]
+    assert delivered == [f"req_{i:03d}" for i in range(5)]
+    assert pending() == []
+
+
+def test_failed_chunk_backs_off_without_charging_the_rest(callback_url):
+    notify(callback_url, 4)
+    StandIn.fail = {1}  # the second chunk
+    asyncio.run(prediction_webhooks.dispatch())
+
+    records = {record["event"]["req_id"]: record for record in pending()}
+    assert sorted(records) == ["req_002", "req_003"]
+    assert records["req_002"]["attempts"] == 1
+    assert records["req_003"]["attempts"] == 1  # same chunk
+    assert min(record["next_attempt_at"] for record in records.values()) > time.time()
+
+    # not due yet: nothing is posted
+    asyncio.run(prediction_webhooks.dispatch())
+    assert len(StandIn.bodies) == 2
+
+    dispatch_when_due()
+    assert len(StandIn.bodies) == 3 and pending() == []
+
+
+def test_records_behind_a_failed_chunk_keep_their_attempts(callback_url):
+    notify(callback_url, 5)
+    StandIn.fail = {0}
+    asyncio.run(prediction_webhooks.dispatch())
+
+    attempts = {record["event"]["req_id"]: record["attempts"] for record in pending()}
+    assert attempts == {"req_000": 1, "req_001": 1, "req_002": 0, "req_003": 0, "req_004": 0}
+    assert len(StandIn.bodies) == 1
+
+
+def test_gives_up_after_max_attempts(callback_url):
+    notify(callback_url, 3)
+    StandIn.fail = set(range(100))
+    for _ in range(settings.WEBHOOK_MAX_ATTEMPTS):
+        dispatch_when_due()
+
+    # only the first chunk was ever posted; it is given up, the record behind it is still pending
+    assert len(StandIn.bodies) == settings.WEBHOOK_MAX_ATTEMPTS
+    assert len(failed()) == 2
+    assert [(record["event"]["req_id"], record["attempts"]) for record in pending()] == [("req_002", 0)]
+
+
+def test_callback_hosts_must_be_allowed(callback_url, monkeypatch):
+    prediction_webhooks.validate_callback_url(callback_url)
+    for url in ("http://169.254.169.254/latest/meta-data", "ftp://127.0.0.1/hook", "http:///hook"):
+        with pytest.raises(ValueError):
+            prediction_webhooks.validate_callback_url(url)
+
+    # records queued before the host was removed from the allowlist are not delivered
+    notify(callback_url, 1)
+    monkeypatch.setattr(settings, "WEBHOOK_ALLOWED_HOSTS", ["*.example.org"])
+    asyncio.run(prediction_webhooks.dispatch())
+    assert StandIn.bodies == [] and pending() == [] and len(failed()) == 1
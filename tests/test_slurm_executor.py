@@ -0,0 +1,198 @@
+"""
+SLURM backend against fake sbatch/squeue/sacct scripts on PATH: submission,
+job status mapping, the squeue/sacct status cache and the batching of parked
+prediction requests into one allocation per model.
+
+    python -m pytest -q tests/test_slurm_executor.py
+
+The fakes log every call to calls.log. sbatch prints increasing job ids;
+squeue and sacct print the "<id>|<state>" lines of squeue.txt / sacct.txt.
+"""
+
+import os
+import json
+import time
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="nnunet_slurm_test_")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("NNUNET_DATA_DIR", DATA_DIR)
+
+import pytest
+
+from app.core import job_executor, prediction_batcher, prediction_slurm, slurm_tools
+from app.core.config import settings
+
+FAKE_SBATCH = """#!/bin/sh
+echo "sbatch $*" >> "$FAKE_SLURM_DIR/calls.log"
+n=$(( $(cat "$FAKE_SLURM_DIR/next_id" 2>/dev/null || echo 1000) + 1 ))
+echo $n > "$FAKE_SLURM_DIR/next_id"
+echo "$n;cluster"
+"""
+
+FAKE_QUERY = """#!/bin/sh
+echo "{name} $*" >> "$FAKE_SLURM_DIR/calls.log"
+cat "$FAKE_SLURM_DIR/{name}.txt" 2>/dev/null
+exit 0
+"""
+
+TEMPLATE = "#!/bin/bash\n#SBATCH --job-name={job_name}\n#SBATCH --output={log_file}\ncd {app_dir}\n{cmd_lines}\n"
+
+
+@pytest.fixture
+def fake_slurm(monkeypatch):
+    """A fresh SLURM jobs dir and fake SLURM commands; returns the fakes' folder."""
+    root = tempfile.mkdtemp(dir=DATA_DIR)
+    bin_dir = os.path.join(root, "bin")
+    os.makedirs(bin_dir)
+    scripts = {"sbatch": FAKE_SBATCH, "squeue": FAKE_QUERY.format(name="squeue"),
+               "sacct": FAKE_QUERY.format(name="sacct"), "scancel": FAKE_QUERY.format(name="scancel")}
+    for name, script in scripts.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    template = os.path.join(root, "job.slurm")
+    with open(template, "w") as f:
+        f.write(TEMPLATE)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SLURM_DIR", root)
+    monkeypatch.setattr(settings, "JOB_PROCESSOR", "slurm")
+    monkeypatch.setattr(settings, "SLURM_SETUP", "")
+    monkeypatch.setattr(settings, "SLURM_JOBS_DIR", os.path.join(root, "jobs"))
+    monkeypatch.setattr(settings, "SLURM_JOB_TEMPLATE", template)
+    monkeypatch.setattr(settings, "SLURM_POLL_TTL_SEC", 60.0)
+    monkeypatch.setattr(job_executor, "_executor", None)
+    monkeypatch.setattr(prediction_slurm, "_vtime", {})
+    return root
+
+
+def calls(root: str, command: str) -> list[str]:
+    try:
+        with open(os.path.join(root, "calls.log")) as f:
+            return [line.strip() for line in f if line.startswith(command + " ")]
+    except FileNotFoundError:
+        return []
+
+
+def set_states(root: str, command: str, states: dict):
+    with open(os.path.join(root, f"{command}.txt"), "w") as f:
+        f.writelines(f"{job_id}|{state}\n" for job_id, state in states.items())
+
+
+def test_enqueue_submits_the_rendered_script(fake_slurm):
+    executor = job_executor.get_executor()
+    job_id = executor.enqueue(prediction_batcher.run_batch, [], queue="nnunet_jobs", job_timeout="3h")
+
+    record = executor.record(job_id)
+    assert record["slurm_job_id"] == "1001" and record["status"] == "queued"
+    assert record["func"] == job_executor.func_path(prediction_batcher.run_batch)
+
+    [call] = calls(fake_slurm, "sbatch")
+    assert "--parsable" in call and "--time 0-03:00:00" in call
+    script_file = call.split()[-1]
+    with open(script_file) as f:
+        script = f.read()
+    assert "--job-name=nnunet_jobs" in script
+    assert f"python -m app.core.job_executor run {settings.SLURM_JOBS_DIR} {job_id}" in script
+
+
+def test_status_follows_squeue_then_sacct(fake_slurm):
+    executor = job_executor.get_executor()
+    job_id = executor.enqueue(prediction_batcher.run_batch, [], queue="nnunet_jobs")
+    executor._states.ttl_sec = 0.0
+
+    set_states(fake_slurm, "squeue", {"1001": "PENDING"})
+    assert executor.fetch(job_id)["status"] == "queued"
+    set_states(fake_slurm, "squeue", {"1001": "RUNNING"})
+    assert executor.fetch(job_id)["status"] == "started"
+
+    # gone from squeue: sacct tells it was cancelled, which is recorded
+    set_states(fake_slurm, "squeue", {})
+    set_states(fake_slurm, "sacct", {"1001": "CANCELLED by 1000"})
+    assert executor.fetch(job_id)["status"] == "canceled"
+    assert executor.record(job_id)["status"] == "canceled"
+
+    # a final status recorded by the job itself needs no SLURM call
+    queries = len(calls(fake_slurm, "squeue"))
+    executor._update_record(job_id, status="finished")
+    assert executor.fetch(job_id)["status"] == "finished"
+    assert len(calls(fake_slurm, "squeue")) == queries
+
+
+def test_state_mapping():
+    assert slurm_tools.job_status("COMPLETING") == "started"
+    assert slurm_tools.job_status("COMPLETED") == "finished"
+    assert slurm_tools.job_status("CANCELLED+") == "canceled"
+    assert slurm_tools.job_status("TIMEOUT") == "failed"
+    assert slurm_tools.job_status("NODE_FAIL") == "failed"
+
+
+def test_status_cache_polls_once_per_ttl(fake_slurm):
+    cache = slurm_tools.StatusCache(ttl_sec=0.3)
+    set_states(fake_slurm, "squeue", {"1": "RUNNING", "2": "PENDING"})
+
+    assert cache.state("1") == "RUNNING"
+    assert cache.state("2") == "PENDING"  # newly watched: polled once more, for both jobs
+    assert calls(fake_slurm, "squeue")[-1].endswith("--jobs 1,2")
+    polls = len(calls(fake_slurm, "squeue"))
+
+    set_states(fake_slurm, "squeue", {"1": "COMPLETING", "2": "RUNNING"})
+    assert cache.state("1") == "RUNNING" and cache.state("2") == "PENDING"  # within the ttl
+    assert len(calls(fake_slurm, "squeue")) == polls
+
+    time.sleep(0.35)
+    assert cache.state("2") == "RUNNING"
+    assert len(calls(fake_slurm, "squeue")) == polls + 1
+
+    # finished jobs are answered from the cache and no longer polled
+    set_states(fake_slurm, "squeue", {"2": "RUNNING"})
+    set_states(fake_slurm, "sacct", {"1": "COMPLETED"})
+    time.sleep(0.35)
+    assert cache.state("1") == "COMPLETED"
+    time.sleep(0.35)
+    cache.state("2")
+    assert calls(fake_slurm, "squeue")[-1].endswith("--jobs 2")
+
+
+def park(root: str, name: str, lane: str = "normal", **model) -> dict:
+    input_dir = os.path.join(root, "predictions", name)
+    os.makedirs(input_dir)
+    job_metadata = {"job_id": f"job_for_{name}", "dataset_id": "Dataset001_Test", "input_dir": input_dir,
+                    "requester_id": "tester", "lane": lane, "submitted_at": time.time(), **model}
+    prediction_slurm.park(job_metadata, lane, job_timeout="3h")
+    return job_metadata
+
+
+def test_flush_batches_parked_requests_per_model(fake_slurm, monkeypatch):
+    monkeypatch.setattr(settings, "SLURM_BATCH_MAX_REQUESTS", 2)
+    monkeypatch.setattr(settings, "SLURM_BATCH_WINDOW_SEC", 3600.0)
+    for i in range(3):
+        park(fake_slurm, f"req_{i:03d}")
+    park(fake_slurm, "req_003", folds=[0])
+
+    assert prediction_slurm.flush() == []  # the batching window is still open
+    job_ids = prediction_slurm.flush(force=True)
+
+    executor = job_executor.get_executor()
+    batches = sorted(sorted(os.path.basename(m["input_dir"]) for m in executor.record(job_id)["args"][0])
+                     for job_id in job_ids)
+    assert batches == [["req_000", "req_001"], ["req_002"], ["req_003"]]
+    assert len(calls(fake_slurm, "sbatch")) == 3
+    assert prediction_slurm.parked(["normal"]) == []
+
+    with open(os.path.join(fake_slurm, "predictions", "req_002", "state.json")) as f:
+        assert json.load(f)["rq_job_id"] in job_ids
+    assert prediction_slurm.submitted_counts(0.0) == {"normal": 4}
+
+
+def test_interactive_lane_is_flushed_right_away(fake_slurm, monkeypatch):
+    monkeypatch.setattr(settings, "SLURM_BATCH_WINDOW_SEC", 3600.0)
+    park(fake_slurm, "req_000", lane="interactive")
+    park(fake_slurm, "req_001", lane="bulk")
+
+    [job_id] = prediction_slurm.flush()
+    [job_metadata] = job_executor.get_executor().record(job_id)["args"][0]
+    assert job_metadata["lane"] == "interactive"
+    assert len(prediction_slurm.parked(["bulk"])) == 1